@@ -0,0 +1,111 @@
+"""
+Load benchmark for read-heavy endpoints.
+Seeds users + agents directly into the configured db, then fires concurrent requests
+at a running api and reports requests/sec.
+
+Usage (from apps/api, with the api already running against the same db):
+  uv run uvicorn src.server:app --port 8003 &
+  uv run python -m benchmarks.load_endpoints --base-url http://localhost:8003
+"""
+
+import argparse
+import asyncio
+import time
+from uuid import UUID, uuid4
+
+import httpx
+
+from src.db import Session, crud
+from src.db.models import AgentBase, TokenBase, UserBase
+
+
+def seed(num_users: int, agents_per_user: int) -> list[UUID]:
+    user_ids: list[UUID] = []
+    with Session() as session:
+        for i in range(num_users):
+            user = crud.create_user(
+                session,
+                UserBase(dynamic_id=uuid4(), username=f"bench_user_{i}"),
+            )
+            user_ids.append(user.id)
+            for j in range(agents_per_user):
+                token = crud.create_token(
+                    session,
+                    TokenBase(
+                        ticker=f"B{i}_{j}",
+                        name=f"bench token {i} {j}",
+                        evm_contract_address=f"0x{i:020x}{j:020x}",
+                        abi=[],
+                    ),
+                )
+                crud.create_agent(
+                    session,
+                    AgentBase(
+                        owner_id=user.id,
+                        token_id=token.id,
+                        character_json={"name": f"bench_agent_{i}_{j}"},
+                        env_file="FOO=bar\nBAZ=qux",
+                    ),
+                )
+    return user_ids
+
+
+async def hammer(
+    client: httpx.AsyncClient,
+    paths: list[str],
+    concurrency: int,
+    duration: float,
+) -> tuple[int, int]:
+    """
+    Issues requests round-robin over paths from `concurrency` workers for `duration`
+    seconds.
+    Returns (ok, failed).
+    """
+    ok = 0
+    failed = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(offset: int) -> None:
+        nonlocal ok, failed
+        i = offset
+        while time.perf_counter() < deadline:
+            resp = await client.get(paths[i % len(paths)])
+            if resp.status_code == 200:
+                ok += 1
+            else:
+                failed += 1
+            i += 1
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return ok, failed
+
+
+async def run(args: argparse.Namespace) -> None:
+    user_ids = seed(args.users, args.agents_per_user)
+    scenarios: dict[str, list[str]] = {
+        "GET /agents": ["/agents"],
+        "GET /users": [f"/users?user_id={user_id}" for user_id in user_ids],
+    }
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=args.base_url, limits=limits, timeout=30
+    ) as client:
+        for name, paths in scenarios.items():
+            # Warm up connections + caches
+            await hammer(client, paths, args.concurrency, 1)
+            ok, failed = await hammer(client, paths, args.concurrency, args.duration)
+            print(
+                f"{name:<14} {ok / args.duration:>8.1f} req/s "
+                f"({ok} ok, {failed} failed, concurrency={args.concurrency})"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--base-url", default="http://localhost:8003")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--agents-per-user", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10)
+    asyncio.run(run(parser.parse_args()))
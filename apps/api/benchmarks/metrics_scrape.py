@@ -0,0 +1,111 @@
+"""
+Scrape time benchmark for agent liveness metrics.
+Compares per-agent labelled Gauges, which keep a series for every agent ever seen, with
+HeartbeatCollector, which only has series for agents in the heartbeat store.
+Simulates --agents live agents (a tenth of them down) after --churn agents per live
+agent have come and gone, and reports p50/p99 of generating the exposition, and its
+size.
+
+Usage (from apps/api):
+  ENV=dev uv run python -m benchmarks.metrics_scrape
+  ENV=dev uv run python -m benchmarks.metrics_scrape --agents 10000 --churn 5
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from uuid import uuid4
+
+from prometheus_client import CollectorRegistry, Gauge, generate_latest
+
+from src.heartbeats import HEARTBEAT_TIMEOUT, HeartbeatCollector, MemoryHeartbeatStore
+
+
+def measure(registry: CollectorRegistry, iterations: int) -> tuple[float, float, int]:
+    """
+    Returns (p50 ms, p99 ms, bytes)
+    """
+    output = generate_latest(registry)  # warm up
+    timings: list[float] = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        generate_latest(registry)
+        timings.append((time.perf_counter() - start) * 1000)
+    percentiles = statistics.quantiles(timings, n=100)
+    return percentiles[49], percentiles[98], len(output)
+
+
+def labelled_gauges(
+    live: list[str], down: list[str], churned: list[str]
+) -> CollectorRegistry:
+    registry = CollectorRegistry()
+    liveness = Gauge(
+        "agent_liveness_status",
+        "Heartbeat status of agents (1 = alive, 0 = dead)",
+        ["agent_id"],
+        registry=registry,
+    )
+    restarts = Gauge(
+        "agent_restart_timestamp",
+        "Unix timestamp of last restart",
+        ["agent_id"],
+        registry=registry,
+    )
+    now = time.time()
+    # Agents that were stopped or deleted keep their series.
+    for agent_id in churned + down:
+        liveness.labels(agent_id=agent_id).set(0)
+        restarts.labels(agent_id=agent_id).set(now)
+    for agent_id in live:
+        liveness.labels(agent_id=agent_id).set(1)
+    return registry
+
+
+async def collector(live: list[str], down: list[str]) -> CollectorRegistry:
+    store = MemoryHeartbeatStore()
+    now = time.time()
+    await store.beat_many(down, now - 2 * HEARTBEAT_TIMEOUT)
+    await store.expire(now - HEARTBEAT_TIMEOUT / 2)
+    for i, agent_id in enumerate(live):
+        await store.beat(agent_id, now - i % HEARTBEAT_TIMEOUT)
+
+    heartbeat_collector = HeartbeatCollector()
+    start = time.perf_counter()
+    heartbeat_collector.update(*await store.snapshot(), now)
+    print(
+        "Collector update (once per liveness check): "
+        f"{(time.perf_counter() - start) * 1000:.3f} ms"
+    )
+
+    registry = CollectorRegistry()
+    registry.register(heartbeat_collector)
+    return registry
+
+
+def main(args: argparse.Namespace) -> None:
+    agent_ids = [str(uuid4()) for _ in range(args.agents)]
+    num_down = args.agents // 10
+    down, live = agent_ids[:num_down], agent_ids[num_down:]
+    churned = [str(uuid4()) for _ in range(args.agents * args.churn)]
+
+    results = {
+        "labelled gauges": measure(
+            labelled_gauges(live, down, churned), args.iterations
+        ),
+        "heartbeat collector": measure(
+            asyncio.run(collector(live, down)), args.iterations
+        ),
+    }
+
+    print(f"{'metrics':<20} {'p50':>9} {'p99':>9}  (ms) {'size':>10}  (bytes)")
+    for name, (p50, p99, size) in results.items():
+        print(f"{name:<20} {p50:>9.3f} {p99:>9.3f}       {size:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--agents", type=int, default=10_000)
+    parser.add_argument("--churn", type=int, default=5)
+    parser.add_argument("--iterations", type=int, default=50)
+    main(parser.parse_args())
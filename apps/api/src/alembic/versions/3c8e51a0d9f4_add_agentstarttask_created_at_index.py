@@ -0,0 +1,40 @@
+"""Add index on AgentStartTask.created_at
+
+Revision ID: 3c8e51a0d9f4
+Revises: 7a2d94e6c1b3
+Create Date: 2026-10-18 16:40:12.583104
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3c8e51a0d9f4"
+down_revision: Union[str, None] = "7a2d94e6c1b3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # See e41b7c5d8f20 for why concurrently, and if_not_exists.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_agentstarttask_created_at",
+            "agentstarttask",
+            ["created_at"],
+            unique=False,
+            if_not_exists=True,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_agentstarttask_created_at",
+            table_name="agentstarttask",
+            if_exists=True,
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,29 @@
+"""Add reserved_until to Runtime
+
+Revision ID: 5b9f02c7e4a1
+Revises: 3c8e51a0d9f4
+Create Date: 2026-10-18 17:02:11.604937
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "5b9f02c7e4a1"
+down_revision: Union[str, None] = "3c8e51a0d9f4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "runtime",
+        sa.Column("reserved_until", sa.DateTime(timezone=True), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("runtime", "reserved_until")
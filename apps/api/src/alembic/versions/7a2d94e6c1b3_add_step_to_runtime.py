@@ -0,0 +1,34 @@
+"""Add provisioning/teardown step to Runtime
+
+Revision ID: 7a2d94e6c1b3
+Revises: e41b7c5d8f20
+Create Date: 2026-10-18 14:21:45.318207
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "7a2d94e6c1b3"
+down_revision: Union[str, None] = "e41b7c5d8f20"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Existing runtimes were provisioned by the old, blocking create_runtime, so they're
+    # started.
+    op.add_column(
+        "runtime",
+        sa.Column(
+            "step", sa.String(length=32), nullable=False, server_default="STARTED"
+        ),
+    )
+    op.alter_column("runtime", "step", server_default=None)
+
+
+def downgrade() -> None:
+    op.drop_column("runtime", "step")
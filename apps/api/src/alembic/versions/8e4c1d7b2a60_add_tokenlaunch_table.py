@@ -0,0 +1,64 @@
+"""Add TokenLaunch table
+
+Revision ID: 8e4c1d7b2a60
+Revises: d2e7a6b41f93
+Create Date: 2026-10-18 19:12:36.904417
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+import sqlmodel
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "8e4c1d7b2a60"
+down_revision: Union[str, None] = "d2e7a6b41f93"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "tokenlaunch",
+        sa.Column("id", sa.Uuid(), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column(
+            "modified_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=True,
+        ),
+        sa.Column("name", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("ticker", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("owner_id", sa.Uuid(), nullable=False),
+        sa.Column("status", sa.String(length=16), nullable=False),
+        sa.Column("tx_hash", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("nonce", sa.Integer(), nullable=True),
+        sa.Column("token_id", sa.Uuid(), nullable=True),
+        sa.Column("error", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.ForeignKeyConstraint(["owner_id"], ["user.id"]),
+        sa.ForeignKeyConstraint(["token_id"], ["token.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_tokenlaunch_owner_id"), "tokenlaunch", ["owner_id"], unique=False
+    )
+    op.create_index(
+        "ix_tokenlaunch_status_created_at",
+        "tokenlaunch",
+        ["status", "created_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_tokenlaunch_status_created_at", table_name="tokenlaunch")
+    op.drop_index(op.f("ix_tokenlaunch_owner_id"), table_name="tokenlaunch")
+    op.drop_table("tokenlaunch")
@@ -0,0 +1,50 @@
+"""Add (created_at, id) indexes for keyset pagination
+
+Revision ID: 9d3f6a1c2b7e
+Revises: 4ae322b296e4
+Create Date: 2026-10-18 10:12:41.530218
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "9d3f6a1c2b7e"
+down_revision: Union[str, None] = "4ae322b296e4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (index name, table), of (created_at, id) indexes.
+INDEXES: list[tuple[str, str]] = [
+    ("ix_agent_created_at_id", "agent"),
+    ("ix_runtime_created_at_id", "runtime"),
+    ("ix_token_created_at_id", "token"),
+    ("ix_user_created_at_id", "user"),
+]
+
+
+def upgrade() -> None:
+    # See e41b7c5d8f20 for why concurrently. A failed build leaves an invalid index
+    # behind, which makes a rerun fail. Drop it and rerun.
+    with op.get_context().autocommit_block():
+        for name, table in INDEXES:
+            op.create_index(
+                name,
+                table,
+                ["created_at", "id"],
+                unique=False,
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table in reversed(INDEXES):
+            op.drop_index(
+                name,
+                table_name=table,
+                if_exists=True,
+                postgresql_concurrently=True,
+            )
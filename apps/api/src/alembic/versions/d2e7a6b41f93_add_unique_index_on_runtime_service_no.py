@@ -0,0 +1,56 @@
+"""Add unique index on Runtime.service_no
+
+Revision ID: d2e7a6b41f93
+Revises: 5b9f02c7e4a1
+Create Date: 2026-10-18 17:48:30.271945
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy.sql import text
+
+# revision identifiers, used by Alembic.
+revision: str = "d2e7a6b41f93"
+down_revision: Union[str, None] = "5b9f02c7e4a1"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # See e41b7c5d8f20 for why concurrently.
+    # Fails if runtimes already share a service number. Delete the duplicates first.
+    with op.get_context().autocommit_block():
+        # A failed concurrent build leaves an invalid index behind, which doesn't
+        # enforce uniqueness. Drop it so that it's built again.
+        conn = op.get_bind()
+        stmt = text(
+            "SELECT 1 FROM pg_index "
+            "JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+            "WHERE pg_class.relname = 'ix_runtime_service_no' "
+            "AND NOT pg_index.indisvalid"
+        )
+        if conn.execute(stmt).first() is not None:
+            op.drop_index(
+                "ix_runtime_service_no",
+                table_name="runtime",
+                postgresql_concurrently=True,
+            )
+        op.create_index(
+            "ix_runtime_service_no",
+            "runtime",
+            ["service_no"],
+            unique=True,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_runtime_service_no",
+            table_name="runtime",
+            if_exists=True,
+            postgresql_concurrently=True,
+        )
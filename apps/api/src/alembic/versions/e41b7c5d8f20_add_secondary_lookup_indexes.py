@@ -0,0 +1,79 @@
+"""Add indexes for hot lookup columns
+
+Revision ID: e41b7c5d8f20
+Revises: 9d3f6a1c2b7e
+Create Date: 2026-10-18 11:02:17.204811
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e41b7c5d8f20"
+down_revision: Union[str, None] = "9d3f6a1c2b7e"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (index name, table, columns)
+INDEXES: list[tuple[str, str, list[str]]] = [
+    ("ix_agent_owner_id", "agent", ["owner_id"]),
+    ("ix_agent_runtime_id", "agent", ["runtime_id"]),
+    ("ix_wallet_public_key", "wallet", ["public_key"]),
+    ("ix_wallet_chain_public_key", "wallet", ["chain", "public_key"]),
+    ("ix_wallet_owner_id", "wallet", ["owner_id"]),
+    ("ix_token_evm_contract_address", "token", ["evm_contract_address"]),
+    (
+        "ix_agentstarttask_agent_id_created_at",
+        "agentstarttask",
+        ["agent_id", "created_at"],
+    ),
+    (
+        "ix_agentstarttask_runtime_id_created_at",
+        "agentstarttask",
+        ["runtime_id", "created_at"],
+    ),
+    (
+        "ix_runtimecreatetask_runtime_id_created_at",
+        "runtimecreatetask",
+        ["runtime_id", "created_at"],
+    ),
+    (
+        "ix_runtimeupdatetask_runtime_id_created_at",
+        "runtimeupdatetask",
+        ["runtime_id", "created_at"],
+    ),
+    (
+        "ix_runtimedeletetask_runtime_id_created_at",
+        "runtimedeletetask",
+        ["runtime_id", "created_at"],
+    ),
+]
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY doesn't lock out writes, but can't run inside a
+    # transaction. if_not_exists: a failed concurrent build leaves an invalid index
+    # behind. Drop it and rerun.
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(
+                name,
+                table,
+                columns,
+                unique=False,
+                if_not_exists=True,
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(
+                name,
+                table_name=table,
+                if_exists=True,
+                postgresql_concurrently=True,
+            )
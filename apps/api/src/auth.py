@@ -2,7 +2,12 @@
 Handles JWT-based authentication and authorization with FastAPI and Dynamic.
 """
 
+import asyncio
+import hashlib
+import time
 from collections.abc import Callable
+from dataclasses import dataclass
+from functools import cache
 from typing import Annotated, Any
 from uuid import UUID
 import os
@@ -13,7 +18,9 @@ from fastapi.security.http import HTTPAuthorizationCredentials
 from jwt import PyJWK, PyJWKClient, PyJWT
 from jwt.exceptions import PyJWTError
 
-from src.db import Session, crud
+from src import logger
+from src.cache import TTLCache
+from src.db import AsyncSession, async_crud
 from src.db.models import User, Wallet
 from src.utils import obj_or_404
 
@@ -39,9 +46,20 @@ if not dynamic_environment_id:
 uri = (
     f"https://app.dynamicauth.com/api/v0/sdk/{dynamic_environment_id}/.well-known/jwks"
 )
+# Seconds between background refreshes of the JWKS.
+JWKS_REFRESH_INTERVAL = int(os.getenv("JWKS_REFRESH_INTERVAL", 300))
+# Signing keys are cached per kid. A kid miss refetches the JWKS inline (key rotation).
+# The jwk set itself outlives the refresh interval, so requests don't pay for the fetch.
 pyjwk_client: PyJWKClient = PyJWKClient(
     uri=uri,
     headers={"User-Agent": "AidenBackend"},
+    cache_keys=True,
+    cache_jwk_set=True,
+    lifespan=JWKS_REFRESH_INTERVAL * 2,
+)
+# sha256(token) -> decoded token, expiring at the token's exp.
+decoded_token_cache: TTLCache[str, dict[str, Any]] = TTLCache(
+    maxsize=int(os.getenv("DECODED_TOKEN_CACHE_SIZE", 4096))
 )
 
 
@@ -56,6 +74,36 @@ def decode_bearer_token(jwt_token: str) -> dict[str, Any]:
     return py_jwt.decode_complete(jwt_token, signing_key, leeway=10)
 
 
+def decode_bearer_token_cached(jwt_token: str) -> dict[str, Any]:
+    """
+    decode_bearer_token, but skips verification for tokens that have already been
+    verified and haven't expired.
+    raises:
+      jwt.exceptions.PyJWTError if the token is invalid
+    """
+    key = hashlib.sha256(jwt_token.encode()).hexdigest()
+    if (decoded_token := decoded_token_cache.get(key)) is not None:
+        return decoded_token
+
+    decoded_token = decode_bearer_token(jwt_token)
+    exp = (decoded_token.get("payload") or {}).get("exp")
+    if isinstance(exp, (int, float)):
+        decoded_token_cache.set(key, decoded_token, expires_at=exp)
+    return decoded_token
+
+
+async def refresh_jwks_periodically() -> None:
+    """
+    Refetches the JWKS in the background so that requests never block on it.
+    """
+    while True:
+        try:
+            await asyncio.to_thread(pyjwk_client.get_jwk_set, True)
+        except Exception as e:
+            logger.warning(f"Failed to refresh JWKS: {e}")
+        await asyncio.sleep(JWKS_REFRESH_INTERVAL)
+
+
 # This guy basically just checks for Authorization header.
 auth_scheme = HTTPBearer(
     bearerFormat="",
@@ -66,42 +114,150 @@ auth_scheme = HTTPBearer(
 TokenDepends = Annotated[HTTPAuthorizationCredentials | None, Security(auth_scheme)]
 
 
+def decode_jwt_payload(token: TokenDepends) -> dict[str, Any] | None:
+    """
+    Standard JWTs contains the aud, iss, sub, iat, and exp fields.
+    Dynamic adds the fields email, environment_id, given_name, family_name, lists,
+    verified_credentials, verified_accounts. See
+    https://docs.dynamic.xyz/authentication-methods/auth-tokens
+    Every auth dependency goes through this one, so FastAPI's dependency cache decodes
+    the JWT once per request.
+    params:
+    token (HTTPAuthorizationCredentials): JWT token
+    returns:
+    payload (dict | None): user credentials details if token is provided
+    raises:
+    HTTPException with status code 401 unauthorized
+    """
+    if not token:
+        return None
+    try:
+        decoded_token = decode_bearer_token_cached(token.credentials)
+    except PyJWTError:
+        raise HTTPException(detail="Failed to decode token", status_code=401)
+
+    payload: dict[str, Any] | None = decoded_token.get("payload")
+    if not payload:
+        raise HTTPException(
+            detail="Expected payload in token",
+            status_code=401,
+        )
+
+    return payload
+
+
+# Cached so that every Security(parse_jwt(...)) refers to the same dependency.
+@cache
 def parse_jwt(required: bool = True):
-    def parse_jwt_helper(token: TokenDepends) -> dict[str, Any] | None:
+    def parse_jwt_helper(
+        payload: Annotated[dict[str, Any] | None, Security(decode_jwt_payload)],
+    ) -> dict[str, Any] | None:
         """
-        Standard JWTs contains the aud, iss, sub, iat, and exp fields.
-        Dynamic adds the fields email, environment_id, given_name, family_name, lists, verified_credentials, verified_accounts.
-        See https://docs.dynamic.xyz/authentication-methods/auth-tokens
         params:
-        token (HTTPAuthorizationCredentials): JWT token
+        payload (dict | None): decoded JWT payload
         returns:
         payload (dict | None): user credentials details if token is provided
         raises:
-        HTTPException with status code 401 unauthorized
+        HTTPException with status code 401 unauthorized if required and no token was
+        provided
         """
-        if not token:
-            if required:
-                raise HTTPException(detail="No token was provided", status_code=401)
-            return None
-        try:
-            decoded_token = decode_bearer_token(token.credentials)
-        except PyJWTError:
-            raise HTTPException(detail="Failed to decode token", status_code=401)
+        if not payload and required:
+            raise HTTPException(detail="No token was provided", status_code=401)
+        return payload
 
-        payload: dict[str, Any] | None = decoded_token.get("payload")
-        if not payload:
-            raise HTTPException(
-                detail="Expected payload in token",
-                status_code=401,
+    return parse_jwt_helper
+
+
+@dataclass
+class Identity:
+    """
+    The user and wallets that a JWT resolves to.
+    """
+
+    user: User | None
+    wallets: list[Wallet]
+    addresses: frozenset[str]
+
+
+# Short-lived, since it's per process and invalidation doesn't reach other api replicas.
+IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", 5))
+# str(sub) -> Identity
+identity_cache: TTLCache[str, Identity] = TTLCache(
+    maxsize=int(os.getenv("IDENTITY_CACHE_SIZE", 4096))
+)
+
+
+def invalidate_identity(dynamic_id: UUID | None = None) -> None:
+    """
+    Drops the cached identity for a user, or every cached identity if dynamic_id is
+    None. Call after mutating users (by dynamic_id) or wallets (all, since wallets can
+    change owners).
+    """
+    if dynamic_id is None:
+        identity_cache.clear()
+    else:
+        identity_cache.pop(str(dynamic_id))
+
+
+async def resolve_identity(
+    payload: Annotated[dict[str, Any] | None, Security(decode_jwt_payload)],
+) -> Identity | None:
+    """
+    Resolves the user (by sub) and wallets (by verified credential addresses) of a JWT.
+    Shared by every auth dependency, so it runs once per request.
+    Costs one query for the user and their wallets, plus one batched query for addresses
+    that aren't the user's own.
+    """
+    if not payload:
+        return None
+
+    subject = payload.get("sub")
+    credentials: list[dict[str, Any]] = payload.get("verified_credentials") or []
+    addresses = frozenset(
+        address for credential in credentials if (address := credential.get("address"))
+    )
+    cache_key = str(subject)
+    if (identity := identity_cache.get(cache_key)) and identity.addresses == addresses:
+        return identity
+
+    try:
+        dynamic_id: UUID | None = UUID(subject)
+    except (TypeError, ValueError):
+        dynamic_id = None
+
+    async with AsyncSession() as session:
+        user: User | None = None
+        if dynamic_id:
+            user = await async_crud.get_user_by_dynamic_id(session, dynamic_id)
+
+        owned = {wallet.public_key: wallet for wallet in user.wallets} if user else {}
+        wallets: list[Wallet] = [
+            owned[address] for address in addresses if address in owned
+        ]
+        # For now, assume the wallet already exists
+        if unowned := [address for address in addresses if address not in owned]:
+            wallets.extend(
+                await async_crud.get_wallets_by_public_keys(session, unowned)
             )
 
-        return payload
+    identity = Identity(user=user, wallets=wallets, addresses=addresses)
+    # Don't cache misses - the user is probably about to be created.
+    if user and IDENTITY_CACHE_TTL > 0:
+        identity_cache.set(
+            cache_key, identity, expires_at=time.time() + IDENTITY_CACHE_TTL
+        )
+    return identity
 
-    return parse_jwt_helper
+
+IdentityDepends = Annotated[Identity | None, Security(resolve_identity)]
 
 
+@cache
 def get_user_from_token(required: bool = True):
-    def get_user_helper(payload: Annotated[dict[str, Any] | None, Security(parse_jwt(required))]) -> User | None:
+    async def get_user_helper(
+        payload: Annotated[dict[str, Any] | None, Security(parse_jwt(required))],
+        identity: IdentityDepends,
+    ) -> User | None:
         """
         Retrieve a user using their JWT
         params:
@@ -109,28 +265,27 @@ def get_user_from_token(required: bool = True):
         returns:
         user (User | None | 404)
         """
-        if not payload:
+        if not payload or not identity:
             if required:
                 raise HTTPException(detail="No token was provided", status_code=401)
             return None
-        subject = payload.get("sub")
-        if not subject:
+        if not payload.get("sub"):
             raise ValueError()
-        dynamic_user_id: UUID = UUID(subject)
 
-        with Session() as session:
-            user = crud.get_user_by_dynamic_id(session, dynamic_id=dynamic_user_id)
-            if required:
-                user = obj_or_404(user, User)
+        user = identity.user
+        if required:
+            user = obj_or_404(user, User)
 
         return user
 
     return get_user_helper
 
 
+@cache
 def get_wallets_from_token(required: bool = True):
-    def get_wallets_helper(
+    async def get_wallets_helper(
         payload: Annotated[dict[str, Any] | None, Security(parse_jwt(required))],
+        identity: IdentityDepends,
     ) -> list[Wallet] | None:
         """
         Retrieve a wallet based on its JWT
@@ -139,31 +294,17 @@ def get_wallets_from_token(required: bool = True):
         raises:
         HTTPException with status code 401 unauthorized
         """
-        if not payload:
+        if not payload or not identity:
             if required:
                 raise HTTPException(detail="No token was provided", status_code=401)
             return None
-        credentials: list[dict[str, Any]] | None = payload.get("verified_credentials")
-        if not credentials:
+        if not identity.addresses:
             raise HTTPException(
                 detail="No verified credentials in token",
                 status_code=401,
             )
-        addresses: list[str] = []
-        for credential in credentials:
-            if address := credential.get("address"):
-                addresses.append(address)
-        # For now, assume the wallet already exists
-
-        wallets: list[Wallet] = []
-        with Session() as session:
-            for address in addresses:
-                # Not going to throw a 404 here cuz it's hacky af any how.
-                wallet = crud.get_wallet_by_public_key_hack(session, address)
-                if wallet:
-                    wallets.append(wallet)
-
-        return wallets
+        # Not going to throw a 404 for missing wallets here cuz it's hacky af any how.
+        return identity.wallets
 
     return get_wallets_helper
 
@@ -219,6 +360,7 @@ def get_is_admin(
     scopes = set(payload.get("lists", []))
     return "admin" in scopes
 
+
 IsAdminDepends = Annotated[bool, Security(get_is_admin)]
 
 
@@ -229,8 +371,10 @@ def get_is_admin_or_owner(
     """
     Optional security, does not throw if no token
     """
+
     def helper(maybe_id: UUID) -> bool:
         return is_admin or (user is not None and maybe_id == user.id)
+
     return helper
 
 IsAdminOrOwnerDepends = Annotated[Callable[[UUID], bool], Security(get_is_admin_or_owner)]
\ No newline at end of file
@@ -0,0 +1,175 @@
+"""
+Keeps a warm pool of idle runtimes, so that starting an agent doesn't wait on
+provisioning one.
+
+The target pool size follows demand: enough idle runtimes to cover the agent starts
+expected while a replacement is provisioned, estimated from an EWMA of the agent start
+rate, within [AUTOSCALER_MIN_IDLE, AUTOSCALER_MAX_IDLE].
+Scaling up counts runtimes already provisioning. Scaling down only happens after the
+pool has been above target (plus a margin) for a while, and one runtime at a time, so
+that bursts don't cause create/delete thrash.
+
+Runs in every api process, but replicas take turns ticking (see Ticker), so they don't
+scale the pool concurrently.
+"""
+
+import math
+import os
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta, timezone
+from typing import Any
+from uuid import UUID
+
+from prometheus_client import Counter, Gauge
+from redis import asyncio as aioredis
+
+from src import logger
+from src.db import AsyncSession, async_crud
+from src.tick_lock import Ticker
+
+AUTOSCALER_MIN_IDLE = int(
+    os.getenv("AUTOSCALER_MIN_IDLE", os.getenv("RUNTIME_IDLE_POOL_SIZE", 2))
+)
+AUTOSCALER_MAX_IDLE = int(os.getenv("AUTOSCALER_MAX_IDLE", 10))
+# Roughly how long a runtime takes to provision, i.e. how far ahead the pool has to
+# cover starts.
+RUNTIME_PROVISION_SECONDS = int(os.getenv("RUNTIME_PROVISION_SECONDS", 5 * 60))
+AUTOSCALER_INTERVAL = 30
+# Outlasts the delete task being picked up, which takes the runtime out of the pool.
+SCALE_DOWN_LEASE = timedelta(hours=1)
+# Time constant of the start rate EWMA, in seconds.
+START_RATE_WINDOW = 15 * 60
+# Runtimes created per tick at most, so a bad estimate can't provision a fleet at once.
+MAX_CREATES_PER_TICK = 3
+# Scale down only once the pool has been more than SCALE_DOWN_MARGIN above target for
+# this many consecutive ticks.
+SCALE_DOWN_MARGIN = 1
+SCALE_DOWN_TICKS = 10
+
+target_idle_gauge = Gauge(
+    "runtime_autoscaler_target_idle", "Idle runtimes the autoscaler aims for"
+)
+idle_gauge = Gauge(
+    "runtime_autoscaler_idle", "Idle runtimes at the last autoscaler tick"
+)
+provisioning_gauge = Gauge(
+    "runtime_autoscaler_provisioning",
+    "Provisioning runtimes at the last autoscaler tick",
+)
+start_rate_gauge = Gauge(
+    "runtime_autoscaler_start_rate", "EWMA of agent starts per minute"
+)
+decisions_counter = Counter(
+    "runtime_autoscaler_decisions_total",
+    "Runtimes created/deleted by the autoscaler",
+    ["action"],
+)
+
+
+def target_idle(start_rate: float) -> int:
+    """
+    start_rate: agent starts per second.
+    """
+    expected_starts = math.ceil(start_rate * RUNTIME_PROVISION_SECONDS)
+    return min(AUTOSCALER_MIN_IDLE + expected_starts, AUTOSCALER_MAX_IDLE)
+
+
+class RuntimeAutoscaler(Ticker):
+    """
+    Ticks every AUTOSCALER_INTERVAL seconds, or right away after a miss.
+    """
+
+    def __init__(
+        self,
+        create_runtime: Callable[[], Awaitable[Any]],
+        delete_runtime: Callable[[UUID], Awaitable[Any]],
+        lock_client: aioredis.Redis | None = None,
+    ) -> None:
+        super().__init__(lock_client, "runtime-autoscaler", AUTOSCALER_INTERVAL)
+        self.create_runtime = create_runtime
+        self.delete_runtime = delete_runtime
+        # Agent starts per second.
+        self.start_rate = 0.0
+        self.excess_ticks = 0
+        # Starts turned away for lack of an idle runtime since the last tick.
+        self.missed_starts = 0
+        self._last_tick: datetime | None = None
+
+    def observe_starts(self, starts: int, elapsed: float) -> None:
+        """
+        Folds starts over the last elapsed seconds into the start rate.
+        """
+        if elapsed <= 0:
+            return
+        alpha = 1 - math.exp(-elapsed / START_RATE_WINDOW)
+        self.start_rate += alpha * (starts / elapsed - self.start_rate)
+
+    def decide(self, idle: int, provisioning: int) -> int:
+        """
+        Returns how many runtimes to create (> 0) or delete (< 0).
+        """
+        target = target_idle(self.start_rate)
+        target_idle_gauge.set(target)
+
+        deficit = target - (idle + provisioning)
+        if deficit > 0:
+            self.excess_ticks = 0
+            return min(deficit, MAX_CREATES_PER_TICK)
+
+        if idle > target + SCALE_DOWN_MARGIN:
+            self.excess_ticks += 1
+            if self.excess_ticks >= SCALE_DOWN_TICKS:
+                self.excess_ticks = 0
+                return -1
+        else:
+            self.excess_ticks = 0
+        return 0
+
+    def miss(self) -> None:
+        """
+        Called when a start found no idle runtime. Counts as demand, and ticks right
+        away.
+        """
+        self.missed_starts += 1
+        self.wake()
+
+    async def _tick(self) -> None:
+        now = datetime.now(timezone.utc)
+        since = self._last_tick or now - timedelta(seconds=AUTOSCALER_INTERVAL)
+        async with AsyncSession() as session:
+            starts = await async_crud.count_agent_start_tasks(session, since)
+            idle_runtimes = await async_crud.get_runtimes(
+                session, unused=True, limit=AUTOSCALER_MAX_IDLE + SCALE_DOWN_MARGIN + 1
+            )
+            provisioning = await async_crud.count_provisioning_runtimes(session)
+        self._last_tick = now
+        starts, self.missed_starts = starts + self.missed_starts, 0
+        self.observe_starts(starts, (now - since).total_seconds())
+
+        idle = len(idle_runtimes)
+        start_rate_gauge.set(self.start_rate * 60)
+        idle_gauge.set(idle)
+        provisioning_gauge.set(provisioning)
+
+        change = self.decide(idle, provisioning)
+        if change > 0:
+            logger.info(
+                f"[autoscaler] {idle} idle, {provisioning} provisioning. "
+                f"Creating {change} runtime(s)"
+            )
+            for _ in range(change):
+                await self.create_runtime()
+            decisions_counter.labels("create").inc(change)
+        elif change < 0:
+            # Reserved the way an agent start claims a runtime, so that a start can't
+            # claim it while it's being deleted. The newest one, so that runtimes that
+            # have been healthy for a while are kept.
+            async with AsyncSession() as session:
+                runtime = await async_crud.claim_idle_runtime(
+                    session, SCALE_DOWN_LEASE, newest=True
+                )
+            if runtime is None:
+                return
+            logger.info(f"[autoscaler] {idle} idle. Deleting runtime {runtime.id}")
+            await self.delete_runtime(runtime.id)
+            decisions_counter.labels("delete").inc()
@@ -1,11 +1,15 @@
 import os
-from typing import cast
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, cast
 
 import boto3
+from botocore.credentials import RefreshableCredentials
+from botocore.session import get_session as get_botocore_session
 from fastapi import HTTPException
 from mypy_boto3_ecs.client import ECSClient
 from mypy_boto3_elbv2.client import ElasticLoadBalancingv2Client as ELBv2Client
-from mypy_boto3_elbv2.type_defs import RuleConditionTypeDef
+from mypy_boto3_elbv2.type_defs import ActionTypeDef, RuleConditionTypeDef
 
 from src import logger
 from src.models import AWSConfig
@@ -54,27 +58,96 @@ def get_aws_config(num: int) -> AWSConfig:
     )
 
 
+ROLE_ARN = "arn:aws:iam::008971649127:role/AidenAPI"
+
+# The role session and its clients are built once per process, and shared by its tasks
+# (and their threads - boto3 clients, unlike sessions, are thread-safe). Forked children
+# (celery's prefork pool) start over, rather than sharing their parent's connections.
+_role_session: boto3.Session | None = None
+_clients: dict[str, Any] = {}
+_role_session_lock = threading.Lock()
+
+
+def assume_role() -> dict[str, str]:
+    """
+    Assumes the AidenAPI role using your user permissions.
+    Returns its credentials, in the form RefreshableCredentials takes.
+    """
+    sts_client = boto3.client("sts")
+    resp = sts_client.assume_role(RoleArn=ROLE_ARN, RoleSessionName="AidenAPI")
+    credentials = resp["Credentials"]
+    return {
+        "access_key": credentials["AccessKeyId"],
+        "secret_key": credentials["SecretAccessKey"],
+        "token": credentials["SessionToken"],
+        "expiry_time": credentials["Expiration"].isoformat(),
+    }
+
+
 def get_role_session() -> boto3.Session:
     """
     Gets the AidenAPI role session.
     """
-    if os.getenv("ENV") == "dev":
-        # If dev, assume the role using your user permissions
-        sts_client = boto3.client("sts")
-        role_arn = "arn:aws:iam::008971649127:role/AidenAPI"
-        resp = sts_client.assume_role(RoleArn=role_arn, RoleSessionName="AidenAPI")
-
-        credentials = resp["Credentials"]
-        assumed_role_session = boto3.Session(
-            aws_access_key_id=credentials["AccessKeyId"],
-            aws_secret_access_key=credentials["SecretAccessKey"],
-            aws_session_token=credentials["SessionToken"],
-        )
-    else:
-        # Otherwise, on staging and dev, the ECS task itself will manage permissions
-        assumed_role_session = boto3.Session()
+    global _role_session
+    with _role_session_lock:
+        if _role_session is not None:
+            return _role_session
+
+        if os.getenv("ENV") == "dev":
+            # If dev, assume the role. botocore assumes it again shortly before it
+            # expires.
+            botocore_session = get_botocore_session()
+            # botocore has no public way to give a session refreshable credentials.
+            botocore_session._credentials = (  # type: ignore[attr-defined]
+                RefreshableCredentials.create_from_metadata(
+                    metadata=assume_role(),
+                    refresh_using=assume_role,
+                    method="sts-assume-role",
+                )
+            )
+            _role_session = boto3.Session(botocore_session=botocore_session)
+        else:
+            # Otherwise, on staging and prod, the ECS task itself will manage
+            # permissions (and refresh them).
+            _role_session = boto3.Session()
+        return _role_session
+
+
+def _get_client(service_name: str) -> Any:
+    session = get_role_session()
+    with _role_session_lock:
+        if (client := _clients.get(service_name)) is None:
+            client = session.client(service_name)  # type: ignore[call-overload]
+            _clients[service_name] = client
+        return client
+
+
+def get_ecs_client() -> ECSClient:
+    return cast(ECSClient, _get_client("ecs"))
+
 
-    return assumed_role_session
+def get_elbv2_client() -> ELBv2Client:
+    return cast(ELBv2Client, _get_client("elbv2"))
+
+
+def reset_role_session() -> None:
+    """
+    Drops the role session and its clients. The next get_* builds them again.
+    """
+    global _role_session
+    with _role_session_lock:
+        _role_session = None
+        _clients.clear()
+
+
+def _reset_role_session_after_fork() -> None:
+    global _role_session_lock
+    # The parent may have forked while another of its threads held the lock.
+    _role_session_lock = threading.Lock()
+    reset_role_session()
+
+
+os.register_at_fork(after_in_child=_reset_role_session_after_fork)
 
 
 def create_http_target_group(
@@ -107,11 +180,14 @@ def create_listener_rules(
     host_header_pattern: str,
     target_group_arn: str,
     priority: int,
-):
+) -> tuple[str, str]:
     """
-    Creates an HTTP and HTTPS Rule.
+    Creates an HTTP and HTTPS Rule, concurrently.
     HTTP Rule redirects to HTTPS
     HTTPS Rule forwards to the specified target group.
+    A rule that already exists for the host (e.g. from an interrupted attempt) is kept,
+    rather than created again with a clashing priority.
+    Returns their ARNs.
     """
     conditions = cast(
         list[RuleConditionTypeDef],
@@ -122,10 +198,8 @@ def create_listener_rules(
             }
         ],
     )  # Type hints appear to be off here. create_rule is not recognizing this as a list of RuleConditionTypeDef
-    http_rule = elbv2_client.create_rule(
-        ListenerArn=http_listener_arn,
-        Conditions=conditions,
-        Actions=[
+    actions: dict[str, list[ActionTypeDef]] = {
+        http_listener_arn: [
             {
                 "Type": "redirect",
                 "RedirectConfig": {
@@ -135,23 +209,30 @@ def create_listener_rules(
                 },
             },
         ],
-        Priority=priority,
-    )
-
-    https_rule = elbv2_client.create_rule(
-        ListenerArn=https_listener_arn,
-        Conditions=conditions,
-        Actions=[
+        https_listener_arn: [
             {
                 "Type": "forward",
                 "TargetGroupArn": target_group_arn,
             },
         ],
-        Priority=priority,
-    )
+    }
 
-    http_rule_arn = http_rule["Rules"][0]["RuleArn"]
-    https_rule_arn = https_rule["Rules"][0]["RuleArn"]
+    def find_or_create(listener_arn: str) -> str:
+        rule_arn = find_listener_rule(elbv2_client, listener_arn, host_header_pattern)
+        if rule_arn is not None:
+            return rule_arn
+        rule = elbv2_client.create_rule(
+            ListenerArn=listener_arn,
+            Conditions=conditions,
+            Actions=actions[listener_arn],
+            Priority=priority,
+        )
+        return rule["Rules"][0]["RuleArn"]
+
+    with ThreadPoolExecutor(2) as pool:
+        http_rule_arn, https_rule_arn = pool.map(
+            find_or_create, (http_listener_arn, https_listener_arn)
+        )
     return http_rule_arn, https_rule_arn
 
 
@@ -214,11 +295,16 @@ def create_runtime_service(
     security_groups: list[str],
     subnets: list[str],
     target_group_arn: str,
+    task_definition_revision: int | None = None,
 ) -> str:
-    latest_task_revision = get_latest_task_definition_revision(
-        ecs_client, task_definition_arn
-    )
-    latest_task_definition_arn = f"{task_definition_arn}:{latest_task_revision}"
+    """
+    task_definition_revision: Defaults to the latest.
+    """
+    if task_definition_revision is None:
+        task_definition_revision = get_latest_task_definition_revision(
+            ecs_client, task_definition_arn
+        )
+    latest_task_definition_arn = f"{task_definition_arn}:{task_definition_revision}"
 
     service = ecs_client.create_service(
         cluster=cluster,
@@ -243,3 +329,67 @@ def create_runtime_service(
     )
 
     return service["service"]["serviceArn"]
+
+
+def find_target_group(elbv2_client: ELBv2Client, target_group_name: str) -> str | None:
+    """
+    Returns the ARN of the target group with this name, if it exists.
+    """
+    try:
+        resp = elbv2_client.describe_target_groups(Names=[target_group_name])
+    except elbv2_client.exceptions.TargetGroupNotFoundException:
+        return None
+    return resp["TargetGroups"][0]["TargetGroupArn"]
+
+
+def find_listener_rule(
+    elbv2_client: ELBv2Client,
+    listener_arn: str,
+    host_header_pattern: str,
+) -> str | None:
+    """
+    Returns the ARN of the listener's rule for this host (see create_listener_rules), if
+    it exists.
+    """
+    paginator = elbv2_client.get_paginator("describe_rules")
+    return next(
+        (
+            rule["RuleArn"]
+            for page in paginator.paginate(ListenerArn=listener_arn)
+            for rule in page["Rules"]
+            for condition in rule.get("Conditions", [])
+            if condition.get("Field") == "host-header"
+            and host_header_pattern in condition.get("Values", [])
+        ),
+        None,
+    )
+
+
+def get_service_status(
+    ecs_client: ECSClient,
+    cluster: str,
+    service_name: str,
+) -> str | None:
+    """
+    Returns the status of the service (ACTIVE, DRAINING or INACTIVE), or None if it
+    doesn't exist.
+    """
+    resp = ecs_client.describe_services(cluster=cluster, services=[service_name])
+    if not resp["services"]:
+        return None
+    return resp["services"][0]["status"]
+
+
+def find_service(
+    ecs_client: ECSClient,
+    cluster: str,
+    service_name: str,
+) -> str | None:
+    """
+    Returns the ARN of the active service with this name, if it exists.
+    """
+    resp = ecs_client.describe_services(cluster=cluster, services=[service_name])
+    for service in resp["services"]:
+        if service["status"] == "ACTIVE":
+            return service["serviceArn"]
+    return None
@@ -0,0 +1,53 @@
+"""
+Small in-process caches.
+"""
+
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from threading import Lock
+
+
+class TTLCache[K: Hashable, V]:
+    """
+    Bounded LRU cache where every entry carries its own absolute expiry (unix time).
+    Thread-safe, since sync dependencies/handlers run in FastAPI's threadpool.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: K) -> V | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: K, value: V, expires_at: float) -> None:
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: K) -> V | None:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
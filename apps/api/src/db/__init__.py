@@ -1,5 +1,5 @@
 import src  # noqa
 
-from .setup import Session, init_db
+from .setup import AsyncSession, Session, init_db
 
-__all__ = ["Session", "init_db"]
+__all__ = ["AsyncSession", "Session", "init_db"]
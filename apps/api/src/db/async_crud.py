@@ -0,0 +1,641 @@
+"""
+Async mirror of crud.py for use in the api's request handlers.
+Relationships can't be lazy loaded from async code, so functions returning models whose
+relationships are read afterwards (e.g. agent_to_agent_public, user_to_user_public) take
+a loading profile from crud.py, defaulting to one that eagerly loads them.
+"""
+
+from collections.abc import Callable, Sequence
+from datetime import datetime, timedelta, timezone
+from typing import TypeVar
+from uuid import UUID
+
+from sqlalchemy import exists, func, literal, union_all, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import text
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .crud import (
+    AGENT_WITH_RUNTIME_AND_TOKEN,
+    USER_WITH_WALLETS,
+    LoadProfile,
+    is_unused_runtime,
+)
+from .models import (
+    Agent,
+    AgentBase,
+    AgentStartTask,
+    AgentStartTaskBase,
+    AgentUpdate,
+    Base,
+    Runtime,
+    RuntimeBase,
+    RuntimeCreateTask,
+    RuntimeCreateTaskBase,
+    RuntimeDeleteTask,
+    RuntimeDeleteTaskBase,
+    RuntimeStep,
+    RuntimeUpdate,
+    RuntimeUpdateTask,
+    RuntimeUpdateTaskBase,
+    TEARDOWN_STEPS,
+    Token,
+    TokenBase,
+    TokenLaunch,
+    TokenLaunchBase,
+    TokenLaunchStatus,
+    TokenLaunchUpdate,
+    User,
+    UserBase,
+    UserUpdate,
+    Wallet,
+    WalletBase,
+    WalletUpdate,
+)
+from .pagination import Cursor, keyset_page
+
+M = TypeVar("M", bound=Base)
+
+# Attempts at a free service number before giving up, when racing concurrent creates.
+SERVICE_NO_ATTEMPTS = 5
+
+
+# region Generics
+async def create_generic(session: AsyncSession, model: M) -> M:
+    session.add(model)
+    await session.commit()
+    await session.refresh(model)
+    return model
+
+
+async def update_generic(session: AsyncSession, model: M, model_update: Base) -> M:
+    fields_payload = model_update.model_dump(exclude_unset=True)
+    model.sqlmodel_update(fields_payload)
+    session.add(model)
+    await session.commit()
+    await session.refresh(model)
+
+    return model
+
+
+async def delete_generic(session: AsyncSession, model: Base) -> None:
+    await session.delete(model)
+    await session.commit()
+    return None
+
+
+# endregion Generics
+
+
+# region Users
+async def create_user(session: AsyncSession, user: UserBase) -> User:
+    return await create_generic(session, User(**user.model_dump()))
+
+
+async def update_user(
+    session: AsyncSession, user: User, user_update: UserUpdate
+) -> User:
+    return await update_generic(session, user, user_update)
+
+
+async def delete_user(session: AsyncSession, user: User) -> None:
+    return await delete_generic(session, user)
+
+
+async def get_user(
+    session: AsyncSession,
+    user_id: UUID,
+    load: LoadProfile = USER_WITH_WALLETS,
+) -> User | None:
+    stmt = select(User).where(User.id == user_id).options(*load)
+    return (await session.exec(stmt)).unique().first()
+
+
+async def get_user_by_dynamic_id(
+    session: AsyncSession,
+    dynamic_id: UUID,
+    load: LoadProfile = USER_WITH_WALLETS,
+) -> User | None:
+    """
+    By default, joins the user's wallets in, so that auth resolves both in one round
+    trip.
+    """
+    stmt = select(User).where(User.dynamic_id == dynamic_id).options(*load)
+    return (await session.exec(stmt)).unique().first()
+
+
+async def get_user_by_public_key(
+    session: AsyncSession,
+    public_key: str,
+    chain: str = "EVM",
+) -> User | None:
+    wallet = await get_wallet_by_public_key(session, public_key, chain)
+    if wallet:
+        return await get_user(session, wallet.owner_id)
+    return None
+
+
+async def get_users(
+    session: AsyncSession, cursor: Cursor | None = None, limit: int = 100
+) -> Sequence[User]:
+    stmt = keyset_page(select(User), User, cursor, limit)
+    return (await session.scalars(stmt)).all()
+
+
+# endregion Users
+# region Agents
+async def create_agent(session: AsyncSession, agent: AgentBase) -> Agent:
+    created = await create_generic(session, Agent(**agent.model_dump()))
+    await session.refresh(created, ["runtime", "token"])
+    return created
+
+
+async def update_agent(
+    session: AsyncSession, agent: Agent, agent_update: AgentUpdate
+) -> Agent:
+    updated = await update_generic(session, agent, agent_update)
+    await session.refresh(updated, ["runtime", "token"])
+    return updated
+
+
+async def get_agents(
+    session: AsyncSession,
+    cursor: Cursor | None = None,
+    limit: int = 100,
+    load: LoadProfile = AGENT_WITH_RUNTIME_AND_TOKEN,
+) -> Sequence[Agent]:
+    stmt = keyset_page(select(Agent).options(*load), Agent, cursor, limit)
+    return (await session.scalars(stmt)).unique().all()
+
+
+async def get_agents_by_user_id(
+    session: AsyncSession,
+    user_id: UUID,
+    load: LoadProfile = AGENT_WITH_RUNTIME_AND_TOKEN,
+) -> Sequence[Agent]:
+    stmt = select(Agent).where(Agent.owner_id == user_id).options(*load)
+    return (await session.scalars(stmt)).unique().all()
+
+
+async def get_agent(
+    session: AsyncSession,
+    agent_id: UUID,
+    load: LoadProfile = AGENT_WITH_RUNTIME_AND_TOKEN,
+) -> Agent | None:
+    stmt = select(Agent).where(Agent.id == agent_id).options(*load)
+    return (await session.exec(stmt)).unique().first()
+
+
+async def delete_agent(session: AsyncSession, agent: Agent) -> None:
+    return await delete_generic(session, agent)
+
+
+# endregion Agents
+# region Wallets
+
+
+async def create_wallet(session: AsyncSession, wallet: WalletBase) -> Wallet:
+    return await create_generic(session, Wallet(**wallet.model_dump()))
+
+
+async def update_wallet(
+    session: AsyncSession,
+    wallet: Wallet,
+    wallet_update: WalletUpdate,
+) -> Wallet:
+    return await update_generic(session, wallet, wallet_update)
+
+
+async def get_wallet(session: AsyncSession, wallet_id: UUID) -> Wallet | None:
+    stmt = select(Wallet).where(Wallet.id == wallet_id)
+    return (await session.exec(stmt)).first()
+
+
+async def get_wallets_by_owner(
+    session: AsyncSession, owner_id: UUID
+) -> Sequence[Wallet]:
+    stmt = select(Wallet).where(Wallet.owner_id == owner_id)
+    return (await session.exec(stmt)).all()
+
+
+async def get_wallet_by_public_key_hack(
+    session: AsyncSession,
+    public_key: str,
+) -> Wallet | None:
+    """
+    TODO: Remove and replace with identification w/ address + chain
+    """
+    stmt = select(Wallet).where(Wallet.public_key == public_key)
+    return (await session.exec(stmt)).first()
+
+
+async def get_wallets_by_public_keys(
+    session: AsyncSession,
+    public_keys: Sequence[str],
+) -> Sequence[Wallet]:
+    """
+    Batched get_wallet_by_public_key_hack.
+    """
+    if not public_keys:
+        return []
+    stmt = select(Wallet).where(col(Wallet.public_key).in_(public_keys))
+    return (await session.exec(stmt)).all()
+
+
+async def get_wallet_by_public_key(
+    session: AsyncSession,
+    public_key: str,
+    chain: str = "EVM",
+) -> Wallet | None:
+    stmt = (
+        select(Wallet)
+        .where(Wallet.chain == chain)
+        .where(Wallet.public_key == public_key)
+    )
+    return (await session.exec(stmt)).first()
+
+
+async def delete_wallet(session: AsyncSession, wallet: Wallet) -> None:
+    return await delete_generic(session, wallet)
+
+
+# endregion Wallets
+# region Runtimes
+
+
+async def get_free_service_no(session: AsyncSession) -> int:
+    """
+    Returns the lowest service number no runtime has.
+    The gaps are found by an anti-join on ix_runtime_service_no, so no runtimes are
+    loaded.
+    """
+    taken = aliased(Runtime)
+    candidates = union_all(
+        select(literal(1).label("service_no")).where(
+            ~exists().where(col(Runtime.service_no) == 1)
+        ),
+        select((col(Runtime.service_no) + 1).label("service_no")).where(
+            ~exists().where(col(taken.service_no) == col(Runtime.service_no) + 1)
+        ),
+    ).subquery()
+    return (await session.exec(select(func.min(candidates.c.service_no)))).one()
+
+
+async def create_runtime(
+    session: AsyncSession, runtime_for: Callable[[int], RuntimeBase]
+) -> Runtime | None:
+    """
+    Creates a runtime with the lowest free service number.
+    runtime_for: Makes the runtime for a service number.
+    A concurrent create can take the same number first, in which case the unique index
+    on service_no rejects this one, and the next free number is tried.
+    Returns None if every attempt lost such a race.
+    """
+    for _ in range(SERVICE_NO_ATTEMPTS):
+        runtime = runtime_for(await get_free_service_no(session))
+        try:
+            return await create_generic(session, Runtime(**runtime.model_dump()))
+        except IntegrityError:
+            await session.rollback()
+    return None
+
+
+async def get_runtime(session: AsyncSession, runtime_id: UUID) -> Runtime | None:
+    stmt = select(Runtime).where(Runtime.id == runtime_id)
+    return (await session.exec(stmt)).first()
+
+
+async def get_runtimes(
+    session: AsyncSession,
+    unused: bool = False,
+    cursor: Cursor | None = None,
+    limit: int = 100,
+) -> Sequence[Runtime]:
+    """
+    unused: Only runtimes that are free to start an agent on. See
+    crud.is_unused_runtime.
+    """
+    stmt = select(Runtime)
+    if unused:
+        stmt = stmt.where(is_unused_runtime(datetime.now(timezone.utc)))
+    stmt = keyset_page(stmt, Runtime, cursor, limit)
+
+    return (await session.scalars(stmt)).all()
+
+
+async def claim_idle_runtime(
+    session: AsyncSession, lease: timedelta, newest: bool = False
+) -> Runtime | None:
+    """
+    Reserves the oldest (or newest) unused runtime for lease, and returns it. None if
+    there is none.
+    Concurrent claims lock their candidate row and skip rows locked by others, so they
+    get different runtimes rather than waiting on, or double-booking, the same one.
+    (sqlite has no row locks, but runs the UPDATE atomically, which is as good.)
+    """
+    now = datetime.now(timezone.utc)
+    candidate = (
+        select(Runtime.id)
+        .where(is_unused_runtime(now))
+        .order_by(
+            *(
+                (col(Runtime.created_at).desc(), col(Runtime.id).desc())
+                if newest
+                else (col(Runtime.created_at), col(Runtime.id))
+            )
+        )
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    stmt = (
+        update(Runtime)
+        .where(col(Runtime.id).in_(candidate))
+        .values(reserved_until=now + lease)
+        .returning(Runtime)
+    )
+    runtime = (await session.scalars(stmt)).one_or_none()
+    await session.commit()
+    return runtime
+
+
+async def release_runtime(session: AsyncSession, runtime: Runtime) -> None:
+    """
+    Ends the reservation runtime was claimed with, unless it has lapsed and been claimed
+    since.
+    """
+    stmt = (
+        update(Runtime)
+        .where(col(Runtime.id) == runtime.id)
+        .where(col(Runtime.reserved_until) == runtime.reserved_until)
+        .values(reserved_until=None)
+    )
+    await session.execute(stmt)
+    await session.commit()
+
+
+async def count_provisioning_runtimes(session: AsyncSession) -> int:
+    """
+    Runtimes that are neither started nor being torn down.
+    """
+    stmt = (
+        select(func.count())
+        .select_from(Runtime)
+        .where(col(Runtime.step).not_in([RuntimeStep.STARTED, *TEARDOWN_STEPS]))
+    )
+    return (await session.exec(stmt)).one()
+
+
+async def update_runtime(
+    session: AsyncSession, runtime: Runtime, runtime_update: RuntimeUpdate
+) -> Runtime:
+    return await update_generic(session, runtime, runtime_update)
+
+
+async def delete_runtime(session: AsyncSession, runtime: Runtime) -> None:
+    return await delete_generic(session, runtime)
+
+
+# endregion Runtimes
+# region Tokens
+async def create_token(session: AsyncSession, token: TokenBase) -> Token:
+    return await create_generic(session, Token(**token.model_dump()))
+
+
+async def get_tokens(
+    session: AsyncSession, cursor: Cursor | None = None, limit: int = 100
+) -> Sequence[Token]:
+    stmt = keyset_page(select(Token), Token, cursor, limit)
+    return (await session.scalars(stmt)).all()
+
+
+async def get_token(session: AsyncSession, token_id: UUID) -> Token | None:
+    stmt = select(Token).where(Token.id == token_id)
+    return (await session.exec(stmt)).first()
+
+
+async def get_tokens_by_ids(
+    session: AsyncSession, token_ids: Sequence[UUID]
+) -> Sequence[Token]:
+    """
+    Batched get_token.
+    """
+    if not token_ids:
+        return []
+    stmt = select(Token).where(col(Token.id).in_(token_ids))
+    return (await session.exec(stmt)).all()
+
+
+async def get_token_by_address(
+    session: AsyncSession, token_address: str
+) -> Token | None:
+    stmt = select(Token).where(Token.evm_contract_address == token_address)
+    return (await session.exec(stmt)).first()
+
+
+async def delete_token(session: AsyncSession, token: Token) -> None:
+    return await delete_generic(session, token)
+
+
+# endregion Tokens
+# region Token launches
+
+
+async def create_token_launch(
+    session: AsyncSession, launch: TokenLaunchBase
+) -> TokenLaunch:
+    return await create_generic(session, TokenLaunch(**launch.model_dump()))
+
+
+async def get_token_launch(
+    session: AsyncSession, launch_id: UUID
+) -> TokenLaunch | None:
+    stmt = select(TokenLaunch).where(TokenLaunch.id == launch_id)
+    return (await session.exec(stmt)).first()
+
+
+async def update_token_launch(
+    session: AsyncSession, launch: TokenLaunch, launch_update: TokenLaunchUpdate
+) -> TokenLaunch:
+    return await update_generic(session, launch, launch_update)
+
+
+async def get_pending_token_launches(
+    session: AsyncSession, limit: int
+) -> Sequence[TokenLaunch]:
+    """
+    Oldest first. Includes launches whose transaction hasn't been sent (yet), so that
+    ones that never are time out.
+    """
+    stmt = (
+        select(TokenLaunch)
+        .where(TokenLaunch.status == TokenLaunchStatus.PENDING)
+        .order_by(col(TokenLaunch.created_at))
+        .limit(limit)
+    )
+    return (await session.exec(stmt)).all()
+
+
+async def finalize_token_launch(
+    session: AsyncSession,
+    launch_id: UUID,
+    token: TokenBase | None = None,
+    error: str | None = None,
+) -> bool:
+    """
+    Ends a pending launch: successfully, creating its token, or with an error. In one
+    transaction, so that a launch never succeeds without its token.
+    Returns False if the launch wasn't pending anymore, e.g. another watcher finalized
+    it first.
+    """
+    token_id = None
+    if token is not None:
+        token_row = Token(**token.model_dump())
+        session.add(token_row)
+        await session.flush()
+        token_id = token_row.id
+    stmt = (
+        update(TokenLaunch)
+        .where(col(TokenLaunch.id) == launch_id)
+        .where(col(TokenLaunch.status) == TokenLaunchStatus.PENDING)
+        .values(
+            status=TokenLaunchStatus.FAILURE
+            if token is None
+            else TokenLaunchStatus.SUCCESS,
+            token_id=token_id,
+            error=error,
+        )
+    )
+    if (await session.execute(stmt)).rowcount == 0:  # type: ignore
+        await session.rollback()
+        return False
+    await session.commit()
+    return True
+
+
+# endregion Token launches
+
+
+# region Tasks
+async def get_task(session: AsyncSession, task_id: UUID) -> dict[str, str] | None:
+    query = text("""
+        SELECT task_id, status FROM celery_taskmeta WHERE task_id = :task_id
+        """).bindparams(task_id=str(task_id))
+    result = (await session.execute(query)).mappings().first()
+
+    return dict(result) if result else None
+
+
+async def create_agent_start_task(
+    session: AsyncSession,
+    agent_start_task: AgentStartTaskBase,
+) -> AgentStartTask:
+    return await create_generic(
+        session, AgentStartTask(**agent_start_task.model_dump())
+    )
+
+
+async def get_agent_start_task(
+    session: AsyncSession,
+    agent_id: UUID | None = None,
+    runtime_id: UUID | None = None,
+) -> AgentStartTask | None:
+    """
+    Returns the most recent task where agent_id and/or runtime_id match.
+    """
+    if not agent_id and not runtime_id:
+        raise ValueError("Must provide at least one of agent_id or runtime_id")
+
+    stmt = select(AgentStartTask)
+    if agent_id is not None:
+        stmt = stmt.where(AgentStartTask.agent_id == agent_id)
+    if runtime_id is not None:
+        stmt = stmt.where(AgentStartTask.runtime_id == runtime_id)
+    stmt = stmt.order_by(col(AgentStartTask.created_at).desc())
+
+    return (await session.exec(stmt)).first()
+
+
+async def count_agent_start_tasks(session: AsyncSession, since: datetime) -> int:
+    """
+    Agent start tasks created at or after since.
+    """
+    stmt = (
+        select(func.count())
+        .select_from(AgentStartTask)
+        .where(col(AgentStartTask.created_at) >= since)
+    )
+    return (await session.exec(stmt)).one()
+
+
+async def create_runtime_create_task(
+    session: AsyncSession,
+    runtime_create_task: RuntimeCreateTaskBase,
+) -> RuntimeCreateTask:
+    return await create_generic(
+        session, RuntimeCreateTask(**runtime_create_task.model_dump())
+    )
+
+
+async def create_runtime_update_task(
+    session: AsyncSession,
+    runtime_update_task: RuntimeUpdateTaskBase,
+) -> RuntimeUpdateTask:
+    return await create_generic(
+        session, RuntimeUpdateTask(**runtime_update_task.model_dump())
+    )
+
+
+async def create_runtime_delete_task(
+    session: AsyncSession,
+    runtime_delete_task: RuntimeDeleteTaskBase,
+) -> RuntimeDeleteTask:
+    return await create_generic(
+        session, RuntimeDeleteTask(**runtime_delete_task.model_dump())
+    )
+
+
+async def get_runtime_create_task(
+    session: AsyncSession, runtime_id: UUID
+) -> RuntimeCreateTask | None:
+    """
+    Returns the latest create task for a given runtime_id
+    """
+    stmt = (
+        select(RuntimeCreateTask)
+        .where(RuntimeCreateTask.runtime_id == runtime_id)
+        .order_by(col(RuntimeCreateTask.created_at).desc())
+    )
+    return (await session.exec(stmt)).first()
+
+
+async def get_runtime_update_task(
+    session: AsyncSession, runtime_id: UUID
+) -> RuntimeUpdateTask | None:
+    """
+    Returns the latest update task for a given runtime_id
+    """
+    stmt = (
+        select(RuntimeUpdateTask)
+        .where(RuntimeUpdateTask.runtime_id == runtime_id)
+        .order_by(col(RuntimeUpdateTask.created_at).desc())
+    )
+    return (await session.exec(stmt)).first()
+
+
+async def get_runtime_delete_task(
+    session: AsyncSession, runtime_id: UUID
+) -> RuntimeDeleteTask | None:
+    """
+    Returns the latest delete task for a given runtime_id
+    """
+    stmt = (
+        select(RuntimeDeleteTask)
+        .where(RuntimeDeleteTask.runtime_id == runtime_id)
+        .order_by(col(RuntimeDeleteTask.created_at).desc())
+    )
+    return (await session.exec(stmt)).first()
+
+
+# endregion Tasks
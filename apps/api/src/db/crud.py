@@ -1,8 +1,24 @@
 from collections.abc import Sequence
-from typing import TypeVar
+from datetime import datetime, timezone
+from typing import NamedTuple, TypeVar
 from uuid import UUID
-from sqlalchemy import ScalarResult
-from sqlalchemy.sql import text
+from sqlalchemy import (
+    ColumnElement,
+    ScalarResult,
+    String,
+    and_,
+    case,
+    cast,
+    exists,
+    func,
+    literal,
+    or_,
+    union_all,
+    update,
+)
+from sqlalchemy.orm import joinedload
+from sqlalchemy.sql import column, table, text
+from sqlalchemy.sql.base import ExecutableOption
 from sqlmodel import Session, col, select
 
 from .models import (
@@ -18,6 +34,7 @@ from .models import (
     RuntimeCreateTaskBase,
     RuntimeDeleteTask,
     RuntimeDeleteTaskBase,
+    RuntimeStep,
     RuntimeUpdate,
     RuntimeUpdateTask,
     RuntimeUpdateTaskBase,
@@ -30,10 +47,28 @@ from .models import (
     WalletBase,
     WalletUpdate,
 )
+from .pagination import Cursor, keyset_page
 
 M = TypeVar("M", bound=Base)
 
 
+# region Loading profiles
+# Loader options for relationships that are read after a query, e.g. by
+# agent_to_agent_public. Without them, every relationship access on every row is its own
+# lazy SELECT (N+1).
+type LoadProfile = Sequence[ExecutableOption]
+
+LAZY: LoadProfile = ()
+# Many-to-one, so joining them in keeps a page of agents to a single query.
+AGENT_WITH_RUNTIME_AND_TOKEN: LoadProfile = (
+    joinedload(Agent.runtime),  # type: ignore[arg-type]
+    joinedload(Agent.token),  # type: ignore[arg-type]
+)
+USER_WITH_WALLETS: LoadProfile = (joinedload(User.wallets),)  # type: ignore[arg-type]
+
+# endregion Loading profiles
+
+
 # region Generics
 def create_generic(session: Session, model: M) -> M:
     session.add(model)
@@ -74,14 +109,22 @@ def delete_user(session: Session, user: User) -> None:
     return delete_generic(session, user)
 
 
-def get_user(session: Session, user_id: UUID) -> User | None:
-    stmt = select(User).where(User.id == user_id)
-    return session.exec(stmt).first()
+def get_user(
+    session: Session,
+    user_id: UUID,
+    load: LoadProfile = LAZY,
+) -> User | None:
+    stmt = select(User).where(User.id == user_id).options(*load)
+    return session.exec(stmt).unique().first()
 
 
-def get_user_by_dynamic_id(session: Session, dynamic_id: UUID) -> User | None:
-    stmt = select(User).where(User.dynamic_id == dynamic_id)
-    return session.exec(stmt).first()
+def get_user_by_dynamic_id(
+    session: Session,
+    dynamic_id: UUID,
+    load: LoadProfile = LAZY,
+) -> User | None:
+    stmt = select(User).where(User.dynamic_id == dynamic_id).options(*load)
+    return session.exec(stmt).unique().first()
 
 
 def get_user_by_public_key(
@@ -95,8 +138,10 @@ def get_user_by_public_key(
     return None
 
 
-def get_users(session: Session, skip: int = 0, limit: int = 100) -> Sequence[User]:
-    stmt = select(User).offset(skip).limit(limit)
+def get_users(
+    session: Session, cursor: Cursor | None = None, limit: int = 100
+) -> Sequence[User]:
+    stmt = keyset_page(select(User), User, cursor, limit)
     return session.scalars(stmt).all()
 
 
@@ -110,19 +155,32 @@ def update_agent(session: Session, agent: Agent, agent_update: AgentUpdate) -> A
     return update_generic(session, agent, agent_update)
 
 
-def get_agents(session: Session, skip: int = 0, limit: int = 100) -> Sequence[Agent]:
-    stmt = select(Agent).offset(skip).limit(limit)
-    return session.scalars(stmt).all()
+def get_agents(
+    session: Session,
+    cursor: Cursor | None = None,
+    limit: int = 100,
+    load: LoadProfile = LAZY,
+) -> Sequence[Agent]:
+    stmt = keyset_page(select(Agent).options(*load), Agent, cursor, limit)
+    return session.scalars(stmt).unique().all()
 
 
-def get_agents_by_user_id(session: Session, user_id: UUID) -> Sequence[Agent]:
-    stmt = select(Agent).where(Agent.owner_id == user_id)
-    return session.scalars(stmt).all()
+def get_agents_by_user_id(
+    session: Session,
+    user_id: UUID,
+    load: LoadProfile = LAZY,
+) -> Sequence[Agent]:
+    stmt = select(Agent).where(Agent.owner_id == user_id).options(*load)
+    return session.scalars(stmt).unique().all()
 
 
-def get_agent(session: Session, agent_id: UUID) -> Agent | None:
-    stmt = select(Agent).where(Agent.id == agent_id)
-    return session.exec(stmt).first()
+def get_agent(
+    session: Session,
+    agent_id: UUID,
+    load: LoadProfile = LAZY,
+) -> Agent | None:
+    stmt = select(Agent).where(Agent.id == agent_id).options(*load)
+    return session.exec(stmt).unique().first()
 
 
 def delete_agent(session: Session, agent: Agent) -> None:
@@ -196,24 +254,35 @@ def get_runtime(session: Session, runtime_id: UUID) -> Runtime | None:
     return session.exec(stmt).first()
 
 
+def is_unused_runtime(now: datetime) -> ColumnElement[bool]:
+    """
+    Runtimes that are up (not provisioning or being torn down), have no agent, and
+    aren't reserved for an agent that is starting on them (see
+    async_crud.claim_idle_runtime).
+    """
+    return and_(
+        col(Runtime.step) == RuntimeStep.STARTED,
+        ~exists().where(col(Agent.runtime_id) == Runtime.id),
+        or_(
+            col(Runtime.reserved_until) == None,  # noqa: E711
+            col(Runtime.reserved_until) <= now,
+        ),
+    )
+
+
 def get_runtimes(
     session: Session,
     unused: bool = False,
-    skip: int = 0,
+    cursor: Cursor | None = None,
     limit: int = 100,
 ) -> ScalarResult[Runtime]:
+    """
+    unused: Only runtimes that are free to start an agent on. See is_unused_runtime.
+    """
     stmt = select(Runtime)
     if unused:
-        stmt = (
-            stmt
-            .outerjoin(Agent)
-            .where(Agent.runtime_id == None)
-        )
-    stmt = (
-        stmt
-        .offset(skip)
-        .limit(limit)
-    )
+        stmt = stmt.where(is_unused_runtime(datetime.now(timezone.utc)))
+    stmt = keyset_page(stmt, Runtime, cursor, limit)
 
     return session.scalars(stmt)
 
@@ -224,6 +293,80 @@ def update_runtime(
     return update_generic(session, runtime, runtime_update)
 
 
+def advance_runtime(
+    session: Session, runtime: Runtime, runtime_update: RuntimeUpdate
+) -> bool:
+    """
+    Applies runtime_update (typically moving the runtime to its next step) only if the
+    runtime is still at runtime.step in the db, i.e. no other task has moved it on in
+    the meantime.
+    Returns whether it was applied. runtime is refreshed either way.
+    """
+    stmt = (
+        update(Runtime)
+        .where(col(Runtime.id) == runtime.id)
+        .where(col(Runtime.step) == runtime.step)
+        .values(**runtime_update.model_dump(exclude_unset=True))
+    )
+    result = session.execute(stmt)
+    session.commit()
+    session.refresh(runtime)
+    # An UPDATE's result is a CursorResult, which has it.
+    return result.rowcount == 1  # type: ignore[attr-defined]
+
+
+def get_started_runtimes_with_agents(
+    session: Session,
+) -> Sequence[tuple[Runtime, Agent | None]]:
+    """
+    All started runtimes, each with the agent running on it (if any), in one query.
+    """
+    stmt = (
+        select(Runtime, Agent)
+        .outerjoin(Agent, col(Agent.runtime_id) == Runtime.id)
+        .where(Runtime.step == RuntimeStep.STARTED)
+    )
+    return session.exec(stmt).all()
+
+
+def record_healthchecks(
+    session: Session,
+    healthy_ids: Sequence[UUID],
+    unhealthy_ids: Sequence[UUID],
+    checked_at: datetime,
+) -> dict[UUID, int]:
+    """
+    Records a healthcheck of many runtimes in one UPDATE: healthy runtimes get
+    last_healthcheck and a reset failure count, unhealthy ones an incremented failure
+    count.
+    Runtimes that left STARTED in the meantime (i.e. are being torn down) are left
+    alone.
+    Returns the updated failure count of each recorded runtime.
+    """
+    if not healthy_ids and not unhealthy_ids:
+        return {}
+    healthy = col(Runtime.id).in_(healthy_ids)
+    stmt = (
+        update(Runtime)
+        .where(col(Runtime.id).in_([*healthy_ids, *unhealthy_ids]))
+        .where(col(Runtime.step) == RuntimeStep.STARTED)
+        .values(
+            last_healthcheck=case(
+                (healthy, checked_at), else_=Runtime.last_healthcheck
+            ),
+            failed_healthchecks=case(
+                (healthy, 0), else_=col(Runtime.failed_healthchecks) + 1
+            ),
+        )
+        .returning(col(Runtime.id), col(Runtime.failed_healthchecks))
+    )
+    failed_healthchecks = {
+        runtime_id: failures for runtime_id, failures in session.execute(stmt)
+    }
+    session.commit()
+    return failed_healthchecks
+
+
 def delete_runtime(session: Session, runtime: Runtime) -> None:
     return delete_generic(session, runtime)
 
@@ -234,8 +377,10 @@ def create_token(session: Session, token: TokenBase) -> Token:
     return create_generic(session, Token(**token.model_dump()))
 
 
-def get_tokens(session: Session, skip: int = 0, limit: int = 100) -> Sequence[Token]:
-    stmt = select(Token).offset(skip).limit(limit)
+def get_tokens(
+    session: Session, cursor: Cursor | None = None, limit: int = 100
+) -> Sequence[Token]:
+    stmt = keyset_page(select(Token), Token, cursor, limit)
     return session.scalars(stmt).all()
 
 
@@ -362,4 +507,75 @@ def get_runtime_delete_task(
     return session.exec(stmt).first()
 
 
+# celery's result table. Created by celery, so it isn't one of our models.
+celery_taskmeta = table(
+    "celery_taskmeta", column("task_id", String), column("status", String)
+)
+RUNTIME_TASKS: dict[
+    str, type[RuntimeCreateTask] | type[RuntimeUpdateTask] | type[RuntimeDeleteTask]
+] = {
+    "create": RuntimeCreateTask,
+    "update": RuntimeUpdateTask,
+    "delete": RuntimeDeleteTask,
+}
+
+
+class LatestRuntimeTask(NamedTuple):
+    kind: str  # Key of RUNTIME_TASKS
+    celery_task_id: UUID
+    # None if celery has no result for the task (yet), e.g. no worker has picked it up.
+    status: str | None
+
+
+def get_latest_runtime_tasks(
+    session: Session, runtime_ids: Sequence[UUID]
+) -> dict[UUID, LatestRuntimeTask]:
+    """
+    Returns the latest create/update/delete task of each runtime that has one, with its
+    celery status, in one query.
+    """
+    if not runtime_ids:
+        return {}
+    tasks = union_all(
+        *(
+            select(
+                literal(kind).label("kind"),
+                col(model.runtime_id).label("runtime_id"),
+                col(model.celery_task_id).label("celery_task_id"),
+                col(model.created_at).label("created_at"),
+            ).where(col(model.runtime_id).in_(runtime_ids))
+            for kind, model in RUNTIME_TASKS.items()
+        )
+    ).subquery()
+    # sqlmodel's select isn't typed for subqueries.
+    ranked = select(  # type: ignore[call-overload]
+        tasks,
+        func.row_number()
+        .over(partition_by=tasks.c.runtime_id, order_by=tasks.c.created_at.desc())
+        .label("rank"),
+    ).subquery()
+    if session.get_bind().dialect.name == "sqlite":
+        # Non-native uuids are stored as hex, without the dashes of celery's task ids.
+        joins_task = (
+            func.replace(celery_taskmeta.c.task_id, "-", "") == ranked.c.celery_task_id
+        )
+    else:
+        joins_task = celery_taskmeta.c.task_id == cast(ranked.c.celery_task_id, String)
+    stmt = (
+        select(
+            ranked.c.runtime_id,
+            ranked.c.kind,
+            ranked.c.celery_task_id,
+            celery_taskmeta.c.status,
+        )
+        .select_from(ranked)
+        .outerjoin(celery_taskmeta, joins_task)
+        .where(ranked.c.rank == 1)
+    )
+    return {
+        runtime_id: LatestRuntimeTask(kind, celery_task_id, status)
+        for runtime_id, kind, celery_task_id, status in session.execute(stmt)
+    }
+
+
 # endregion Tasks
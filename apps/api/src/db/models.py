@@ -1,8 +1,10 @@
 from datetime import datetime
+from enum import Enum
 from typing import Any, Mapping, Optional, cast
 from uuid import UUID, uuid4
 
-from sqlalchemy import JSON, DateTime, func
+from sqlalchemy import JSON, DateTime, Index, func
+from sqlalchemy import Enum as SAEnum
 from sqlmodel import Field, Relationship, SQLModel
 
 
@@ -33,6 +35,7 @@ class WalletBase(Base):
     public_key: str = Field(
         description="Public key",
         nullable=False,
+        index=True,
     )
     chain: str = Field(
         description="Chain the wallet is on",
@@ -49,6 +52,7 @@ class WalletBase(Base):
         foreign_key="user.id",
         description="UUID of the User who owns the wallet.",
         nullable=False,
+        index=True,
     )
 
 
@@ -97,12 +101,14 @@ class AgentBase(Base):
         foreign_key="user.id",
         description="UUID of the User who owns the agent.",
         nullable=False,
+        index=True,
     )
     runtime_id: UUID | None = Field(
         foreign_key="runtime.id",
         description="UUID of the runtime the agent uses.",
         nullable=True,
         default=None,
+        index=True,
     )
     token_id: UUID | None = Field(
         foreign_key="token.id",
@@ -146,15 +152,115 @@ class AgentUpdate(Base):
 class TokenBase(Base):
     ticker: str = Field(description="Token ticker")
     name: str = Field(description="Token name")
-    evm_contract_address: str = Field(description="EVM contract address")
+    evm_contract_address: str = Field(description="EVM contract address", index=True)
     abi: list[dict] = Field(description="EVM contract ABI", sa_type=JSON)
 
 
+class TokenLaunchStatus(str, Enum):
+    # Launch transaction sent, waiting to be mined
+    PENDING = "PENDING"
+    SUCCESS = "SUCCESS"
+    FAILURE = "FAILURE"
+
+
+class TokenLaunchBase(Base):
+    name: str = Field(description="Token name")
+    ticker: str = Field(description="Token ticker")
+    owner_id: UUID = Field(
+        foreign_key="user.id",
+        description="UUID of the User who launched the token.",
+        nullable=False,
+        index=True,
+    )
+    status: TokenLaunchStatus = Field(
+        description="Status of the launch.",
+        nullable=False,
+        default=TokenLaunchStatus.PENDING,
+        sa_type=cast(Any, SAEnum(TokenLaunchStatus, native_enum=False, length=16)),
+    )
+    tx_hash: str | None = Field(
+        description="Hash of the launch transaction, once sent.",
+        nullable=True,
+        default=None,
+    )
+    nonce: int | None = Field(
+        description="Deployer nonce of the launch transaction.",
+        nullable=True,
+        default=None,
+    )
+    token_id: UUID | None = Field(
+        foreign_key="token.id",
+        description="UUID of the launched token, once mined.",
+        nullable=True,
+        default=None,
+    )
+    error: str | None = Field(
+        description="Why the launch failed.", nullable=True, default=None
+    )
+
+
+class TokenLaunchUpdate(Base):
+    status: TokenLaunchStatus | None = Field(
+        description="Status of the launch.", nullable=True, default=None
+    )
+    tx_hash: str | None = Field(
+        description="Hash of the launch transaction.", nullable=True, default=None
+    )
+    nonce: int | None = Field(
+        description="Deployer nonce of the launch transaction.",
+        nullable=True,
+        default=None,
+    )
+    error: str | None = Field(
+        description="Why the launch failed.", nullable=True, default=None
+    )
+
+
+class RuntimeStep(str, Enum):
+    """
+    Provisioning/teardown progress of a runtime. Persisted after every step, so that an
+    interrupted create_runtime/delete_runtime task resumes where it left off.
+    """
+
+    # Provisioning, in order
+    CREATE_TARGET_GROUP = "CREATE_TARGET_GROUP"
+    # Listener rules, then the service
+    CREATE_LISTENER_RULES = "CREATE_LISTENER_RULES"
+    HEALTH_WAIT = "HEALTH_WAIT"
+    STARTED = "STARTED"
+    # Teardown, in order. The row is deleted once done.
+    # The service and listener rules
+    DELETE_SERVICE = "DELETE_SERVICE"
+    SERVICE_DRAINING = "SERVICE_DRAINING"
+    DELETE_TARGET_GROUP = "DELETE_TARGET_GROUP"
+
+
+TEARDOWN_STEPS = frozenset(
+    {
+        RuntimeStep.DELETE_SERVICE,
+        RuntimeStep.SERVICE_DRAINING,
+        RuntimeStep.DELETE_TARGET_GROUP,
+    }
+)
+
+
 class RuntimeBase(Base):
     url: str = Field(description="URL of the agents runtime.")
     service_no: int = Field(
         description="The service number of the runtime.", nullable=False
     )
+    step: RuntimeStep = Field(
+        description="Provisioning/teardown step the runtime is at.",
+        nullable=False,
+        default=RuntimeStep.CREATE_TARGET_GROUP,
+        sa_type=cast(Any, SAEnum(RuntimeStep, native_enum=False, length=32)),
+    )
+    reserved_until: datetime | None = Field(
+        description="End of the runtime's reservation for an agent starting on it.",
+        nullable=True,
+        default=None,
+        sa_type=cast(Any, DateTime(timezone=True)),
+    )
     last_healthcheck: datetime | None = Field(
         description="Datetime of last healthcheck", nullable=True, default=None
     )
@@ -188,8 +294,13 @@ class RuntimeUpdate(Base):
     failed_healthchecks: int = Field(
         description="Number of failed healthchecks.", nullable=False, default=0
     )
-    started: bool | None = Field(
-        description="If the runtime has started. Proxies for a heartbeat.",
+    step: RuntimeStep | None = Field(
+        description="Provisioning/teardown step the runtime is at.",
+        nullable=True,
+        default=None,
+    )
+    reserved_until: datetime | None = Field(
+        description="End of the runtime's reservation for an agent starting on it.",
         nullable=True,
         default=None,
     )
@@ -238,43 +349,78 @@ class RuntimeDeleteTaskBase(Base):
 
 # endregion
 # region Tables
+# Listings are keyset paginated on (created_at, id), see pagination.py.
 
 
 class User(UserBase, MetadataMixin, table=True):
+    __table_args__ = (Index("ix_user_created_at_id", "created_at", "id"),)
+
     agents: list["Agent"] = Relationship(back_populates="owner")
     wallets: list["Wallet"] = Relationship(back_populates="owner")
 
 
 class Wallet(WalletBase, MetadataMixin, table=True):
+    __table_args__ = (Index("ix_wallet_chain_public_key", "chain", "public_key"),)
+
     owner: User = Relationship(back_populates="wallets")
 
 
 class Agent(AgentBase, MetadataMixin, table=True):
+    __table_args__ = (Index("ix_agent_created_at_id", "created_at", "id"),)
+
     owner: User = Relationship(back_populates="agents")
     token: "Token" = Relationship(back_populates="agent")
     runtime: Optional["Runtime"] = Relationship(back_populates="agent")
 
 
 class Token(TokenBase, MetadataMixin, table=True):
+    __table_args__ = (Index("ix_token_created_at_id", "created_at", "id"),)
+
     agent: Optional["Agent"] = Relationship(back_populates="token")
 
 
+class TokenLaunch(TokenLaunchBase, MetadataMixin, table=True):
+    # For the launch watcher's pending launches, see launches.py.
+    __table_args__ = (
+        Index("ix_tokenlaunch_status_created_at", "status", "created_at"),
+    )
+
+
 class Runtime(RuntimeBase, MetadataMixin, table=True):
+    __table_args__ = (
+        Index("ix_runtime_created_at_id", "created_at", "id"),
+        # Service numbers name the runtime's AWS resources and set its listener rule
+        # priority, so they must never be shared. See async_crud.create_runtime.
+        Index("ix_runtime_service_no", "service_no", unique=True),
+    )
+
     agent: Optional["Agent"] = Relationship(back_populates="runtime")
 
 
 # TODO: Add relationships.
+# Indexed for "latest task for agent/runtime" lookups.
 class AgentStartTask(AgentStartTaskBase, MetadataMixin, table=True):
-    pass
+    __table_args__ = (
+        Index("ix_agentstarttask_agent_id_created_at", "agent_id", "created_at"),
+        Index("ix_agentstarttask_runtime_id_created_at", "runtime_id", "created_at"),
+        # For the start rate, see autoscaler.py.
+        Index("ix_agentstarttask_created_at", "created_at"),
+    )
 
 
 class RuntimeCreateTask(RuntimeCreateTaskBase, MetadataMixin, table=True):
-    pass
+    __table_args__ = (
+        Index("ix_runtimecreatetask_runtime_id_created_at", "runtime_id", "created_at"),
+    )
 
 
 class RuntimeUpdateTask(RuntimeUpdateTaskBase, MetadataMixin, table=True):
-    pass
+    __table_args__ = (
+        Index("ix_runtimeupdatetask_runtime_id_created_at", "runtime_id", "created_at"),
+    )
 
 
 class RuntimeDeleteTask(RuntimeDeleteTaskBase, MetadataMixin, table=True):
-    pass
+    __table_args__ = (
+        Index("ix_runtimedeletetask_runtime_id_created_at", "runtime_id", "created_at"),
+    )
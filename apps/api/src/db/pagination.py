@@ -0,0 +1,92 @@
+"""
+Keyset (cursor) pagination over (created_at, id).
+Unlike offset pagination, a page costs the same no matter how deep it is, and rows don't
+shift between pages as others are inserted. Backed by the (created_at, id) indexes on
+each table.
+"""
+
+import base64
+import json
+from collections.abc import Sequence
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Self
+from uuid import UUID
+
+from sqlalchemy import func, literal, tuple_
+from sqlalchemy.orm import aliased
+from sqlmodel import col, select
+from sqlmodel.sql.expression import SelectOfScalar
+
+from .models import MetadataMixin
+
+
+@dataclass(frozen=True)
+class Cursor:
+    """
+    Position after which the next page starts. Opaque to clients.
+    """
+
+    created_at: datetime
+    id: UUID
+
+    @classmethod
+    def after(cls, row: MetadataMixin) -> Self:
+        if row.created_at is None:
+            raise ValueError("Row has not been flushed to the db")
+        return cls(created_at=row.created_at, id=row.id)
+
+    def encode(self) -> str:
+        raw = json.dumps([self.created_at.isoformat(), str(self.id)])
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    @classmethod
+    def decode(cls, token: str) -> Self:
+        """
+        raises:
+          ValueError if the token is not a cursor
+        """
+        try:
+            created_at, id = json.loads(base64.urlsafe_b64decode(token.encode()))
+            return cls(created_at=datetime.fromisoformat(created_at), id=UUID(id))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid cursor {token}") from e
+
+
+def keyset_page[T: MetadataMixin](
+    stmt: SelectOfScalar[T],
+    model: type[T],
+    cursor: Cursor | None,
+    limit: int,
+) -> SelectOfScalar[T]:
+    """
+    Orders stmt by (created_at, id) and restricts it to the page after cursor.
+    """
+    if cursor is not None:
+        # Compare against the stored created_at of the cursor row when it still exists.
+        # Round tripping a timestamp through python isn't exact on every backend (e.g.
+        # sqlite's CURRENT_TIMESTAMP has no fractional seconds, but bound datetimes do).
+        cursor_row = aliased(model)
+        stored_created_at = (
+            select(cursor_row.created_at)
+            .where(cursor_row.id == cursor.id)
+            .scalar_subquery()
+        )
+        stmt = stmt.where(
+            tuple_(col(model.created_at), col(model.id))
+            > tuple_(
+                func.coalesce(stored_created_at, cursor.created_at),
+                literal(cursor.id),
+            )
+        )
+
+    return stmt.order_by(col(model.created_at), col(model.id)).limit(limit)
+
+
+def next_cursor(rows: Sequence[MetadataMixin], limit: int) -> str | None:
+    """
+    Cursor for the page after rows, or None if rows is the last page.
+    """
+    if not rows or len(rows) < limit:
+        return None
+    return Cursor.after(rows[-1]).encode()
@@ -1,10 +1,13 @@
 import logging
 import os
-from contextlib import contextmanager
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager, contextmanager
 
 from sqlalchemy import URL
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlmodel import Session as SQLModelSession
 from sqlmodel import SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession as SQLModelAsyncSession
 
 from src import logger
 
@@ -19,12 +22,21 @@ if (db_password and db_host) and (env == "staging" or env == "prod"):
         host=db_host,
         database="postgres",
     )
+    ASYNC_SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.set(
+        drivername="postgresql+asyncpg"
+    )
     connect_args = {}
 elif env == "dev":
     SQLALCHEMY_DATABASE_URL = URL.create(drivername="sqlite", database="./dev.db")
+    ASYNC_SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.set(
+        drivername="sqlite+aiosqlite"
+    )
     connect_args = {"check_same_thread": False}
 elif env == "test":
     SQLALCHEMY_DATABASE_URL = URL.create(drivername="sqlite", database="./test.db")
+    ASYNC_SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.set(
+        drivername="sqlite+aiosqlite"
+    )
     connect_args = {"check_same_thread": False}
 else:
     raise ValueError("Unknown environment for db. See db/setup.py")
@@ -34,6 +46,19 @@ engine = create_engine(
     connect_args=connect_args,
     pool_pre_ping=True,
 )
+# Used by the api, so that db i/o doesn't block the event loop.
+# Celery tasks are sync, and keep using `engine`.
+async_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL,
+    connect_args=connect_args,
+    pool_pre_ping=True,
+)
+# expire_on_commit=False: attributes can't be lazily refreshed outside of an await.
+async_session_factory = async_sessionmaker(
+    async_engine,
+    class_=SQLModelAsyncSession,
+    expire_on_commit=False,
+)
 
 
 @contextmanager
@@ -45,6 +70,15 @@ def Session():
         session.close()
 
 
+@asynccontextmanager
+async def AsyncSession() -> AsyncIterator[SQLModelAsyncSession]:
+    session = async_session_factory()
+    try:
+        yield session
+    finally:
+        await session.close()
+
+
 def init_db():
     """
     Initializes database tables
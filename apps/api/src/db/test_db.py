@@ -1,18 +1,33 @@
 # from unittest.mock import MagicMock
+import asyncio
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from uuid import UUID, uuid4
 
 import pytest
-from sqlalchemy import inspect
+import pytest_asyncio
+from celery.backends.database.models import Task as CeleryTask
+from sqlalchemy import Connection, Engine, event, insert, inspect
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlmodel.pool import StaticPool
 
+from src.models import agent_to_agent_public
+
+from . import async_crud
 from .crud import (
+    AGENT_WITH_RUNTIME_AND_TOKEN,
     create_agent,
     create_runtime_create_task,
     create_runtime_delete_task,
+    create_runtime,
     create_runtime_update_task,
     create_token,
     create_user,
+    get_agents,
+    get_latest_runtime_tasks,
     get_runtime_create_task,
     get_runtime_delete_task,
     get_runtime_update_task,
@@ -20,10 +35,12 @@ from .crud import (
 from .models import (
     Agent,
     AgentBase,
+    RuntimeBase,
     RuntimeCreateTask,
     RuntimeCreateTaskBase,
     RuntimeDeleteTask,
     RuntimeDeleteTaskBase,
+    RuntimeStep,
     RuntimeUpdateTask,
     RuntimeUpdateTaskBase,
     Token,
@@ -51,6 +68,72 @@ def session():
         engine.dispose()
 
 
+@pytest_asyncio.fixture
+async def async_session(session):
+    """
+    Async session against the same db as `session`, so sync factories can be used for
+    setup.
+    """
+    engine = create_async_engine(
+        "sqlite+aiosqlite:///test.db",
+        connect_args={"check_same_thread": False},
+    )
+    sess = AsyncSession(engine, expire_on_commit=False)
+    try:
+        yield sess
+    finally:
+        await sess.close()
+        await engine.dispose()
+
+
+@contextmanager
+def count_queries(engine: Engine | Connection) -> Iterator[list[str]]:
+    """
+    Collects every statement executed against engine while in the context.
+    """
+    statements: list[str] = []
+
+    def before_cursor_execute(conn, cursor, statement, *args) -> None:
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+@pytest.fixture
+def agent_page_factory(session, user_factory, token_factory, agent_factory):
+    """
+    Creates a page of agents, each with its own token and runtime.
+    """
+
+    def factory(size: int) -> User:
+        owner: User = user_factory(dynamic_id=uuid4())
+        for i in range(size):
+            token = token_factory(
+                ticker=f"T{i}",
+                name=f"token {i}",
+                evm_contract_address=f"0x{i}",
+                abi=[],
+            )
+            runtime = create_runtime(
+                session,
+                RuntimeBase(url=f"https://runtime-{i}", service_no=i),
+            )
+            agent_factory(
+                owner_id=owner.id,
+                token_id=token.id,
+                runtime_id=runtime.id,
+                character_json={},
+                env_file="",
+            )
+        return owner
+
+    return factory
+
+
 @pytest.fixture
 def runtime_create_task_factory(session):
     tasks = []
@@ -282,3 +365,182 @@ def test_runtimes(
     assert gotten_delete_task is not None
     assert gotten_delete_task.runtime_id == delete_task.runtime_id
     assert gotten_delete_task.celery_task_id == delete_task.celery_task_id
+
+
+def test_get_latest_runtime_tasks(session: Session) -> None:
+    engine = session.get_bind()
+    CeleryTask.__table__.create(engine, checkfirst=True)
+    try:
+        updating, deleting, idle = uuid4(), uuid4(), uuid4()
+        created = datetime(2025, 1, 1)
+        tasks: list[
+            tuple[
+                RuntimeCreateTask | RuntimeUpdateTask | RuntimeDeleteTask,
+                int,
+                str | None,
+            ]
+        ] = [
+            # task, minutes after `created`, celery status
+            (
+                RuntimeCreateTask(runtime_id=updating, celery_task_id=uuid4()),
+                0,
+                "SUCCESS",
+            ),
+            (
+                RuntimeUpdateTask(runtime_id=updating, celery_task_id=uuid4()),
+                2,
+                "STARTED",
+            ),
+            (
+                RuntimeDeleteTask(runtime_id=updating, celery_task_id=uuid4()),
+                1,
+                "SUCCESS",
+            ),
+            (
+                RuntimeCreateTask(runtime_id=deleting, celery_task_id=uuid4()),
+                0,
+                "SUCCESS",
+            ),
+            # Published, but no worker has picked it up yet.
+            (RuntimeDeleteTask(runtime_id=deleting, celery_task_id=uuid4()), 1, None),
+        ]
+        for task, minutes, status in tasks:
+            task.created_at = created + timedelta(minutes=minutes)
+            session.add(task)
+            if status:
+                session.execute(
+                    insert(CeleryTask.__table__).values(
+                        task_id=str(task.celery_task_id), status=status
+                    )
+                )
+        session.commit()
+
+        with count_queries(engine) as statements:
+            latest = get_latest_runtime_tasks(session, [updating, deleting, idle])
+        assert len(statements) == 1
+        assert latest.keys() == {updating, deleting}
+        assert latest[updating].kind == "update"
+        assert latest[updating].celery_task_id == tasks[1][0].celery_task_id
+        assert latest[updating].status == "STARTED"
+        assert latest[deleting].kind == "delete"
+        assert latest[deleting].status is None
+    finally:
+        CeleryTask.__table__.drop(engine)
+
+
+@pytest.mark.asyncio
+async def test_create_runtime_service_no(
+    session: Session, async_session: AsyncSession
+) -> None:
+    for service_no in (1, 2, 4):
+        create_runtime(session, RuntimeBase(url="", service_no=service_no))
+    assert await async_crud.get_free_service_no(async_session) == 3
+
+    def runtime_for(service_no: int) -> RuntimeBase:
+        return RuntimeBase(url=f"https://runtime-{service_no}", service_no=service_no)
+
+    # Concurrent creates race for the same numbers, and retry on the ones they lose.
+    sessions = [
+        AsyncSession(async_session.bind, expire_on_commit=False) for _ in range(5)
+    ]
+    try:
+        runtimes = await asyncio.gather(
+            *(async_crud.create_runtime(s, runtime_for) for s in sessions)
+        )
+    finally:
+        await asyncio.gather(*(s.close() for s in sessions))
+    created = [runtime for runtime in runtimes if runtime]
+    assert sorted(runtime.service_no for runtime in created) == [3, 5, 6, 7, 8]
+    assert all(runtime.url.endswith(str(runtime.service_no)) for runtime in created)
+
+
+@pytest.mark.asyncio
+async def test_claim_idle_runtime(
+    session: Session, async_session: AsyncSession
+) -> None:
+    runtimes = [
+        create_runtime(
+            session, RuntimeBase(url="", service_no=i, step=RuntimeStep.STARTED)
+        )
+        for i in range(3)
+    ]
+    # sqlite's timestamps are in seconds.
+    for i, runtime in enumerate(runtimes):
+        runtime.created_at = datetime(2025, 1, 1, i)
+        session.add(runtime)
+    session.commit()
+    runtime_ids = [runtime.id for runtime in runtimes]
+    lease = timedelta(minutes=1)
+
+    oldest = await async_crud.claim_idle_runtime(async_session, lease)
+    newest = await async_crud.claim_idle_runtime(async_session, lease, newest=True)
+    assert oldest and oldest.id == runtime_ids[0]
+    assert newest and newest.id == runtime_ids[-1]
+    # Claimed ones are skipped until their lease runs out.
+    claimed = await async_crud.claim_idle_runtime(async_session, lease, newest=True)
+    assert claimed and claimed.id == runtime_ids[1]
+    assert await async_crud.claim_idle_runtime(async_session, lease) is None
+
+
+@pytest.mark.asyncio
+async def test_async_get_agents(
+    async_session: AsyncSession,
+    user_factory,
+    token_factory,
+    agent_factory,
+) -> None:
+    owner: User = user_factory(dynamic_id=uuid4())
+    token: Token = token_factory(
+        ticker="AIDEN",
+        name="The greatest token ever",
+        evm_contract_address="0x123",
+        abi=[{"key": "value"}],
+    )
+    agent: Agent = agent_factory(
+        owner_id=owner.id,
+        token_id=token.id,
+        character_json={},
+        env_file="",
+    )
+
+    agents = await async_crud.get_agents_by_user_id(async_session, owner.id)
+    assert [a.id for a in agents] == [agent.id]
+    # Relationships must already be loaded - lazy loading raises in async code.
+    assert agents[0].token is not None
+    assert agents[0].token.id == token.id
+    assert agents[0].runtime is None
+
+    user = await async_crud.get_user(async_session, owner.id)
+    assert user is not None
+    assert user.wallets == []
+
+
+def test_get_agents_query_count(session: Session, agent_page_factory) -> None:
+    agent_page_factory(100)
+    engine = session.get_bind()
+
+    # Fresh session, so relationships can't come out of the identity map.
+    with Session(engine) as fresh_session, count_queries(engine) as statements:
+        agents = get_agents(fresh_session, limit=100)
+        [agent_to_agent_public(agent) for agent in agents]
+    # 1 + a runtime and token per agent
+    assert len(statements) == 201
+
+    with Session(engine) as fresh_session, count_queries(engine) as statements:
+        agents = get_agents(fresh_session, limit=100, load=AGENT_WITH_RUNTIME_AND_TOKEN)
+        agents_public = [agent_to_agent_public(agent) for agent in agents]
+    assert len(statements) == 1
+    assert len(agents_public) == 100
+    assert all(agent.runtime and agent.token for agent in agents_public)
+
+
+@pytest.mark.asyncio
+async def test_async_get_agents_query_count(
+    async_session: AsyncSession, agent_page_factory
+) -> None:
+    agent_page_factory(100)
+
+    with count_queries(async_session.bind.sync_engine) as statements:
+        agents = await async_crud.get_agents(async_session, limit=100)
+        [agent_to_agent_public(agent) for agent in agents]
+    assert len(statements) == 1
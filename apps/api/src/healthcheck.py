@@ -0,0 +1,94 @@
+"""
+Concurrent runtime healthchecks, for the healthcheck_runtimes sweep (see tasks.py).
+Every runtime is probed at once over one async HTTP client, with bounded concurrency and
+strict timeouts, so that a sweep takes as long as the slowest runtime rather than the
+sum of them.
+"""
+
+import asyncio
+from collections.abc import Sequence
+from dataclasses import dataclass
+from uuid import UUID
+
+import httpx
+
+from src import logger
+
+# Runtimes probed at the same time.
+HEALTHCHECK_CONCURRENCY = 50
+# A runtime that takes longer than this to answer is unhealthy.
+HEALTHCHECK_TIMEOUT = httpx.Timeout(3, connect=2)
+
+
+@dataclass(frozen=True)
+class RuntimeTarget:
+    runtime_id: UUID
+    url: str
+    # eliza_agent_id of the agent that should be running on the runtime, if any.
+    expected_agent: str | None
+
+
+@dataclass(frozen=True)
+class RuntimeHealth:
+    runtime_id: UUID
+    healthy: bool
+    # Whether the expected agent is running. None if there's no agent, or the runtime is
+    # unhealthy.
+    agent_running: bool | None = None
+
+
+async def probe_runtime(
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    target: RuntimeTarget,
+) -> RuntimeHealth:
+    """
+    Checks that nginx and the runtime's fastapi controller are up, then that the
+    expected agent is running on it.
+    """
+    async with semaphore:
+        try:
+            for path in ("/ping", "/controller/ping"):
+                resp = await client.get(f"{target.url}{path}")
+                resp.raise_for_status()
+        except (httpx.HTTPError, httpx.InvalidURL) as e:
+            logger.info(f"{e!r}: Runtime {target.runtime_id} is unhealthy.")
+            return RuntimeHealth(target.runtime_id, healthy=False)
+
+        if target.expected_agent is None:
+            return RuntimeHealth(target.runtime_id, healthy=True)
+
+        try:
+            resp = await client.get(f"{target.url}/controller/character/status")
+            resp.raise_for_status()
+            character_status = resp.json()
+        except (httpx.HTTPError, ValueError) as e:
+            # The controller answered its ping, so leave it to the next sweep.
+            logger.info(
+                f"{e!r}: Couldn't get character status of runtime {target.runtime_id}."
+            )
+            return RuntimeHealth(target.runtime_id, healthy=True)
+
+    # TODO: Improve agent health check coverage - this isn't comprehensive
+    # Agent might be running, but not chattable.
+    # This only covers client-direct, but not other clients (e.g. what if twitter client
+    # is down?)
+    agent_running = bool(character_status.get("running")) and (
+        character_status.get("agent_id") == target.expected_agent
+    )
+    return RuntimeHealth(target.runtime_id, healthy=True, agent_running=agent_running)
+
+
+async def probe_runtimes(targets: Sequence[RuntimeTarget]) -> list[RuntimeHealth]:
+    """
+    Probes all runtimes concurrently. Results are in the same order as targets.
+    """
+    semaphore = asyncio.Semaphore(HEALTHCHECK_CONCURRENCY)
+    limits = httpx.Limits(
+        max_connections=HEALTHCHECK_CONCURRENCY,
+        max_keepalive_connections=HEALTHCHECK_CONCURRENCY,
+    )
+    async with httpx.AsyncClient(timeout=HEALTHCHECK_TIMEOUT, limits=limits) as client:
+        return await asyncio.gather(
+            *(probe_runtime(client, semaphore, target) for target in targets)
+        )
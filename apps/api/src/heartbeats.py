@@ -0,0 +1,272 @@
+"""
+Agent heartbeats, for liveness monitoring.
+Runtimes post a heartbeat for their agent periodically. An agent that hasn't sent one
+for HEARTBEAT_TIMEOUT seconds is expired (down) by the next liveness tick. If it beats
+again shortly after, it's counted as a restart.
+
+Stores keep live agents ordered by last heartbeat, so a tick only touches the agents
+that expired since the last one, rather than scanning every agent. Down agents are
+forgotten after DOWN_RETENTION seconds, and stopped/deleted agents are removed outright,
+so stores stay bounded. The redis store is shared by all api processes. The in-process
+one is for a single process (and tests).
+
+Liveness metrics are generated from a snapshot of the store (see HeartbeatCollector), so
+that their series come and go with the agents in it.
+"""
+
+import heapq
+import os
+from abc import ABC, abstractmethod
+from bisect import bisect_right
+from collections.abc import Iterator, Sequence
+
+from prometheus_client.metrics_core import (
+    GaugeMetricFamily,
+    HistogramMetricFamily,
+    Metric,
+)
+from prometheus_client.registry import Collector
+from redis import asyncio as aioredis
+
+from src import redis_clients
+
+# An agent is down if it hasn't sent a heartbeat in this many seconds.
+HEARTBEAT_TIMEOUT = 75
+# Down agents are forgotten after this many seconds. A heartbeat after that is a fresh
+# start, not a restart.
+DOWN_RETENTION = 24 * 60 * 60
+HEARTBEAT_STORE = os.getenv("HEARTBEAT_STORE", "redis")
+
+
+class HeartbeatStore(ABC):
+    async def beat(self, agent_id: str, now: float) -> float | None:
+        """
+        Records a heartbeat. Returns when the agent was expired, if it was down.
+        """
+        return (await self.beat_many([agent_id], now)).get(agent_id)
+
+    @abstractmethod
+    async def beat_many(self, agent_ids: Sequence[str], now: float) -> dict[str, float]:
+        """
+        Records a heartbeat of each agent. Returns when each agent that was down was
+        expired.
+        """
+
+    @abstractmethod
+    async def expire(self, now: float) -> list[str]:
+        """
+        Marks agents that haven't sent a heartbeat since now - HEARTBEAT_TIMEOUT as
+        down, and returns them. Each expiry is returned once, even with many processes
+        sharing the store.
+        """
+
+    @abstractmethod
+    async def remove(self, agent_id: str) -> None:
+        """
+        Forgets an agent, e.g. because it was stopped on purpose.
+        """
+
+    @abstractmethod
+    async def snapshot(self) -> tuple[dict[str, float], dict[str, float]]:
+        """
+        Returns the last heartbeat of each live agent, and when each down agent was
+        expired.
+        """
+
+
+class MemoryHeartbeatStore(HeartbeatStore):
+    """
+    Min-heaps of (time, agent_id), with at most one live entry per agent. An entry that
+    comes up for expiry while its agent has beaten since is pushed back with the latest
+    heartbeat, so each agent costs O(log n) per HEARTBEAT_TIMEOUT, however often it
+    beats.
+    Not thread-safe. Only use it from the event loop.
+    """
+
+    def __init__(self) -> None:
+        self._last_beat: dict[str, float] = {}
+        # Time each live agent's heap entry is for. Entries that don't match are stale.
+        self._scheduled: dict[str, float] = {}
+        self._live: list[tuple[float, str]] = []
+        self._down_since: dict[str, float] = {}
+        self._down: list[tuple[float, str]] = []
+
+    async def beat_many(self, agent_ids: Sequence[str], now: float) -> dict[str, float]:
+        restarted: dict[str, float] = {}
+        for agent_id in agent_ids:
+            self._last_beat[agent_id] = now
+            if agent_id not in self._scheduled:
+                self._scheduled[agent_id] = now
+                heapq.heappush(self._live, (now, agent_id))
+            if (down_since := self._down_since.pop(agent_id, None)) is not None:
+                restarted[agent_id] = down_since
+        return restarted
+
+    async def expire(self, now: float) -> list[str]:
+        cutoff = now - HEARTBEAT_TIMEOUT
+        expired: list[str] = []
+        while self._live and self._live[0][0] < cutoff:
+            scheduled, agent_id = heapq.heappop(self._live)
+            if self._scheduled.get(agent_id) != scheduled:
+                continue
+            last_beat = self._last_beat[agent_id]
+            if last_beat > scheduled:
+                self._scheduled[agent_id] = last_beat
+                heapq.heappush(self._live, (last_beat, agent_id))
+                continue
+            del self._scheduled[agent_id], self._last_beat[agent_id]
+            self._down_since[agent_id] = now
+            heapq.heappush(self._down, (now, agent_id))
+            expired.append(agent_id)
+
+        forget_before = now - DOWN_RETENTION
+        while self._down and self._down[0][0] < forget_before:
+            down_since, agent_id = heapq.heappop(self._down)
+            if self._down_since.get(agent_id) == down_since:
+                del self._down_since[agent_id]
+        return expired
+
+    async def remove(self, agent_id: str) -> None:
+        self._last_beat.pop(agent_id, None)
+        self._scheduled.pop(agent_id, None)
+        self._down_since.pop(agent_id, None)
+
+    async def snapshot(self) -> tuple[dict[str, float], dict[str, float]]:
+        return dict(self._last_beat), dict(self._down_since)
+
+
+class RedisHeartbeatStore(HeartbeatStore):
+    """
+    Two sorted sets: live agents scored by last heartbeat, and down agents scored by
+    when they expired. Expiry moves agents between them in a script, so concurrent ticks
+    of several api processes never expire an agent twice, or one that has just beaten.
+    """
+
+    LIVE_KEY = "heartbeats:live"
+    DOWN_KEY = "heartbeats:down"
+    # Agents expired per script call, so that one call never blocks redis for long.
+    EXPIRE_BATCH = 1000
+    EXPIRE_SCRIPT = """
+    local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[1], 'LIMIT', 0, ARGV[4])
+    for _, agent_id in ipairs(expired) do
+        redis.call('ZREM', KEYS[1], agent_id)
+        redis.call('ZADD', KEYS[2], ARGV[2], agent_id)
+    end
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', '(' .. ARGV[3])
+    return expired
+    """
+
+    def __init__(self, client: aioredis.Redis) -> None:
+        self.client = client
+        self._expire = client.register_script(self.EXPIRE_SCRIPT)
+
+    async def beat_many(self, agent_ids: Sequence[str], now: float) -> dict[str, float]:
+        if not agent_ids:
+            return {}
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.zadd(self.LIVE_KEY, dict.fromkeys(agent_ids, now))
+            for agent_id in agent_ids:
+                pipe.zscore(self.DOWN_KEY, agent_id)
+            pipe.zrem(self.DOWN_KEY, *agent_ids)
+            _, *down_since, _ = await pipe.execute()
+        return {
+            agent_id: since
+            for agent_id, since in zip(agent_ids, down_since)
+            if since is not None
+        }
+
+    async def expire(self, now: float) -> list[str]:
+        expired: list[str] = []
+        while True:
+            batch: list[bytes] = await self._expire(
+                keys=[self.LIVE_KEY, self.DOWN_KEY],
+                args=[
+                    now - HEARTBEAT_TIMEOUT,
+                    now,
+                    now - DOWN_RETENTION,
+                    self.EXPIRE_BATCH,
+                ],
+            )
+            expired.extend(agent_id.decode() for agent_id in batch)
+            if len(batch) < self.EXPIRE_BATCH:
+                return expired
+
+    async def remove(self, agent_id: str) -> None:
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.zrem(self.LIVE_KEY, agent_id)
+            pipe.zrem(self.DOWN_KEY, agent_id)
+            await pipe.execute()
+
+    async def snapshot(self) -> tuple[dict[str, float], dict[str, float]]:
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.zrange(self.LIVE_KEY, 0, -1, withscores=True)
+            pipe.zrange(self.DOWN_KEY, 0, -1, withscores=True)
+            live, down = await pipe.execute()
+        return (
+            {agent_id.decode(): score for agent_id, score in live},
+            {agent_id.decode(): score for agent_id, score in down},
+        )
+
+
+class HeartbeatCollector(Collector):
+    """
+    Prometheus collector for agent liveness, generated from store snapshots rather than
+    kept in labelled Gauges, so that series of stopped, deleted and forgotten agents go
+    away with them. Metrics are built once per snapshot (every liveness tick) and served
+    as is on scrape.
+    """
+
+    # Seconds since an agent's last heartbeat.
+    LAG_BUCKETS = (5.0, 10.0, 15.0, 30.0, 45.0, 60.0, float(HEARTBEAT_TIMEOUT))
+
+    def __init__(self) -> None:
+        self._metrics: list[Metric] = []
+
+    def update(
+        self, live: dict[str, float], down: dict[str, float], now: float
+    ) -> None:
+        liveness = GaugeMetricFamily(
+            "agent_liveness_status",
+            "Heartbeat status of agents (1 = alive, 0 = dead)",
+            labels=["agent_id"],
+        )
+        for agent_id in live:
+            liveness.add_metric([agent_id], 1)
+        for agent_id in down:
+            liveness.add_metric([agent_id], 0)
+
+        agents = GaugeMetricFamily(
+            "agent_heartbeat_agents", "Agents tracked by heartbeat", labels=["state"]
+        )
+        agents.add_metric(["live"], len(live))
+        agents.add_metric(["down"], len(down))
+
+        lags = sorted(now - last_beat for last_beat in live.values())
+        lag = HistogramMetricFamily(
+            "agent_heartbeat_lag_seconds",
+            "Seconds since the last heartbeat of live agents, "
+            "as of the last liveness check",
+            buckets=[
+                (str(bound), bisect_right(lags, bound)) for bound in self.LAG_BUCKETS
+            ]
+            + [("+Inf", len(lags))],
+            sum_value=sum(lags),
+        )
+        # Swapped in whole, so a concurrent scrape sees either the old or the new
+        # metrics.
+        self._metrics = [liveness, agents, lag]
+
+    def collect(self) -> Iterator[Metric]:
+        return iter(self._metrics)
+
+
+def heartbeat_store_from_env() -> HeartbeatStore:
+    if HEARTBEAT_STORE == "memory":
+        return MemoryHeartbeatStore()
+    if HEARTBEAT_STORE == "redis":
+        return RedisHeartbeatStore(redis_clients.async_client())
+    raise ValueError(f"Unknown HEARTBEAT_STORE {HEARTBEAT_STORE}. Use redis or memory.")
+
+
+heartbeat_store = heartbeat_store_from_env()
+heartbeat_collector = HeartbeatCollector()
@@ -0,0 +1,116 @@
+"""
+Finalizes token launches.
+
+POST /tokens/launches only sends the launch transaction, and returns a pending
+TokenLaunch right away. The launch watcher then polls the receipts of all pending
+launches, in one batch per tick, and finalizes each one that was mined: it creates the
+launched token, or records why the launch failed. Launches that aren't mined within
+LAUNCH_TIMEOUT are failed, e.g. if their transaction was dropped, or the api process
+sending it died before recording it.
+
+Like the runtime autoscaler, it runs in every api process, but replicas take turns
+ticking (see Ticker), so launches are polled once per tick however many there are.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from prometheus_client import Counter
+from redis import asyncio as aioredis
+
+from src import logger, token_deployment
+from src.db import AsyncSession, async_crud
+from src.db.models import TokenBase, TokenLaunch
+from src.tick_lock import Ticker
+
+LAUNCH_WATCH_INTERVAL = 1.0
+# Pending launches polled per tick at most. The oldest first, so none are starved.
+LAUNCH_WATCH_LIMIT = 500
+LAUNCH_TIMEOUT = timedelta(minutes=10)
+
+launches_counter = Counter(
+    "token_launches_total", "Token launches finalized by the launch watcher", ["status"]
+)
+
+
+class LaunchWatcher(Ticker):
+    """
+    Ticks every LAUNCH_WATCH_INTERVAL seconds while launches are pending. Woken when a
+    launch is sent, so that an idle watcher starts polling right away.
+    """
+
+    def __init__(self, lock_client: aioredis.Redis | None = None) -> None:
+        super().__init__(lock_client, "token-launch-watcher", LAUNCH_WATCH_INTERVAL)
+
+    async def _finalize(
+        self, launch: TokenLaunch, token: TokenBase | None, error: str | None
+    ) -> bool:
+        async with AsyncSession() as session:
+            finalized = await async_crud.finalize_token_launch(
+                session, launch.id, token=token, error=error
+            )
+        if finalized:
+            launches_counter.labels("SUCCESS" if token else "FAILURE").inc()
+            if error:
+                logger.warning(f"[launches] Launch {launch.id} failed: {error}")
+        return finalized
+
+    async def idle(self) -> bool:
+        async with AsyncSession() as session:
+            return not await async_crud.get_pending_token_launches(session, 1)
+
+    async def _tick(self) -> None:
+        async with AsyncSession() as session:
+            launches = await async_crud.get_pending_token_launches(
+                session, LAUNCH_WATCH_LIMIT
+            )
+        if not launches:
+            return
+
+        rpc = await token_deployment.get_rpc()
+        # Launches without a hash were never sent, so they can only time out.
+        tx_hashes = [launch.tx_hash for launch in launches if launch.tx_hash]
+        receipts = (
+            dict(zip(tx_hashes, await rpc.receipts(tx_hashes))) if tx_hashes else {}
+        )
+        bonding_contract = rpc.bonding_contract(token_deployment.deployer_env()[1])
+        deployer_address = token_deployment.deployer_address()
+        now = datetime.now(timezone.utc)
+
+        for launch in launches:
+            receipt = receipts.get(launch.tx_hash) if launch.tx_hash else None
+            token: TokenBase | None = None
+            error: str | None = None
+            if receipt is None:
+                # sqlite drops the timezone. Its timestamps are UTC.
+                created_at = launch.created_at or now
+                if created_at.tzinfo is None:
+                    created_at = created_at.replace(tzinfo=timezone.utc)
+                if now - created_at < LAUNCH_TIMEOUT:
+                    continue
+                error = (
+                    "Launch transaction wasn't mined in time"
+                    if launch.tx_hash
+                    else "Launch transaction wasn't sent"
+                )
+            elif int(receipt["status"], 16) == 0:
+                error = "Launch transaction reverted"
+            else:
+                try:
+                    token = TokenBase(
+                        name=launch.name,
+                        ticker=launch.ticker,
+                        evm_contract_address=token_deployment.launched_token(
+                            bonding_contract, receipt
+                        ),
+                        abi=token_deployment.load_token_abi(),
+                    )
+                except ValueError as e:
+                    logger.warning(f"[launches] No token in launch {launch.id}: {e}")
+                    error = "Launched token not found in the transaction receipt"
+
+            await self._finalize(launch, token, error)
+            # Mined or timed out, so its nonce is no longer pending.
+            if launch.nonce is not None:
+                await token_deployment.deployer_nonces.confirm(
+                    deployer_address, launch.nonce
+                )
@@ -132,5 +132,74 @@ def agent_to_agent_public(agent: Agent, show_secrets: bool=False) -> AgentPublic
 class TaskStatus(str, Enum):
     FAILURE = "FAILURE"
     PENDING = "PENDING"
+    # Waiting to run again, e.g. between polls of a starting agent
+    RETRY = "RETRY"
     STARTED = "STARTED"
     SUCCESS = "SUCCESS"
+
+
+class TaskEvent(BaseModel):
+    """
+    A status transition of an agent start, runtime create or runtime delete task.
+    """
+
+    task_id: UUID
+    task: str = Field(description="Name of the celery task, e.g. start_agent")
+    status: TaskStatus
+    agent_id: UUID | None = None
+    runtime_id: UUID | None = None
+
+
+class AgentResourceStatus(BaseModel):
+    memory_bytes: int | None = Field(
+        None, ge=0, description="Resident memory of the agent"
+    )
+    cpu_percent: float | None = Field(None, ge=0, description="CPU usage of the agent")
+    uptime_seconds: float | None = Field(
+        None, ge=0, description="Time since the agent started"
+    )
+
+
+class AgentHeartbeat(BaseModel):
+    agent_id: UUID
+    status: AgentResourceStatus | None = None
+
+
+class AgentHeartbeatBatch(BaseModel):
+    """
+    Heartbeats of many agents, e.g. all those on a runtime, in one request.
+    """
+
+    heartbeats: list[AgentHeartbeat] = Field(max_length=1000)
+
+
+class TradeSide(str, Enum):
+    BUY = "BUY"
+    SELL = "SELL"
+
+
+class TradeRequest(BaseModel):
+    token_id: UUID
+    side: TradeSide
+    amount: int = Field(
+        gt=0, description="SEI to spend (in wei) when buying, tokens when selling"
+    )
+    user_address: str = Field(description="Address of the user making the trade")
+
+
+class TradeBatch(BaseModel):
+    """
+    Trades to build unsigned transactions for, e.g. of many users or amounts, in one
+    request.
+    """
+
+    trades: list[TradeRequest] = Field(max_length=100)
+
+
+class UnsignedTrade(BaseModel):
+    transaction: dict[str, Any] | None = Field(
+        None, description="Unsigned transaction, for the user to sign and send"
+    )
+    error: str | None = Field(
+        None, description="Why the transaction can't be built, e.g. it would revert"
+    )
@@ -0,0 +1,291 @@
+"""
+Nonces of hot wallets that send many transactions at once, e.g. the token deployer.
+
+Fetching the nonce from the chain for every transaction makes concurrent transactions
+from one address collide on it, or forces them to be sent one at a time. Instead, a
+NonceManager hands out increasing nonces from a counter, which is only synced with the
+chain's pending transaction count when first used, and after a send fails.
+
+Sent transactions are tracked as pending until they're mined or time out, and a sync
+never hands out a pending nonce again, even if the node doesn't know that transaction
+yet: it only hands out the gaps below the highest pending nonce, e.g. left by failed
+sends, and then the nonces past it. A sync can still hand out a nonce again, if a
+transaction holding it is still being sent. That send then fails on the nonce, resyncs,
+and is retried with a fresh one.
+
+The redis store is shared by all processes sending from an address. The in-process one
+is for a single process (and tests).
+"""
+
+import asyncio
+import os
+from abc import ABC, abstractmethod
+from collections.abc import Awaitable, Callable
+from contextlib import AbstractAsyncContextManager
+
+from redis import asyncio as aioredis
+
+from src import logger, redis_clients
+
+NONCE_STORE = os.getenv("NONCE_STORE", "redis")
+# A sync that holds the lock for longer than this is assumed to have died.
+SYNC_LOCK_TIMEOUT = 30
+# Sends that fail on their nonce are retried with a fresh one, this many times in total.
+SEND_ATTEMPTS = 3
+# Node errors that mean the nonce was already used, or is out of order.
+NONCE_ERRORS = ("nonce", "already known", "replacement transaction underpriced")
+
+
+class NonceStore(ABC):
+    @abstractmethod
+    async def take(self, address: str) -> int | None:
+        """
+        Returns the next nonce of address, and advances it: the lowest gap, if there is
+        one. None if address isn't synced.
+        """
+
+    @abstractmethod
+    async def synced(self, address: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def sync(self, address: str, next_nonce: int) -> int:
+        """
+        Sets the next nonce of address, past its highest pending transaction if that is
+        higher, and the nonces from next_nonce on that aren't pending as gaps. Returns
+        the nonce that take returns next.
+        """
+
+    @abstractmethod
+    def lock(self, address: str) -> AbstractAsyncContextManager:
+        """
+        Held while syncing address.
+        """
+
+    @abstractmethod
+    async def add_pending(self, address: str, nonce: int, tx_hash: str) -> None:
+        pass
+
+    @abstractmethod
+    async def confirm(self, address: str, nonce: int) -> None:
+        """
+        Forgets a pending transaction, once it was mined or timed out.
+        """
+
+    @abstractmethod
+    async def pending(self, address: str) -> dict[int, str]:
+        """
+        Returns the tx hash of each pending transaction of address, by nonce.
+        """
+
+
+class MemoryNonceStore(NonceStore):
+    """
+    Not thread-safe. Only use it from one event loop.
+    """
+
+    def __init__(self) -> None:
+        self._next: dict[str, int] = {}
+        self._gaps: dict[str, list[int]] = {}
+        self._pending: dict[str, dict[int, str]] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    async def take(self, address: str) -> int | None:
+        nonce = self._next.get(address)
+        if nonce is None:
+            return None
+        if gaps := self._gaps.get(address):
+            return gaps.pop(0)
+        self._next[address] = nonce + 1
+        return nonce
+
+    async def synced(self, address: str) -> bool:
+        return address in self._next
+
+    async def sync(self, address: str, next_nonce: int) -> int:
+        pending = self._pending.get(address, {})
+        self._next[address] = max([next_nonce, *(nonce + 1 for nonce in pending)])
+        self._gaps[address] = [
+            nonce
+            for nonce in range(next_nonce, self._next[address])
+            if nonce not in pending
+        ]
+        return (self._gaps[address] or [self._next[address]])[0]
+
+    def lock(self, address: str) -> asyncio.Lock:
+        return self._locks.setdefault(address, asyncio.Lock())
+
+    async def add_pending(self, address: str, nonce: int, tx_hash: str) -> None:
+        self._pending.setdefault(address, {})[nonce] = tx_hash
+
+    async def confirm(self, address: str, nonce: int) -> None:
+        self._pending.get(address, {}).pop(nonce, None)
+
+    async def pending(self, address: str) -> dict[int, str]:
+        return dict(self._pending.get(address, {}))
+
+
+class RedisNonceStore(NonceStore):
+    """
+    The next nonce of each address in a counter and its gaps in a list, taken with a
+    script so that it's one round trip, and pending transactions in a hash. Syncs take
+    a redis lock, so that processes that fail at once don't all sync.
+    """
+
+    # Returns the first gap, or else the counter before incrementing it. nil if there is
+    # no counter.
+    TAKE_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return nil
+    end
+    local gap = redis.call('LPOP', KEYS[2])
+    if gap then
+        return tonumber(gap)
+    end
+    return redis.call('INCR', KEYS[1]) - 1
+    """
+    # Sets the counter to ARGV[1], or past the highest pending nonce if that's higher,
+    # and the gaps to the nonces in between that aren't pending. Returns the nonce taken
+    # next.
+    SYNC_SCRIPT = """
+    local chain_nonce = tonumber(ARGV[1])
+    local next_nonce = chain_nonce
+    local pending = {}
+    for _, nonce in ipairs(redis.call('HKEYS', KEYS[2])) do
+        pending[tonumber(nonce)] = true
+        next_nonce = math.max(next_nonce, tonumber(nonce) + 1)
+    end
+    redis.call('SET', KEYS[1], next_nonce)
+    redis.call('DEL', KEYS[3])
+    for nonce = next_nonce - 1, chain_nonce, -1 do
+        if not pending[nonce] then
+            redis.call('LPUSH', KEYS[3], nonce)
+        end
+    end
+    return tonumber(redis.call('LINDEX', KEYS[3], 0) or next_nonce)
+    """
+
+    def __init__(self, client: aioredis.Redis) -> None:
+        self.client = client
+        self._take = client.register_script(self.TAKE_SCRIPT)
+        self._sync = client.register_script(self.SYNC_SCRIPT)
+
+    @staticmethod
+    def _next_key(address: str) -> str:
+        return f"nonces:{address}:next"
+
+    @staticmethod
+    def _gaps_key(address: str) -> str:
+        return f"nonces:{address}:gaps"
+
+    @staticmethod
+    def _pending_key(address: str) -> str:
+        return f"nonces:{address}:pending"
+
+    async def take(self, address: str) -> int | None:
+        nonce = await self._take(
+            keys=[self._next_key(address), self._gaps_key(address)]
+        )
+        return None if nonce is None else int(nonce)
+
+    async def synced(self, address: str) -> bool:
+        return bool(await self.client.exists(self._next_key(address)))
+
+    async def sync(self, address: str, next_nonce: int) -> int:
+        return int(
+            await self._sync(
+                keys=[
+                    self._next_key(address),
+                    self._pending_key(address),
+                    self._gaps_key(address),
+                ],
+                args=[next_nonce],
+            )
+        )
+
+    def lock(self, address: str) -> AbstractAsyncContextManager:
+        return self.client.lock(f"nonces:{address}:lock", timeout=SYNC_LOCK_TIMEOUT)
+
+    async def add_pending(self, address: str, nonce: int, tx_hash: str) -> None:
+        key = self._pending_key(address)
+        await self.client.hset(key, str(nonce), tx_hash)  # type: ignore
+
+    async def confirm(self, address: str, nonce: int) -> None:
+        await self.client.hdel(self._pending_key(address), str(nonce))  # type: ignore
+
+    async def pending(self, address: str) -> dict[int, str]:
+        pending = await self.client.hgetall(self._pending_key(address))  # type: ignore
+        return {int(nonce): tx_hash.decode() for nonce, tx_hash in pending.items()}
+
+
+def is_nonce_error(e: Exception) -> bool:
+    message = str(e).lower()
+    return any(error in message for error in NONCE_ERRORS)
+
+
+class NonceManager:
+    def __init__(
+        self, store: NonceStore, fetch_nonce: Callable[[str], Awaitable[int]]
+    ) -> None:
+        """
+        fetch_nonce: Returns the pending transaction count of an address on chain.
+        """
+        self.store = store
+        self.fetch_nonce = fetch_nonce
+
+    async def reserve(self, address: str) -> int:
+        """
+        Returns the next nonce of address. Syncs it with the chain first, if it isn't
+        yet.
+        """
+        while (nonce := await self.store.take(address)) is None:
+            async with self.store.lock(address):
+                # Another caller may have synced it while this one waited for the lock.
+                if not await self.store.synced(address):
+                    await self.store.sync(address, await self.fetch_nonce(address))
+        return nonce
+
+    async def resync(self, address: str) -> None:
+        async with self.store.lock(address):
+            next_nonce = await self.store.sync(address, await self.fetch_nonce(address))
+        logger.info(f"[nonces] Resynced {address} to {next_nonce}")
+
+    async def send(
+        self, address: str, send: Callable[[int], Awaitable[str]]
+    ) -> tuple[int, str]:
+        """
+        Sends a transaction from address with the next nonce, and tracks it as pending
+        until confirmed.
+        send: Signs and sends the transaction with the given nonce. Returns its hash. If
+        sending fails, the nonce is resynced. Failures on the nonce are retried, up to
+        SEND_ATTEMPTS times in total, and other errors raised.
+        Returns the nonce and tx hash.
+        """
+        attempt = 1
+        while True:
+            nonce = await self.reserve(address)
+            try:
+                tx_hash = await send(nonce)
+                break
+            except Exception as e:
+                await self.resync(address)
+                if attempt >= SEND_ATTEMPTS or not is_nonce_error(e):
+                    raise
+                logger.warning(f"[nonces] Retrying send from {address}: {e}")
+                attempt += 1
+        await self.store.add_pending(address, nonce, tx_hash)
+        return nonce, tx_hash
+
+    async def confirm(self, address: str, nonce: int) -> None:
+        """
+        Stops tracking the transaction with nonce, once it was mined or timed out.
+        """
+        await self.store.confirm(address, nonce)
+
+
+def nonce_store_from_env() -> NonceStore:
+    if NONCE_STORE == "memory":
+        return MemoryNonceStore()
+    if NONCE_STORE == "redis":
+        return RedisNonceStore(redis_clients.async_client())
+    raise ValueError(f"Unknown NONCE_STORE {NONCE_STORE}. Use redis or memory.")
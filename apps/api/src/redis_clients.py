@@ -0,0 +1,37 @@
+"""
+Redis clients for the api's own state: task statuses, heartbeats, nonces and tick locks.
+It shares celery's redis, unless REDIS_URL points elsewhere.
+"""
+
+import os
+from typing import Any
+
+import redis
+from redis import asyncio as aioredis
+
+REDIS_URL = os.getenv("REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost"))
+# Commands fail after this many seconds, so that a redis outage degrades the features
+# that use it rather than hanging requests.
+REDIS_TIMEOUT = 0.5
+
+
+def _options(kwargs: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "socket_timeout": REDIS_TIMEOUT,
+        "socket_connect_timeout": REDIS_TIMEOUT,
+        **kwargs,
+    }
+
+
+def async_client(**kwargs: Any) -> aioredis.Redis:
+    """
+    kwargs: Override the client's options, e.g. socket_timeout=None for blocking reads.
+    """
+    return aioredis.Redis.from_url(REDIS_URL, **_options(kwargs))
+
+
+def sync_client(**kwargs: Any) -> redis.Redis:
+    """
+    Like async_client, for code that isn't async, e.g. celery tasks.
+    """
+    return redis.Redis.from_url(REDIS_URL, **_options(kwargs))
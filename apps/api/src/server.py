@@ -1,31 +1,42 @@
 import asyncio
-from datetime import datetime, timedelta
 import os
 from base64 import b64decode
+from datetime import timedelta
 from collections.abc import Sequence
 from contextlib import asynccontextmanager
-from collections.abc import Awaitable, Callable
+from collections.abc import AsyncIterator, Awaitable, Callable
 from typing import Annotated, Any
 from uuid import UUID
 
-import requests
-from fastapi import FastAPI, HTTPException, Request, Security, Response
+import httpx
+import redis
+from fastapi import FastAPI, HTTPException, Query, Request, Security, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from prometheus_fastapi_instrumentator import Instrumentator, metrics
-from prometheus_client import Counter, Gauge, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import (
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    CONTENT_TYPE_LATEST,
+)
 import time
-from src import logger, tasks
+from src import logger, redis_clients, task_status, tasks, token_deployment
 from src.auth import (
     IsAdminDepends,
     IsAdminOrOwnerDepends,
     check_scopes,
     get_user_from_token,
     get_wallets_from_token,
+    invalidate_identity,
     parse_jwt,
+    refresh_jwks_periodically,
 )
 from src.aws_utils import get_aws_config
-from src.db import Session, crud, init_db
+from src.db import AsyncSession, async_crud, crud, init_db
+
 from src.db.models import (
     Agent,
     AgentBase,
@@ -40,6 +51,10 @@ from src.db.models import (
     RuntimeDeleteTaskBase,
     Token,
     TokenBase,
+    TokenLaunch,
+    TokenLaunchBase,
+    TokenLaunchStatus,
+    TokenLaunchUpdate,
     User,
     UserBase,
     UserUpdate,
@@ -48,73 +63,94 @@ from src.db.models import (
     WalletUpdate,
 )
 from src.models import (
+    AgentHeartbeatBatch,
     AgentPublic,
     AWSConfig,
+    TaskEvent,
     TaskStatus,
+    TokenCreationRequest,
+    TradeBatch,
+    TradeSide,
+    UnsignedTrade,
     UserPublic,
     agent_to_agent_public,
     user_to_user_public,
 )
 from src.setup import test_db_connection
-from src.utils import obj_or_404
-from threading import Lock
-
-agent_last_down_time: dict[str, datetime] = {}
-stopped_agents = set()
-stopped_agents_lock = Lock()
-agent_heartbeat_store: dict[str, datetime] = {}
-agent_heartbeat_lock = Lock()
-
-agent_liveness_gauge = Gauge(
-    "agent_liveness_status",
-    "Heartbeat status of agents (1 = alive, 0 = dead)",
-    ["agent_id"]
+from src.db.pagination import next_cursor
+from src.autoscaler import RuntimeAutoscaler
+from src.launches import LaunchWatcher
+from src.heartbeats import HEARTBEAT_TIMEOUT, heartbeat_collector, heartbeat_store
+from src.utils import NEXT_CURSOR_HEADER, cursor_or_400, obj_or_404, set_next_cursor
+
+# Per-agent liveness is built from a heartbeat store snapshot taken every liveness
+# check, and served as is on scrape. See HeartbeatCollector.
+REGISTRY.register(heartbeat_collector)
+agent_restart_histogram = Histogram(
+    "agent_restart_downtime_seconds",
+    "Downtime of agents that came back up shortly after their heartbeats stopped",
+    buckets=[15, 30, 45, 60, HEARTBEAT_TIMEOUT],
 )
 
-agent_restart_timestamp = Gauge("agent_restart_timestamp", "Unix timestamp of last restart", ["agent_id"])
-
 agent_live_gauge = Gauge("agent_live_count", "Current live agents")
 agent_killed_counter = Counter("agent_killed_total", "Total agents killed")
 agent_event_counter = Counter("agent_event_total", "Agent lifecycle events", ["type"])
+# Resource usage reported in batched heartbeats, across all agents.
+agent_memory_histogram = Histogram(
+    "agent_reported_memory_bytes",
+    "Memory use reported in agent heartbeats",
+    buckets=[2**i * 1024 * 1024 for i in range(5, 14)],  # 32MiB to 8GiB
+)
+agent_cpu_histogram = Histogram(
+    "agent_reported_cpu_percent",
+    "CPU use reported in agent heartbeats",
+    buckets=[5, 10, 25, 50, 75, 100, 150, 200, 400],
+)
+agent_uptime_histogram = Histogram(
+    "agent_reported_uptime_seconds",
+    "Agent uptime reported in agent heartbeats",
+    buckets=[60, 300, 900, 3600, 6 * 3600, 24 * 3600, 7 * 24 * 3600],
+)
 
-RUNTIME_IDLE_POOL_SIZE = int(os.getenv("RUNTIME_IDLE_POOL_SIZE", 2))
+LIVENESS_CHECK_INTERVAL = 15
+# Outlasts tasks.start_agent, which releases the runtime once the agent is running on
+# it.
+RUNTIME_CLAIM_LEASE = timedelta(
+    seconds=tasks.START_AGENT_POLL_INTERVAL * (tasks.START_AGENT_MAX_POLLS + 1) + 60
+)
 
 # TODO: Change a ton of endpoints to not require information that is already in the JWT token.
 # For example, PATCH /users should just require the user_id in the JWT token, not in query params.
 
+
 async def monitor_agent_liveness():
+    """
+    Every LIVENESS_CHECK_INTERVAL seconds, marks agents whose heartbeats stopped as
+    down, and refreshes the liveness metrics. See heartbeats.py.
+    """
     logger.info("[monitor_agent_liveness] Task started")
 
     while True:
-        now = datetime.utcnow()
-
-        with agent_heartbeat_lock:
-            for agent_id, last_beat in agent_heartbeat_store.items():
-                # Skip agents purposelly stopped, can be removed if needed
-                with stopped_agents_lock:
-                    if agent_id in stopped_agents:
-                        continue
-
-                # Check if agent is alive or not
-                alive = (now - last_beat).total_seconds() < 75
-
-                agent_liveness_gauge.labels(agent_id=str(agent_id)).set(1 if alive else 0)
+        try:
+            now = time.time()
+            for agent_id in await heartbeat_store.expire(now):
+                logger.info(f"Agent {agent_id} stopped sending heartbeats")
+            heartbeat_collector.update(*await heartbeat_store.snapshot(), now)
+        except redis.RedisError as e:
+            logger.warning(f"[monitor_agent_liveness] Heartbeat store unavailable: {e}")
 
-                if not alive:
-                
-                    if agent_id not in agent_last_down_time:
-                        agent_last_down_time[agent_id] = now
-                else:
-                    if agent_id in agent_last_down_time:
-                        down_time = agent_last_down_time.pop(agent_id)
-                        downtime_seconds = (now - down_time).total_seconds()
+        await asyncio.sleep(LIVENESS_CHECK_INTERVAL)
 
-                        if downtime_seconds <= 75:
-                            logger.info(f"[RESTART DETECTED] Agent {agent_id} restarted after {downtime_seconds:.1f}s")
-                            agent_restart_timestamp.labels(agent_id=str(agent_id)).set(time.time())
-                            logger.info("[RESTART METRIC] %s restarted at %d", agent_id, int(time.time()))
 
-        await asyncio.sleep(15)
+async def forget_heartbeats(agent_id: UUID) -> None:
+    """
+    Stops liveness tracking of an agent that was stopped or deleted on purpose.
+    Tracking resumes with its next heartbeat.
+    """
+    try:
+        await heartbeat_store.remove(str(agent_id))
+    except redis.RedisError as e:
+        logger.warning(f"Heartbeat store unavailable: {e}")
 
 
 @asynccontextmanager
@@ -127,7 +163,14 @@ async def lifespan(app: FastAPI):  # noqa
         raise Exception("DB Connection Failed")
     
     asyncio.create_task(monitor_agent_liveness())
+    asyncio.create_task(refresh_jwks_periodically())
+    asyncio.create_task(task_status.event_hub.run())
+    # Tests create runtimes themselves.
+    if os.getenv("ENV") != "test":
+        asyncio.create_task(runtime_autoscaler.run())
+        asyncio.create_task(launch_watcher.run())
     yield
+    await token_deployment.close_rpc()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -172,7 +215,15 @@ async def auth_middleware(
 
 
 instrumentator = Instrumentator(
-    excluded_handlers=["/metrics_prometheus"],
+    # /tasks/events streams stay open for minutes, and would skew the latency
+    # histograms. Heartbeats are by far the most frequent requests, and would dominate
+    # them.
+    excluded_handlers=[
+        "/metrics_prometheus",
+        "/tasks/events",
+        "/agents/heartbeats",
+        "/agents/{agent_id}/heartbeat",
+    ],
 )
 
 # Handler and method included by default
@@ -199,8 +250,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
+# Page size for cursor paginated listings
+PageLimit = Annotated[int, Query(ge=1, le=100)]
+
 
 @app.get("/ping")
 async def ping():
@@ -209,18 +264,59 @@ async def ping():
     """
     return "pong"
 
+
+async def record_heartbeats(agent_ids: Sequence[str]) -> None:
+    """
+    Records heartbeats in the heartbeat store.
+    An agent that was down for at most HEARTBEAT_TIMEOUT seconds is counted as
+    restarted.
+    """
+    now = time.time()
+    try:
+        restarted = await heartbeat_store.beat_many(agent_ids, now)
+    except redis.RedisError as e:
+        logger.warning(f"Heartbeat store unavailable: {e}")
+        raise HTTPException(status_code=503, detail="Heartbeat store unavailable")
+
+    for agent_id, down_since in restarted.items():
+        if now - down_since <= HEARTBEAT_TIMEOUT:
+            logger.info(
+                f"[RESTART DETECTED] Agent {agent_id} restarted after "
+                f"{now - down_since:.1f}s"
+            )
+            agent_restart_histogram.observe(now - down_since)
+
+
 @app.post("/agents/{agent_id}/heartbeat")
 async def agent_heartbeat(agent_id: UUID):
     """
-    Receives a heartbeat ping and updates in-memory store.
+    Receives a heartbeat ping and records it in the heartbeat store.
     """
-    with agent_heartbeat_lock:
-        agent_heartbeat_store[str(agent_id)] = datetime.utcnow()
+    await record_heartbeats([str(agent_id)])
     return {"message": "heartbeat received"}
 
 
+@app.post("/agents/heartbeats")
+async def agent_heartbeats(batch: AgentHeartbeatBatch):
+    """
+    Receives the heartbeats of many agents, e.g. all those on a runtime, at once.
+    Reported resource usage is aggregated into histograms, rather than kept per agent.
+    """
+    await record_heartbeats([str(heartbeat.agent_id) for heartbeat in batch.heartbeats])
+    for heartbeat in batch.heartbeats:
+        if heartbeat.status is None:
+            continue
+        if heartbeat.status.memory_bytes is not None:
+            agent_memory_histogram.observe(heartbeat.status.memory_bytes)
+        if heartbeat.status.cpu_percent is not None:
+            agent_cpu_histogram.observe(heartbeat.status.cpu_percent)
+        if heartbeat.status.uptime_seconds is not None:
+            agent_uptime_histogram.observe(heartbeat.status.uptime_seconds)
+    return {"message": "heartbeats received", "received": len(batch.heartbeats)}
+
+
 @app.post("/agents")
-def create_agent(
+async def create_agent(
     agent: AgentBase,
     # Require that the user be signed in, but don't do any other verification
     user: Annotated[User, Security(get_user_from_token())],
@@ -231,14 +327,16 @@ def create_agent(
     Only stores it in db.
     Requires that the user be signed in.
     """
-    with Session() as session:
-        agents = crud.get_agents_by_user_id(session, user.id)
+    async with AsyncSession() as session:
+        agents = await async_crud.get_agents_by_user_id(
+            session, user.id, load=crud.LAZY
+        )
         if not is_admin and len(agents) > 0:
             raise HTTPException(
                 status_code=403,
                 detail="Users are restricted to one agent at any time!",
             )
-        agent = crud.create_agent(session, agent)
+        agent = await async_crud.create_agent(session, agent)
 
         return agent_to_agent_public(agent, show_secrets=True)
 
@@ -246,14 +344,18 @@ def create_agent(
 @app.get("/agents")
 async def get_agents(
     is_admin_or_owner: IsAdminOrOwnerDepends,
+    response: Response,
     user_id: UUID | None = None,
     user_dynamic_id: UUID | None = None,
+    cursor: str | None = None,
+    limit: PageLimit = 100,
 ) -> Sequence[AgentPublic]:
     """
     Returns a list of Agents.
     If user_id is passed, returns all agents owned by that user.
     If user_dynamic_id is passed, returns all agents owned by that user.
-    If neither is passed, returns all agents.
+    If neither is passed, returns a page of up to limit agents, oldest first. If there
+    are more, the X-Next-Cursor header holds the cursor to pass for the next page.
     Raises a 400 if both user_id and user_dynamic_id are passed.
     If user query params are passed, valid auth for that user must be provided.
     """
@@ -263,20 +365,30 @@ async def get_agents(
             detail="Exactly one or zero of user_id or user_dynamic_id may be passed",
         )
 
-    with Session() as session:
+    async with AsyncSession() as session:
         if user_dynamic_id:
             user: User = obj_or_404(
-                crud.get_user_by_dynamic_id(
+                await async_crud.get_user_by_dynamic_id(
                     session,
                     dynamic_id=user_dynamic_id,
                 ),
                 User,
             )
-            agents = crud.get_agents_by_user_id(session, user.id)
+            agents = await async_crud.get_agents_by_user_id(
+                session, user.id, load=crud.AGENT_WITH_RUNTIME_AND_TOKEN
+            )
         elif user_id:
-            agents = crud.get_agents_by_user_id(session, user_id)
+            agents = await async_crud.get_agents_by_user_id(
+                session, user_id, load=crud.AGENT_WITH_RUNTIME_AND_TOKEN
+            )
         else:
-            agents = crud.get_agents(session)
+            agents = await async_crud.get_agents(
+                session,
+                cursor=cursor_or_400(cursor),
+                limit=limit,
+                load=crud.AGENT_WITH_RUNTIME_AND_TOKEN,
+            )
+            set_next_cursor(response, next_cursor(agents, limit))
 
         return [
             agent_to_agent_public(
@@ -295,8 +407,8 @@ async def get_agent(
     Returns an agent by id.
     Raises a 404 if the agent is not found.
     """
-    with Session() as session:
-        agent: Agent | None = crud.get_agent(session, agent_id)
+    async with AsyncSession() as session:
+        agent: Agent | None = await async_crud.get_agent(session, agent_id)
 
         if not agent:
             raise HTTPException(status_code=404, detail="Agent not found")
@@ -318,8 +430,8 @@ async def update_agent(
     Raises a 404 if the agent is not found.
     Only admins or the agent owner can update(including ownership transfer).
     """
-    with Session() as session:
-        agent = crud.get_agent(session, agent_id)
+    async with AsyncSession() as session:
+        agent = await async_crud.get_agent(session, agent_id)
 
         if not agent:
             raise HTTPException(status_code=404, detail="Agent not found")
@@ -330,7 +442,7 @@ async def update_agent(
                 detail="You do not have permission to update an agent that doesn't belong to you",
             )
 
-        updated = crud.update_agent(session, agent, agent_update)
+        updated = await async_crud.update_agent(session, agent, agent_update)
 
         return agent_to_agent_public(updated, show_secrets=is_authorized)
 
@@ -341,30 +453,93 @@ async def save_token(token_base: TokenBase) -> Token:
     Saves an already deployed token to db.
     Returns the token object
     """
-    with Session() as session:
-        token = crud.create_token(session, token_base)
+    async with AsyncSession() as session:
+        token = await async_crud.create_token(session, token_base)
 
     return token
 
 
 @app.get("/tokens")
-async def get_tokens() -> Sequence[Token]:
+async def get_tokens(
+    response: Response,
+    cursor: str | None = None,
+    limit: PageLimit = 100,
+) -> Sequence[Token]:
     """
-    Returns a list of tokens.
+    Returns a page of up to limit tokens, oldest first.
+    If there are more, the X-Next-Cursor header holds the cursor to pass for the next
+    page.
     """
-    with Session() as session:
-        tokens = crud.get_tokens(session)
+    async with AsyncSession() as session:
+        tokens = await async_crud.get_tokens(
+            session, cursor=cursor_or_400(cursor), limit=limit
+        )
+    set_next_cursor(response, next_cursor(tokens, limit))
     return tokens
 
 
+@app.post("/tokens/launches", status_code=202)
+async def launch_token(
+    request: TokenCreationRequest,
+    user: Annotated[User, Security(get_user_from_token())],
+) -> TokenLaunch:
+    """
+    Sends the transaction launching a token, without waiting for it to be mined.
+    Returns the pending launch. Poll it at GET /tokens/launches/{launch_id}: once it
+    succeeds, its token_id is the launched token.
+    Raises a 502 if the transaction can't be sent.
+    Requires that the user be signed in.
+    """
+    async with AsyncSession() as session:
+        launch = await async_crud.create_token_launch(
+            session,
+            TokenLaunchBase(name=request.name, ticker=request.ticker, owner_id=user.id),
+        )
+        try:
+            nonce, tx_hash = await token_deployment.submit_launch(
+                request.name, request.ticker
+            )
+        except Exception as e:
+            logger.error(f"Failed to send token launch {launch.id}: {e}")
+            # Node errors may expose the deployer's details, so they're only logged.
+            error = "Failed to send launch transaction"
+            await async_crud.update_token_launch(
+                session,
+                launch,
+                TokenLaunchUpdate(status=TokenLaunchStatus.FAILURE, error=error),
+            )
+            raise HTTPException(status_code=502, detail=error)
+        launch = await async_crud.update_token_launch(
+            session, launch, TokenLaunchUpdate(tx_hash=tx_hash, nonce=nonce)
+        )
+
+    launch_watcher.wake()
+    return launch
+
+
+@app.get("/tokens/launches/{launch_id}")
+async def get_token_launch(launch_id: UUID) -> TokenLaunch:
+    """
+    Returns a token launch by id.
+    Raises a 404 if the launch is not found.
+    """
+    async with AsyncSession() as session:
+        launch = await async_crud.get_token_launch(session, launch_id)
+
+    if not launch:
+        raise HTTPException(status_code=404, detail="Token launch not found")
+
+    return launch
+
+
 @app.get("/tokens/{token_id}")
 async def get_token(token_id: UUID) -> Token:
     """
     Returns a token by id.
     Raises a 404 if the token is not found.
     """
-    with Session() as session:
-        token: Token | None = crud.get_token(session, token_id)
+    async with AsyncSession() as session:
+        token: Token | None = await async_crud.get_token(session, token_id)
 
     if not token:
         raise HTTPException(status_code=404, detail="Token not found")
@@ -372,82 +547,128 @@ async def get_token(token_id: UUID) -> Token:
     return token
 
 
+@app.post("/tokens/transactions")
+async def build_trade_transactions(batch: TradeBatch) -> list[UnsignedTrade]:
+    """
+    Builds unsigned buy/sell transactions, e.g. for many users or amounts, in one
+    batched RPC round trip. Users sign and send them themselves.
+    A trade whose transaction can't be built, e.g. because it would revert, gets an
+    error.
+    Raises a 404 if a token is not found.
+    """
+    token_ids = list({trade.token_id for trade in batch.trades})
+    async with AsyncSession() as session:
+        tokens = {
+            token.id: token
+            for token in await async_crud.get_tokens_by_ids(session, token_ids)
+        }
+    if len(tokens) < len(token_ids):
+        raise HTTPException(status_code=404, detail="Token not found")
+
+    calls = []
+    for trade in batch.trades:
+        token = tokens[trade.token_id]
+        if trade.side == TradeSide.BUY:
+            call = token_deployment.buy_call(
+                trade.amount, token.evm_contract_address, trade.user_address
+            )
+        else:
+            call = await token_deployment.sell_call(
+                trade.amount, token.abi, token.evm_contract_address, trade.user_address
+            )
+        calls.append(call)
+
+    try:
+        transactions = await token_deployment.unsigned_transactions(calls)
+    except (ConnectionError, ValueError) as e:
+        logger.error(f"Failed to build trade transactions: {e}")
+        raise HTTPException(status_code=502, detail="SEI RPC unavailable")
+    return [
+        UnsignedTrade(error=transaction)
+        if isinstance(transaction, str)
+        else UnsignedTrade(transaction=transaction)
+        for transaction in transactions
+    ]
+
+
 # TODO: Admin page for creating this.
 @app.post(
     "/runtimes",
     dependencies=[Security(check_scopes("admin"))],
 )
-def create_runtime() -> RuntimeCreateTask:
+async def create_runtime() -> RuntimeCreateTask:
     """
     Attempts to create a new runtime.
-    Returns a Runtime object immediately, with flag started=False.
+    Returns a RuntimeCreateTask immediately. The runtime's step tracks provisioning
+    progress, and is STARTED once it's online.
     The runtime will be polled for 10 min to verify that it is online.
     If it is not, then the runtime will be deleted.
     Note: This doesn't need to block anything.
     """
-    # Perhaps, the least performant code ever written
-    # This is why *real* companies use leetcode
-    runtime_nums: set[int] = set()
-    with Session() as session:
-        runtimes = crud.get_runtimes(
-            session, limit=1000000
-        )  # lul better hope you don't run out of memory
-        for runtime in runtimes:
-            runtime_nums.add(runtime.service_no)
-
-    next_runtime_number = 1
-    while next_runtime_number in runtime_nums:
-        next_runtime_number += 1
-
-    aws_config: AWSConfig = get_aws_config(next_runtime_number)
-
-    host = f"{aws_config.subdomain}.{aws_config.host}"
-    url = f"https://{host}"
-    with Session() as session:
-        runtime = crud.create_runtime(
-            session,
-            RuntimeBase(
-                url=url,
-                started=False,
-                service_no=next_runtime_number,
-            ),
+
+    def runtime_for(service_no: int) -> RuntimeBase:
+        aws_config = get_aws_config(service_no)
+        return RuntimeBase(
+            url=f"https://{aws_config.subdomain}.{aws_config.host}",
+            service_no=service_no,
         )
+
+    async with AsyncSession() as session:
+        runtime = await async_crud.create_runtime(session, runtime_for)
+        if runtime is None:
+            raise HTTPException(
+                status_code=503,
+                detail="Runtimes are being created concurrently. Please retry shortly.",
+            )
+
+        aws_config: AWSConfig = get_aws_config(runtime.service_no)
         res = tasks.create_runtime.delay(
             aws_config_dict=aws_config.model_dump(),
-            runtime_no=next_runtime_number,
+            runtime_no=runtime.service_no,
             runtime_id=runtime.id,
         )
 
-        runtime_create_task: RuntimeCreateTask = crud.create_runtime_create_task(
-            session,
-            RuntimeCreateTaskBase(
-                runtime_id=runtime.id,
-                celery_task_id=res.id,
-            ),
+        runtime_create_task: RuntimeCreateTask = (
+            await async_crud.create_runtime_create_task(
+                session,
+                RuntimeCreateTaskBase(
+                    runtime_id=runtime.id,
+                    celery_task_id=res.id,
+                ),
+            )
         )
 
         return runtime_create_task
 
 
 @app.get("/runtimes")
-def get_runtimes(
+async def get_runtimes(
+    response: Response,
     unused: bool = False,
+    cursor: str | None = None,
+    limit: PageLimit = 100,
 ) -> Sequence[Runtime]:
     """
-    Returns a list of up to 100 runtimes.
+    Returns a page of up to limit runtimes, oldest first.
+    If there are more, the X-Next-Cursor header holds the cursor to pass for the next
+    page.
     """
-    with Session() as session:
-        return [runtime for runtime in crud.get_runtimes(session, unused=unused)]
+    async with AsyncSession() as session:
+        runtimes = await async_crud.get_runtimes(
+            session, unused=unused, cursor=cursor_or_400(cursor), limit=limit
+        )
+    set_next_cursor(response, next_cursor(runtimes, limit))
+    return runtimes
 
 
 @app.get("/runtimes/{runtime_id}")
-def get_runtime(runtime_id: UUID) -> Runtime:
+async def get_runtime(runtime_id: UUID) -> Runtime:
     """
     Returns a runtime by id.
     Raises a 404 if the runtime is not found.
     """
-    with Session() as session:
-        runtime: Runtime | None = crud.get_runtime(session, runtime_id)
+    async with AsyncSession() as session:
+        runtime: Runtime | None = await async_crud.get_runtime(session, runtime_id)
 
     if not runtime:
         raise HTTPException(status_code=404, detail="Runtime not found")
@@ -455,8 +676,55 @@ def get_runtime(runtime_id: UUID) -> Runtime:
     return runtime
 
 
+# Seconds between keep-alive comments on idle event streams, so proxies don't close
+# them.
+EVENT_STREAM_KEEPALIVE = 15
+
+
+@app.get("/tasks/events")
+async def stream_task_events(
+    agent_id: UUID | None = None,
+    runtime_id: UUID | None = None,
+    task_id: UUID | None = None,
+) -> StreamingResponse:
+    """
+    Server-sent events stream of agent start, runtime create and runtime delete task
+    transitions, as JSON TaskEvents. Only events matching every passed id are sent.
+    Events aren't replayed, so read the current status (e.g. GET /tasks/start-agent)
+    after connecting. The stream ends if the client falls too far behind, in which case
+    it should reconnect.
+    """
+
+    def match(event: TaskEvent) -> bool:
+        return (
+            (agent_id is None or event.agent_id == agent_id)
+            and (runtime_id is None or event.runtime_id == runtime_id)
+            and (task_id is None or event.task_id == task_id)
+        )
+
+    async def events() -> AsyncIterator[str]:
+        async with task_status.event_hub.subscribe(match) as queue:
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        queue.get(), timeout=EVENT_STREAM_KEEPALIVE
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    return
+                yield f"event: task\ndata: {event.model_dump_json()}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/tasks/start-agent")
-def get_agent_start_task_status(
+async def get_agent_start_task_status(
     agent_id: UUID | None = None,
     runtime_id: UUID | None = None,
 ) -> TaskStatus | None:
@@ -470,21 +738,21 @@ def get_agent_start_task_status(
     if not agent_id and not runtime_id:
         raise ValueError("At least one of agent_id or runtime_id must be provided")
 
-    with Session() as session:
+    async with AsyncSession() as session:
         agent_start_task = None
         if agent_id and runtime_id:
-            agent_start_task = crud.get_agent_start_task(
+            agent_start_task = await async_crud.get_agent_start_task(
                 session,
                 agent_id=agent_id,
                 runtime_id=runtime_id,
             )
         elif agent_id:
-            agent_start_task = crud.get_agent_start_task(
+            agent_start_task = await async_crud.get_agent_start_task(
                 session,
                 agent_id=agent_id,
             )
         elif runtime_id:
-            agent_start_task = crud.get_agent_start_task(
+            agent_start_task = await async_crud.get_agent_start_task(
                 session,
                 runtime_id=runtime_id,
             )
@@ -494,53 +762,62 @@ def get_agent_start_task_status(
 
         task_id = agent_start_task.celery_task_id
 
-        return get_task_status(task_id)
+        return await get_task_status(task_id)
 
 
 @app.get("/tasks/{task_id}")
-def get_task_status(task_id: UUID) -> TaskStatus:
+async def get_task_status(task_id: UUID) -> TaskStatus:
     """
     Returns the status of a task by id.
     Raises a 404 if the task is not found.
     """
     # TODO: Include more info like traceback if failed.
-    with Session() as session:
-        task = crud.get_task(session, task_id)
+    status = await task_status.get_status(task_id)
+    if status is not None:
+        return status
+
+    async with AsyncSession() as session:
+        task = await async_crud.get_task(session, task_id)
 
-        if not task:
-            raise HTTPException(status_code=404, detail="Task not found")
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
 
-        return TaskStatus(task["status"])
+    status = TaskStatus(task["status"])
+    await task_status.backfill_status(task_id, status)
+    return status
 
 
 @app.post("/agents/{agent_id}/start")
-def start_agent_without_runtime(
+async def start_agent_without_runtime(
     agent_id: UUID,
     is_admin_or_owner: IsAdminOrOwnerDepends,
 ) -> AgentStartTask:
     """
-    Starts an agent. Uses an unused runtime if available.
-    Otherwise, provisions new runtimes and asks the user to retry.
+    Starts an agent on an unused runtime, which is reserved for it until the agent is
+    running (or RUNTIME_CLAIM_LEASE has passed).
+    Raises a 503 if there is none. The autoscaler keeps a pool of them, and is woken up
+    to provision more, so retry shortly.
     """
-    with Session() as session:
-        unused_runtime = crud.get_runtimes(session, unused=True).first()
-    
-        if unused_runtime is None:
-            # Provision new runtimes 
-            to_provision = int(os.getenv("RUNTIME_POOL_INCREMENT", 2))
-            for _ in range(to_provision):
-                create_runtime()
+    async with AsyncSession() as session:
+        runtime = await async_crud.claim_idle_runtime(session, RUNTIME_CLAIM_LEASE)
 
-            raise HTTPException(
-                status_code=503,
-                detail="Provisioning new runtime(s). Please retry shortly.",
-            )
+    if runtime is None:
+        runtime_autoscaler.miss()
+        raise HTTPException(
+            status_code=503,
+            detail="Provisioning new runtime(s). Please retry shortly.",
+        )
 
-        return start_agent(agent_id, unused_runtime.id, is_admin_or_owner)
+    try:
+        return await start_agent(agent_id, runtime.id, is_admin_or_owner)
+    except HTTPException:
+        async with AsyncSession() as session:
+            await async_crud.release_runtime(session, runtime)
+        raise
 
 
 @app.post("/agents/{agent_id}/start/{runtime_id}")
-def start_agent(
+async def start_agent(
     agent_id: UUID,
     runtime_id: UUID,
     is_admin_or_owner: IsAdminOrOwnerDepends,
@@ -550,8 +827,10 @@ def start_agent(
     Returns a task record that you can retrieve from.
     Returns a 404 if the agent or runtime is not found.
     """
-    with Session() as session:
-        agent: Agent | None = crud.get_agent(session, agent_id)
+    async with AsyncSession() as session:
+        agent: Agent | None = await async_crud.get_agent(
+            session, agent_id, load=crud.LAZY
+        )
 
         if not agent:
             raise HTTPException(status_code=404, detail="Agent not found")
@@ -565,8 +844,14 @@ def start_agent(
     # Must block on both agent_id or runtime_id.
     # That is, there must not be a running task for either agent_id or runtime_id.
     try:
-        task_status_agent: TaskStatus | None = get_agent_start_task_status(agent_id=agent_id)
-        if task_status_agent in (TaskStatus.PENDING, TaskStatus.STARTED):
+        task_status_agent: TaskStatus | None = await get_agent_start_task_status(
+            agent_id=agent_id
+        )
+        if task_status_agent in (
+            TaskStatus.PENDING,
+            TaskStatus.STARTED,
+            TaskStatus.RETRY,
+        ):
             raise HTTPException(
                 status_code=400,
                 detail=f"There is already a {task_status_agent} task for agent {agent_id}",
@@ -576,8 +861,14 @@ def start_agent(
             raise e
 
     try:
-        task_status_runtime: TaskStatus | None = get_agent_start_task_status(runtime_id=runtime_id)
-        if task_status_runtime in (TaskStatus.PENDING, TaskStatus.STARTED):
+        task_status_runtime: TaskStatus | None = await get_agent_start_task_status(
+            runtime_id=runtime_id
+        )
+        if task_status_runtime in (
+            TaskStatus.PENDING,
+            TaskStatus.STARTED,
+            TaskStatus.RETRY,
+        ):
             raise HTTPException(
                 status_code=400,
                 detail=f"There is already a {task_status_runtime} task for runtime {runtime_id}",
@@ -586,7 +877,7 @@ def start_agent(
         if e.status_code != 404:
             raise e
 
-    with Session() as session:
+    async with AsyncSession() as session:
         res = tasks.start_agent.delay(agent_id, runtime_id)
         task_record = AgentStartTaskBase(
             agent_id=agent_id,
@@ -597,21 +888,21 @@ def start_agent(
         #prometheus test metrics
         agent_live_gauge.inc()
         agent_event_counter.labels("start").inc()
-        return crud.create_agent_start_task(session, task_record)
+        return await async_crud.create_agent_start_task(session, task_record)
 
 
 @app.post("/agents/{agent_id}/stop")
-def stop_agent(
+async def stop_agent(
     agent_id: UUID,
     is_admin_or_owner: IsAdminOrOwnerDepends,
 ) -> Agent:
-    with stopped_agents_lock:
-        stopped_agents.add(agent_id)
     """
     Stops an agent running on a runtime.
     """
-    with Session() as session:
-        agent: Agent | None = crud.get_agent(session, agent_id)
+    async with AsyncSession() as session:
+        agent: Agent | None = await async_crud.get_agent(
+            session, agent_id, load=crud.LAZY
+        )
 
         if not agent:
             raise HTTPException(status_code=404, detail="Agent not found")
@@ -625,7 +916,7 @@ def stop_agent(
         if not runtime_id:
             raise HTTPException(status_code=404, detail="Agent has no runtime")
 
-        runtime: Runtime | None = crud.get_runtime(session, runtime_id)
+        runtime: Runtime | None = await async_crud.get_runtime(session, runtime_id)
         if not runtime:
             raise HTTPException(status_code=404, detail="Runtime not found")
 
@@ -635,14 +926,18 @@ def stop_agent(
 
         try:
             stop_endpoint = f"{runtime.url}/controller/character/stop"
-            resp = requests.post(stop_endpoint, timeout=3)
+            async with httpx.AsyncClient() as client:
+                resp = await client.post(stop_endpoint, timeout=3)
             resp.raise_for_status()
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             raise HTTPException(
                 status_code=500,
                 detail=f"Failed to stop agent subprocess: {str(e)}"
             )
-        stopped_agent = crud.update_agent(session, agent, AgentUpdate(runtime_id=None))
+        stopped_agent = await async_crud.update_agent(
+            session, agent, AgentUpdate(runtime_id=None)
+        )
+        await forget_heartbeats(agent_id)
 
         logger.info(f"[stop_agent] Agent {agent.id} stopped by user {is_admin_or_owner.__self__.id}")
 
@@ -651,13 +946,11 @@ def stop_agent(
         agent_killed_counter.inc()
         agent_event_counter.labels("kill").inc()
 
-        cleanup_idle_runtimes(session)
-
         return stopped_agent
 
 
 @app.delete("/agents/{agent_id}")
-def delete_agent(
+async def delete_agent(
     agent_id: UUID,
     is_admin_or_owner: IsAdminOrOwnerDepends,
 ):
@@ -666,8 +959,10 @@ def delete_agent(
     Raises a 404 if the agent is not found.
     Raises a 403 if the agent does not belong to the currently signed in user.
     """
-    with Session() as session:
-        agent: Agent | None = crud.get_agent(session, agent_id)
+    async with AsyncSession() as session:
+        agent: Agent | None = await async_crud.get_agent(
+            session, agent_id, load=crud.LAZY
+        )
 
         if not agent:
             raise HTTPException(status_code=404, detail="Agent not found")
@@ -678,9 +973,10 @@ def delete_agent(
             )
 
         if agent.runtime_id:
-            stop_agent(agent_id, is_admin_or_owner)
+            await stop_agent(agent_id, is_admin_or_owner)
 
-        crud.delete_agent(session, agent)
+        await async_crud.delete_agent(session, agent)
+    await forget_heartbeats(agent_id)
 
 
 # TODO: Auth wallets by jwt token
@@ -690,8 +986,9 @@ async def create_wallet(wallet: WalletBase) -> Wallet:
     Creates a new wallet.
     Returns the wallet address and private key.
     """
-    with Session() as session:
-        wallet = crud.create_wallet(session, wallet)
+    async with AsyncSession() as session:
+        wallet = await async_crud.create_wallet(session, wallet)
+        invalidate_identity()
         return wallet
 
 
@@ -715,17 +1012,17 @@ async def get_wallets(
         )
 
     wallet: Wallet | Sequence[Wallet] | None = None
-    with Session() as session:
+    async with AsyncSession() as session:
         if wallet_id:
-            wallet = crud.get_wallet(session, wallet_id)
+            wallet = await async_crud.get_wallet(session, wallet_id)
         elif public_key:
-            wallet = crud.get_wallet_by_public_key(
+            wallet = await async_crud.get_wallet_by_public_key(
                 session,
                 public_key,
                 chain,
             )
         elif owner_id:
-            wallet = crud.get_wallets_by_owner(session, owner_id)
+            wallet = await async_crud.get_wallets_by_owner(session, owner_id)
 
         if wallet is None:
             raise HTTPException(status_code=404, detail="Wallet not found")
@@ -745,13 +1042,14 @@ async def update_wallet(
             detail="You do not have permission to update a wallet that doesn't belong to you",
         )
 
-    with Session() as session:
-        wallet = crud.get_wallet(session, wallet_id)
+    async with AsyncSession() as session:
+        wallet = await async_crud.get_wallet(session, wallet_id)
 
         if not wallet:
             raise HTTPException(status_code=404, detail="Wallet not found")
 
-        wallet = crud.update_wallet(session, wallet, wallet_update)
+        wallet = await async_crud.update_wallet(session, wallet, wallet_update)
+        invalidate_identity()
 
         return wallet
 
@@ -772,13 +1070,14 @@ async def delete_wallet(
             detail="You do not have permission to delete a wallet that doesn't belong to you",
         )
 
-    with Session() as session:
-        wallet = crud.get_wallet(session, wallet_id)
+    async with AsyncSession() as session:
+        wallet = await async_crud.get_wallet(session, wallet_id)
 
         if not wallet:
             raise HTTPException(status_code=404, detail="Wallet not found")
 
-        crud.delete_wallet(session, wallet)
+        await async_crud.delete_wallet(session, wallet)
+        invalidate_identity()
 
 
 @app.post("/users")
@@ -798,12 +1097,34 @@ async def create_user(
             detail="You do not have permission to create a user that doesn't belong to you",
         )
 
-    with Session() as session:
-        user = crud.create_user(session, user)
+    async with AsyncSession() as session:
+        user = await async_crud.create_user(session, user)
 
     return user
 
 
+@app.get(
+    "/users/all",
+    dependencies=[Security(check_scopes("admin"))],
+)
+async def get_users(
+    response: Response,
+    cursor: str | None = None,
+    limit: PageLimit = 100,
+) -> Sequence[User]:
+    """
+    Returns a page of up to limit users, oldest first.
+    If there are more, the X-Next-Cursor header holds the cursor to pass for the next
+    page. Requires admin.
+    """
+    async with AsyncSession() as session:
+        users = await async_crud.get_users(
+            session, cursor=cursor_or_400(cursor), limit=limit
+        )
+    set_next_cursor(response, next_cursor(users, limit))
+    return users
+
+
 @app.get("/users")
 async def get_user(
     user_id: UUID | None = None,
@@ -815,7 +1136,7 @@ async def get_user(
     Raises a 400 if more than one of user_id, public_key, or dynamic_id are passed.
     Raises a 404 if the user is not found.
     Otherwise, returns the user by query parameter.
-    """
+     """
     num_params = sum([bool(user_id), bool(public_key), bool(dynamic_id)])
     if num_params != 1:
         raise HTTPException(
@@ -824,13 +1145,13 @@ async def get_user(
         )
 
     user = None
-    with Session() as session:
+    async with AsyncSession() as session:
         if user_id:
-            user = crud.get_user(session, user_id)
+            user = await async_crud.get_user(session, user_id)
         elif public_key:
-            user = crud.get_user_by_public_key(session, public_key, chain)
+            user = await async_crud.get_user_by_public_key(session, public_key, chain)
         elif dynamic_id:
-            user = crud.get_user_by_dynamic_id(session, dynamic_id)
+            user = await async_crud.get_user_by_dynamic_id(session, dynamic_id)
 
         if user is None:
             raise HTTPException(status_code=404, detail="User not found")
@@ -850,7 +1171,7 @@ async def update_user(
     user_id: UUID of user to update
     user_update: UserUpdate object with fields to update
     current_user: User object of the currently signed in user making the request. Comes from Auth headers.
-     """
+    """
 
     if not is_admin_or_owner(user_id):
         raise HTTPException(
@@ -858,13 +1179,14 @@ async def update_user(
             detail="You do not have permission to update a user other than your own",
         )
 
-    with Session() as session:
-        user = crud.get_user(session, user_id)
+    async with AsyncSession() as session:
+        user = await async_crud.get_user(session, user_id)
 
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
-        user = crud.update_user(session, user, user_update)
+        user = await async_crud.update_user(session, user, user_update)
+        invalidate_identity(user.dynamic_id)
 
     return user
 
@@ -885,52 +1207,51 @@ async def delete_user(
             detail="You do not have permission to delete a user other than your own",
         )
 
-    with Session() as session:
-        user = crud.get_user(session, user_id)
+    async with AsyncSession() as session:
+        user = await async_crud.get_user(session, user_id)
 
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
-        crud.delete_user(session, user)
+        await async_crud.delete_user(session, user)
+        invalidate_identity(user.dynamic_id)
+
 
 @app.delete(
     "/runtimes/{runtime_id}",
     dependencies=[Security(check_scopes("admin"))],
 )
-def delete_runtime(
+async def delete_runtime(
     runtime_id: UUID,
 ) -> RuntimeDeleteTask:
     """
     Deletes a runtime by id.
     Raises a 404 if the runtime is not found.
     """
-    with Session() as session:
-        runtime: Runtime | None = crud.get_runtime(session, runtime_id)
+    async with AsyncSession() as session:
+        runtime: Runtime | None = await async_crud.get_runtime(session, runtime_id)
         if not runtime:
             raise HTTPException(status_code=404, detail="Runtime not found")
 
         res = tasks.delete_runtime.delay(runtime_id)
-        runtime_delete_task: RuntimeDeleteTask = crud.create_runtime_delete_task(
-            session,
-            RuntimeDeleteTaskBase(
-                runtime_id=runtime_id,
-                celery_task_id=res.id,
-            ),
+        runtime_delete_task: RuntimeDeleteTask = (
+            await async_crud.create_runtime_delete_task(
+                session,
+                RuntimeDeleteTaskBase(
+                    runtime_id=runtime_id,
+                    celery_task_id=res.id,
+                ),
+            )
         )
 
         return runtime_delete_task
 
+
 @app.get("/metrics_prometheus")
 async def metrics_prometheus():
     return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
-def cleanup_idle_runtimes(session: Session) -> None:
-    """
-    Deletes idle runtimes if they exceed the allowed pool size.
-    """
-    idle_runtimes = crud.get_idle_runtimes(session)  # Returns runtimes with no agent
 
-    if len(idle_runtimes) > RUNTIME_IDLE_POOL_SIZE:
-        excess = idle_runtimes[RUNTIME_IDLE_POOL_SIZE:]
-        for r in excess:
-            delete_runtime.delay(r.id)
+tick_lock_client = redis_clients.async_client()
+runtime_autoscaler = RuntimeAutoscaler(create_runtime, delete_runtime, tick_lock_client)
+launch_watcher = LaunchWatcher(tick_lock_client)
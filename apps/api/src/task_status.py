@@ -0,0 +1,195 @@
+"""
+Cache of celery task statuses, so that polling a task's status doesn't query
+celery_taskmeta. Status transitions are written to redis from celery signals (see
+tasks.py): PENDING by whoever publishes the task, STARTED/SUCCESS/FAILURE by the worker
+running it.
+Reads go: in-process cache (terminal statuses only, since they never change) -> redis ->
+db. Redis is best effort. If it's unreachable, reads fall through to the db, which stays
+the source of truth.
+
+Transitions of agent start/runtime create/runtime delete tasks are also published on a
+redis channel, pipelined with the status write, which each api process relays to its
+event stream subscribers through a TaskEventHub.
+"""
+
+import asyncio
+import os
+import time
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+from uuid import UUID
+
+import redis
+
+from src import logger, redis_clients
+from src.cache import TTLCache
+from src.models import TaskEvent, TaskStatus
+
+# Matches celery's default result_expires.
+TASK_STATUS_TTL = int(os.getenv("TASK_STATUS_TTL", 24 * 60 * 60))
+# After a redis error, go straight to the db for this many seconds.
+REDIS_RETRY_INTERVAL = 5
+KEY_PREFIX = "task-status:"
+EVENTS_CHANNEL = "task-events"
+TERMINAL_STATUSES = frozenset({TaskStatus.SUCCESS, TaskStatus.FAILURE})
+
+sync_client = redis_clients.sync_client()
+async_client = redis_clients.async_client()
+# No socket_timeout, since subscriptions block on reads until an event arrives.
+pubsub_client = redis_clients.async_client(
+    socket_timeout=None, health_check_interval=30
+)
+terminal_statuses: TTLCache[str, TaskStatus] = TTLCache(maxsize=10_000)
+_skip_redis_until = 0.0
+
+
+def _key(task_id: UUID | str) -> str:
+    return f"{KEY_PREFIX}{task_id}"
+
+
+def _redis_available() -> bool:
+    return time.time() >= _skip_redis_until
+
+
+def _redis_failed(e: redis.RedisError) -> None:
+    global _skip_redis_until
+    _skip_redis_until = time.time() + REDIS_RETRY_INTERVAL
+    logger.warning(f"Task status cache unavailable: {e}")
+
+
+def _remember_terminal(task_id: UUID | str, status: TaskStatus) -> None:
+    if status in TERMINAL_STATUSES:
+        terminal_statuses.set(str(task_id), status, time.time() + TASK_STATUS_TTL)
+
+
+def set_status(
+    task_id: UUID | str,
+    status: TaskStatus,
+    only_if_new: bool = False,
+    event: TaskEvent | None = None,
+) -> None:
+    """
+    Records a status transition. Called from celery signal handlers, so it's sync.
+    PENDING is recorded by whoever publishes the task, e.g. on the api's event loop, so
+    it's one round trip.
+    only_if_new: don't overwrite an existing status, e.g. PENDING arriving after
+    STARTED.
+    event: Published to event stream subscribers, in the same round trip.
+    """
+    _remember_terminal(task_id, status)
+    if not _redis_available():
+        return
+    pipe = sync_client.pipeline(transaction=False)
+    pipe.set(_key(task_id), status.value, ex=TASK_STATUS_TTL, nx=only_if_new)
+    if event is not None:
+        pipe.publish(EVENTS_CHANNEL, event.model_dump_json())
+    try:
+        pipe.execute()
+    except redis.RedisError as e:
+        _redis_failed(e)
+
+
+async def get_status(task_id: UUID) -> TaskStatus | None:
+    """
+    Returns the cached status, or None if it has to be read from the db.
+    """
+    status = terminal_statuses.get(str(task_id))
+    if status is not None or not _redis_available():
+        return status
+
+    try:
+        value = await async_client.get(_key(task_id))
+    except redis.RedisError as e:
+        _redis_failed(e)
+        return None
+    if value is None:
+        return None
+
+    status = TaskStatus(value.decode())
+    _remember_terminal(task_id, status)
+    return status
+
+
+async def backfill_status(task_id: UUID, status: TaskStatus) -> None:
+    """
+    Caches a status read from the db, so that the next read doesn't go to the db.
+    Doesn't overwrite a newer status that a worker may have written in the meantime.
+    """
+    _remember_terminal(task_id, status)
+    if not _redis_available():
+        return
+    try:
+        await async_client.set(_key(task_id), status.value, ex=TASK_STATUS_TTL, nx=True)
+    except redis.RedisError as e:
+        _redis_failed(e)
+
+
+class TaskEventHub:
+    """
+    Fans task events out from one redis subscription per process to any number of
+    subscribers, so that open event streams don't each hold a redis connection.
+    """
+
+    # Events buffered per subscriber. A subscriber that falls this far behind is
+    # disconnected, rather than silently missing events. Clients reconnect and re-read
+    # the status.
+    MAX_BUFFERED = 256
+    RECONNECT_INTERVAL = 5
+
+    def __init__(self) -> None:
+        self._subscribers: dict[
+            asyncio.Queue[TaskEvent | None], Callable[[TaskEvent], bool]
+        ] = {}
+
+    @asynccontextmanager
+    async def subscribe(
+        self, match: Callable[[TaskEvent], bool]
+    ) -> AsyncIterator[asyncio.Queue[TaskEvent | None]]:
+        """
+        Yields a queue of the events for which match returns True.
+        None on the queue means the subscriber was dropped for falling behind.
+        """
+        queue: asyncio.Queue[TaskEvent | None] = asyncio.Queue(self.MAX_BUFFERED)
+        self._subscribers[queue] = match
+        try:
+            yield queue
+        finally:
+            self._subscribers.pop(queue, None)
+
+    def dispatch(self, event: TaskEvent) -> None:
+        for queue, match in list(self._subscribers.items()):
+            if not match(event):
+                continue
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                del self._subscribers[queue]
+                queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def run(self) -> None:
+        """
+        Relays events from redis until cancelled. Meant to run for the lifetime of the
+        api.
+        """
+        while True:
+            try:
+                async with pubsub_client.pubsub() as pubsub:
+                    await pubsub.subscribe(EVENTS_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+                        # A bad message is dropped, rather than ending the relay.
+                        try:
+                            event = TaskEvent.model_validate_json(message["data"])
+                            self.dispatch(event)
+                        except Exception as e:
+                            logger.exception(
+                                f"Dropping task event {message['data']}: {e}"
+                            )
+            except redis.RedisError as e:
+                logger.warning(f"Task event subscription failed: {e}")
+                await asyncio.sleep(self.RECONNECT_INTERVAL)
+
+
+event_hub = TaskEventHub()
@@ -1,38 +1,52 @@
+import asyncio
+import inspect
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from time import sleep
-from typing import Sequence
+from typing import Any, Callable, Sequence
 from uuid import UUID
 
-import botocore
 import requests
-from boto3 import Session as Boto3Session
-from celery import Celery
+from botocore.exceptions import ClientError
+from celery import Celery, Task
+from celery.app.task import Context
+from celery.signals import (
+    after_task_publish,
+    task_failure,
+    task_prerun,
+    task_retry,
+    task_success,
+)
 from celery.utils.log import get_task_logger
 from mypy_boto3_ecs.client import ECSClient
 from mypy_boto3_elbv2.client import ElasticLoadBalancingv2Client as ELBv2Client
-from requests.exceptions import HTTPError
+from sqlmodel import Session as SQLModelSession
 
 from src.aws_utils import (
     create_http_target_group,
     create_listener_rules,
     create_runtime_service,
+    find_listener_rule,
+    find_service,
+    find_target_group,
     get_aws_config,
-    get_role_session,
+    get_ecs_client,
+    get_elbv2_client,
+    get_latest_task_definition_revision,
+    get_service_status,
 )
 from src.db import crud
 from src.db.models import (
-    Agent,
     AgentUpdate,
     Runtime,
-    RuntimeCreateTask,
-    RuntimeDeleteTask,
+    RuntimeStep,
     RuntimeUpdate,
-    RuntimeUpdateTask,
+    TEARDOWN_STEPS,
 )
 from src.db.setup import SQLALCHEMY_DATABASE_URL, Session
-from src.models import AWSConfig, TaskStatus
-from src.utils import obj_or_404
+from src.healthcheck import RuntimeTarget, probe_runtimes
+from src.models import AWSConfig, TaskEvent, TaskStatus
+from src.task_status import set_status
 
 logger = get_task_logger(__name__)
 db_password = os.getenv("POSTGRES_DB_PASSWORD")
@@ -57,151 +71,193 @@ def setup_periodic_tasks(sender: Celery, **kwargs):
     )
 
 
-# TODO
-# Update polling tasks to be non-blocking on worker concurrency slots.
-# Maybe recursively call a polling task? not sure.
+# region Task status signals
+# Mirror task state transitions into the status cache, and publish those of lifecycle
+# tasks to event stream subscribers. See task_status.py.
+LIFECYCLE_TASKS = {"start_agent", "create_runtime", "delete_runtime"}
 
 
-@app.task
-def healthcheck_runtimes() -> None | str:
-    """
-    Polls all runtimes to see if they are healthy.
-    If they are not healthy, then they are updated and restarted
-    """
-    with Session() as session:
-        runtimes: Sequence[Runtime] = crud.get_runtimes(session)
-        runtime_ids = [runtime.id for runtime in runtimes]
+def record_transition(
+    task_name: str,
+    task_id: str,
+    status: TaskStatus,
+    args: Sequence[Any] | None,
+    kwargs: dict[str, Any] | None,
+    only_if_new: bool = False,
+) -> None:
+    short_name = task_name.rsplit(".", 1)[-1]
+    if short_name not in LIFECYCLE_TASKS or task_name not in app.tasks:
+        set_status(task_id, status, only_if_new=only_if_new)
+        return
+    arguments: dict[str, Any]
+    try:
+        arguments = (
+            inspect.signature(app.tasks[task_name].run)
+            .bind_partial(*(args or ()), **(kwargs or {}))
+            .arguments
+        )
+    except TypeError:
+        arguments = {}
+    event = TaskEvent(
+        task_id=task_id,
+        task=short_name,
+        status=status,
+        agent_id=arguments.get("agent_id"),
+        runtime_id=arguments.get("runtime_id"),
+    )
+    set_status(task_id, status, only_if_new=only_if_new, event=event)
 
-    for runtime_id in runtime_ids:
-        healthcheck_runtime.delay(runtime_id)
-    return None
 
+@after_task_publish.connect
+def on_task_published(
+    sender: str, headers: dict | None = None, body: tuple | None = None, **kwargs
+) -> None:
+    if not headers or "id" not in headers:
+        return
+    # Message protocol 2: body is (args, kwargs, embed)
+    task_args, task_kwargs, _ = body if body else ((), {}, None)
+    record_transition(
+        sender,
+        headers["id"],
+        TaskStatus.PENDING,
+        task_args,
+        task_kwargs,
+        only_if_new=True,
+    )
 
-@app.task
-def healthcheck_runtime(runtime_id: UUID) -> str:
-    """
-    Healthchecks a single runtime to see if it is healthy.
-    If it is not healthy, then it is updated and restarted.
-    If it can't be updated and restarted, then it is deleted? Not sure about htis part.
-    """
-    FAILED_HEALTHCHECKS_BEFORE_UPDATE = 3
-    FAILED_HEALTHCHECKS_BEFORE_DELETE = 5
 
-    # Don't do the healthcheck if:
-    # There is a running runtime task already (e.g. starting, updating, deleting, healthchecking)
-    with Session() as session:
-        runtime_create_task: RuntimeCreateTask | None
-        runtime_update_task: RuntimeUpdateTask | None
-        runtime_delete_task: RuntimeDeleteTask | None
-        task_status: TaskStatus | None
-        runtime_task: RuntimeCreateTask | RuntimeUpdateTask | RuntimeDeleteTask | None
-        runtime_create_task = crud.get_runtime_create_task(session, runtime_id)
-        if runtime_create_task := crud.get_runtime_create_task(session, runtime_id):
-            runtime_task = runtime_create_task
-        elif runtime_update_task := crud.get_runtime_update_task(session, runtime_id):
-            runtime_task = runtime_update_task
-        elif runtime_delete_task := crud.get_runtime_delete_task(session, runtime_id):
-            runtime_task = runtime_delete_task
-        else:
-            runtime_task = None
-        if runtime_task:
-            task = crud.get_task(session, runtime_task.celery_task_id)
-            if not task:
-                raise ValueError(
-                    "Task not found. Most likely it is pending and a worker has not picked it up yet."
-                )
-            task_status = TaskStatus(task["status"])
+@task_prerun.connect
+def on_task_started(
+    task_id: str, task: Task, args: Sequence[Any], kwargs: dict[str, Any], **_
+) -> None:
+    record_transition(task.name, task_id, TaskStatus.STARTED, args, kwargs)
 
-        if task_status == TaskStatus.PENDING or TaskStatus.STARTED:
-            logger.info(
-                f"Runtime {runtime_id} is already being created, updated, or deleted. Skipping healthcheck."
-            )
-            return "Runtime is already being created, updated, or deleted. Skipping healthcheck."
 
-    with Session() as session:
-        runtime: Runtime = obj_or_404(crud.get_runtime(session, runtime_id), Runtime)
-        agent: Agent | None = runtime.agent
+@task_success.connect
+def on_task_succeeded(sender: Task, **kwargs) -> None:
+    request = sender.request
+    record_transition(
+        sender.name, request.id, TaskStatus.SUCCESS, request.args, request.kwargs
+    )
 
-    try:
-        resp = requests.get(f"{runtime.url}/ping")
-        resp.raise_for_status()
-        resp = requests.get(f"{runtime.url}/controller/ping")
-        resp.raise_for_status()
-        with Session() as session:
-            crud.update_runtime(
-                session,
-                runtime,
-                RuntimeUpdate(
-                    last_healthcheck=datetime.now(),
-                    failed_healthchecks=0,
-                ),
-            )
 
-    except HTTPError as e:
-        logger.info(f"{repr(e)}: Runtime {runtime_id} is unhealthy.")
+@task_retry.connect
+def on_task_retried(sender: Task, request: Context, **_) -> None:
+    record_transition(
+        sender.name, request.id, TaskStatus.RETRY, request.args, request.kwargs
+    )
+
+
+@task_failure.connect
+def on_task_failed(
+    sender: Task, task_id: str, args: Sequence[Any], kwargs: dict[str, Any], **_
+) -> None:
+    record_transition(sender.name, task_id, TaskStatus.FAILURE, args, kwargs)
 
-        with Session() as session:
-            runtime = obj_or_404(crud.get_runtime(session, runtime_id), Runtime)
-            crud.update_runtime(
-                session,
-                runtime,
-                RuntimeUpdate(failed_healthchecks=runtime.failed_healthchecks + 1),
-            )
 
-        if runtime.failed_healthchecks > FAILED_HEALTHCHECKS_BEFORE_DELETE:
-            delete_runtime.delay(runtime_id)
-            return "Runtime failed healthcheck too many times. Deleting it."
-        elif runtime.failed_healthchecks > FAILED_HEALTHCHECKS_BEFORE_UPDATE:
-            return "Runtime is unhealthy. No update attempted."
+# endregion Task status signals
 
-    # 3. Check if the character running on the runtime is healthy
-    if agent:
-        healthcheck_running_agent.delay(agent.id)
 
-    return "Runtime is healthy."
+# Runtimes failing more consecutive healthchecks than this are deleted.
+FAILED_HEALTHCHECKS_BEFORE_DELETE = 5
+# ... and more than this are reported as unhealthy. TODO: update them.
+FAILED_HEALTHCHECKS_BEFORE_UPDATE = 3
+# Runtimes whose latest create/update/delete task has one of these (celery) statuses
+# aren't healthchecked.
+RUNTIME_TASK_IN_PROGRESS = {
+    status.value
+    for status in (TaskStatus.PENDING, TaskStatus.STARTED, TaskStatus.RETRY)
+}
 
 
 @app.task
-def healthcheck_running_agent(agent_id: UUID) -> None | str:
+def healthcheck_runtimes() -> str:
     """
-    Healthchecks an agent that should be running on a runtime.
-    Restarts if it is down.
+    Healthchecks all started runtimes, and the agents that should be running on them.
+    Runtimes are probed concurrently (see healthcheck.py) and the results recorded in
+    one update. Runtimes that fail too many healthchecks in a row are deleted, and
+    agents that aren't running are restarted.
+    Runtimes being provisioned or torn down aren't started, so they're skipped, as are
+    runtimes with a create/update/delete task in progress.
     """
     with Session() as session:
-        agent: Agent = obj_or_404(crud.get_agent(session, agent_id), Agent)
-        runtime: Runtime | None = agent.runtime
-        if runtime is None:
-            return "Agent should not be running on any runtime."
-
-    resp = requests.get(f"{runtime.url}/controller/character/status", timeout=3)
-    resp.raise_for_status()
-    # An HTTP error here means either the runtime is down, or the fastapi controller is down
-    # This is unexpected, and should be handled by healthcheck_runtime. So, just raise an exception here.
-
-    character_status = resp.json()
-    # Make sure that the character matches the expected running agent.
-    running: bool = character_status.get("running")
-    running_character_agent_id: str = character_status.get("agent_id")
-    # TODO: Improve agent health check coverage - this isn't comprehensive
-    # Agent might be running, but not chattable.
-    # This only covers client-direct, but not other clients (e.g. what if twitter client is down?)
-    if (
-        not running
-        or not running_character_agent_id
-        or running_character_agent_id != agent.eliza_agent_id
-    ):
+        runtimes = crud.get_started_runtimes_with_agents(session)
+        latest_tasks = crud.get_latest_runtime_tasks(
+            session, [runtime.id for runtime, _ in runtimes]
+        )
+    busy = {
+        runtime_id
+        for runtime_id, task in latest_tasks.items()
+        if task.status in RUNTIME_TASK_IN_PROGRESS
+    }
+    if busy:
         logger.info(
-            f"Expected agent {agent.eliza_agent_id} to be running on runtime {runtime.id}. But either no agent was running, or the wrong agent was running."  # noqa
+            f"Runtimes {busy} are already being created, updated, or deleted. "
+            "Skipping their healthchecks."
         )
-        #
-        start_agent.delay(agent_id=agent.id, runtime_id=runtime.id)
-    return None
+    targets = [
+        RuntimeTarget(
+            runtime_id=runtime.id,
+            url=runtime.url,
+            expected_agent=agent.eliza_agent_id if agent else None,
+        )
+        for runtime, agent in runtimes
+        if runtime.id not in busy
+    ]
+    agent_ids = {runtime.id: agent.id for runtime, agent in runtimes if agent}
 
+    results = asyncio.run(probe_runtimes(targets))
 
-@app.task
-def start_agent(agent_id: UUID, runtime_id: UUID) -> None:
     with Session() as session:
-        # 1. Stop the old agent (if it exists)
+        failed_healthchecks = crud.record_healthchecks(
+            session,
+            healthy_ids=[r.runtime_id for r in results if r.healthy],
+            unhealthy_ids=[r.runtime_id for r in results if not r.healthy],
+            checked_at=datetime.now(),
+        )
+
+    for result in results:
+        failures = failed_healthchecks.get(result.runtime_id)
+        if failures is None:
+            continue
+        if failures > FAILED_HEALTHCHECKS_BEFORE_DELETE:
+            logger.info(
+                f"Runtime {result.runtime_id} failed healthcheck too many times. "
+                "Deleting it."
+            )
+            delete_runtime.delay(runtime_id=result.runtime_id)
+        elif failures > FAILED_HEALTHCHECKS_BEFORE_UPDATE:
+            logger.info(
+                f"Runtime {result.runtime_id} is unhealthy. No update attempted."
+            )
+        elif result.agent_running is False:
+            agent_id = agent_ids[result.runtime_id]
+            logger.info(
+                f"Expected agent {agent_id} to be running on runtime "
+                f"{result.runtime_id}. But either no agent was running, or the wrong "
+                "agent was running."
+            )
+            start_agent.delay(agent_id=agent_id, runtime_id=result.runtime_id)
+
+    healthy = sum(result.healthy for result in results)
+    return f"{healthy}/{len(results)} runtimes healthy."
+
+
+# Seconds between polls of a starting agent, and the number of polls before giving up.
+START_AGENT_POLL_INTERVAL = 10
+START_AGENT_MAX_POLLS = 60
+
+
+@app.task(bind=True, max_retries=START_AGENT_MAX_POLLS)
+def start_agent(self: Task, agent_id: UUID, runtime_id: UUID) -> None:
+    """
+    Starts an agent on a runtime, then polls the runtime until the agent is running.
+    Instead of sleeping between polls, the task retries itself (same task id) with a
+    countdown, so that it only holds a worker slot for the duration of a single poll.
+    The poll attempt is self.request.retries, which travels with the task message.
+    """
+    attempt = self.request.retries
+    with Session() as session:
         runtime = crud.get_runtime(session, runtime_id)
         if runtime is None:
             raise ValueError(f"Runtime {runtime_id} does not exist")
@@ -209,85 +265,195 @@ def start_agent(agent_id: UUID, runtime_id: UUID) -> None:
         if agent is None:
             raise ValueError(f"Agent {agent_id} does not exist")
 
-        stop_endpoint = f"{runtime.url}/controller/character/stop"
-        resp = requests.post(stop_endpoint)
-        resp.raise_for_status()
-        if (old_agent := runtime.agent) is not None:
-            if old_agent:
-                crud.update_agent(
-                    session,
-                    old_agent,
-                    AgentUpdate(runtime_id=None),
-                )
-
-        # 2. Start the new agent
-        start_endpoint = f"{runtime.url}/controller/character/start"
-        character_json: dict = agent.character_json
-        env_file: str = agent.env_file
-        resp = requests.post(
-            start_endpoint,
-            json={
-                "character_json": character_json,
-                "envs": env_file,
-            },
-        )
-        resp.raise_for_status()
-
-    # Poll the runtime until the agent is running
-    for i in range(1, 61):
-        resp = requests.get(f"{runtime.url}/controller/character/status")
-        logger.info(f"{i}/{60}: Polling for agent to start")
-        if resp.status_code == 200 and resp.json()["running"]:
-            eliza_agent_id = resp.json()["agent_id"]
-            with Session() as session:
-                agent = crud.update_agent(
-                    session,
-                    agent,
-                    AgentUpdate(runtime_id=runtime_id, eliza_agent_id=eliza_agent_id),
-                )
-                logger.info(f"Agent started. Updated agent in db to {agent}")
-            return
-        sleep(10)
+        if attempt == 0:
+            # 1. Stop the old agent (if it exists)
+            stop_endpoint = f"{runtime.url}/controller/character/stop"
+            resp = requests.post(stop_endpoint)
+            resp.raise_for_status()
+            if (old_agent := runtime.agent) is not None:
+                if old_agent:
+                    crud.update_agent(
+                        session,
+                        old_agent,
+                        AgentUpdate(runtime_id=None),
+                    )
+
+            # 2. Start the new agent
+            start_endpoint = f"{runtime.url}/controller/character/start"
+            character_json: dict = agent.character_json
+            env_file: str = agent.env_file
+            resp = requests.post(
+                start_endpoint,
+                json={
+                    "character_json": character_json,
+                    "envs": env_file,
+                },
+            )
+            resp.raise_for_status()
 
-    # agent failed to start - mark the task as failed
-    # TODO: Improve failed to start.
-    raise Exception("Agent failed to start")
+    # 3. Poll the runtime until the agent is running
+    logger.info(f"{attempt + 1}/{START_AGENT_MAX_POLLS}: Polling for agent to start")
+    try:
+        resp = requests.get(f"{runtime.url}/controller/character/status", timeout=3)
+        character_status = resp.json() if resp.status_code == 200 else {}
+    except requests.RequestException as e:
+        logger.info(f"Runtime {runtime_id} did not respond: {e}")
+        character_status = {}
+
+    if character_status.get("running"):
+        eliza_agent_id = character_status["agent_id"]
+        with Session() as session:
+            agent = crud.update_agent(
+                session,
+                agent,
+                AgentUpdate(runtime_id=runtime_id, eliza_agent_id=eliza_agent_id),
+            )
+            # Taken by the agent now, so no longer needs reserving.
+            crud.update_runtime(session, runtime, RuntimeUpdate(reserved_until=None))
+            logger.info(f"Agent started. Updated agent in db to {agent}")
+        return
+
+    if attempt + 1 >= START_AGENT_MAX_POLLS:
+        # agent failed to start - mark the task as failed
+        # TODO: Improve failed to start.
+        raise Exception("Agent failed to start")
+    raise self.retry(countdown=START_AGENT_POLL_INTERVAL)
+
+
+# Seconds between health polls of a provisioning runtime, and the number of polls before
+# giving up.
+CREATE_RUNTIME_POLL_INTERVAL = 15
+CREATE_RUNTIME_MAX_POLLS = 40
+# Seconds between checks of whether a deleted service has drained, and the number of
+# checks. Matches the services_inactive waiter's defaults.
+DELETE_RUNTIME_POLL_INTERVAL = 15
+DELETE_RUNTIME_MAX_POLLS = 40
+# AWS error codes for resources that don't exist (anymore).
+NOT_FOUND_ERROR_CODES = frozenset(
+    {
+        "ServiceNotFoundException",
+        "ServiceNotActiveException",
+        "RuleNotFound",
+        "TargetGroupNotFound",
+    }
+)
 
 
-@app.task
+@app.task(
+    bind=True,
+    acks_late=True,
+    reject_on_worker_lost=True,
+    max_retries=CREATE_RUNTIME_MAX_POLLS,
+)
 def create_runtime(
+    self: Task,
     aws_config_dict: AWSConfig,
     runtime_no: int,
     runtime_id: UUID,
 ) -> None:
     """
-    Creates a service w/ a basic rollback strategy
-    Creates a target group + listener rule + service, deleting them if health check at the end fails.
+    Provisions a runtime: target group -> listener rules, then service -> health wait ->
+    started. runtime.step is persisted as each step completes. Once the service exists,
+    the health wait retries the task (same task id) with a countdown instead of
+    sleeping, so a worker slot is only held for one poll.
+    If the worker dies, the task is redelivered (acks_late) and resumes from the last
+    completed step. Any other failure tears the runtime down.
     """
+    aws_config: AWSConfig = AWSConfig.model_validate(aws_config_dict)
+    attempt = self.request.retries
     try:
         with Session() as session:
-            aws_config: AWSConfig = AWSConfig.model_validate(aws_config_dict)
-            sts_client: Boto3Session = get_role_session()
-            ecs_client: ECSClient = sts_client.client("ecs")
-            elbv2_client: ELBv2Client = sts_client.client("elbv2")
             runtime = crud.get_runtime(session, runtime_id)
             if runtime is None:
-                raise ValueError(f"Runtime {runtime_id} does not exist")
-            host = f"{aws_config.subdomain}.{aws_config.host}"
-            url = f"https://{host}"
+                logger.info(
+                    f"Runtime {runtime_id} does not exist. Deleted while provisioning?"
+                )
+                return
+            if runtime.step not in (RuntimeStep.HEALTH_WAIT, RuntimeStep.STARTED):
+                provision_runtime(session, runtime, aws_config, runtime_no)
 
-            logger.info(f'Creating target group "{aws_config.target_group_name}"')
-            target_group_arn = create_http_target_group(
-                elbv2_client=elbv2_client,
-                target_group_name=aws_config.target_group_name,
-                vpc_id=aws_config.vpc_id,
-            )
-            runtime = crud.update_runtime(
-                session, runtime, RuntimeUpdate(target_group_arn=target_group_arn)
+            if runtime.step in TEARDOWN_STEPS:
+                logger.info(
+                    f"Runtime {runtime_id} is being deleted. Stopping provisioning."
+                )
+                return
+            if runtime.step == RuntimeStep.STARTED:
+                return
+
+            # Poll runtime to see if it stands up. If it doesn't, throw an error and
+            # rollback.
+            logger.info(
+                f"{attempt + 1}/{CREATE_RUNTIME_MAX_POLLS}: "
+                "Polling runtime for health check"
             )
+            try:
+                url = f"{runtime.url}/controller/ping"  # fastapi server not nginx
+                resp = requests.get(url=url, timeout=3)
+                resp.raise_for_status()
+
+                logger.info(f"Runtime {runtime.id} has started")
+                crud.advance_runtime(
+                    session, runtime, RuntimeUpdate(step=RuntimeStep.STARTED)
+                )
+                return
+            except requests.RequestException as e:
+                logger.info(f"Runtime not online yet. {e}")
+
+        if attempt + 1 >= CREATE_RUNTIME_MAX_POLLS:
+            raise Exception("Runtime did not come online in time. Rolling back.")
+    except Exception as e:
+        logger.error(f"{e}: Rolling back runtime")
+        delete_runtime.delay(runtime_id=runtime_id)
+        raise e
+
+    raise self.retry(countdown=CREATE_RUNTIME_POLL_INTERVAL)
+
 
-            logger.info(f"Creating listener rules for {host}")
-            http_rule_arn, https_rule_arn = create_listener_rules(
+def provision_runtime(
+    session: SQLModelSession,
+    runtime: Runtime,
+    aws_config: AWSConfig,
+    runtime_no: int,
+) -> None:
+    """
+    Runs the remaining provisioning steps up to the health wait, persisting each one.
+    Stops early if another task (i.e. delete_runtime) moves the runtime on.
+    Steps pick up resources a previous attempt created but didn't get to record.
+    """
+    ecs_client = get_ecs_client()
+    elbv2_client = get_elbv2_client()
+    host = f"{aws_config.subdomain}.{aws_config.host}"
+
+    if runtime.step == RuntimeStep.CREATE_TARGET_GROUP:
+        logger.info(f'Creating target group "{aws_config.target_group_name}"')
+        target_group_arn = find_target_group(
+            elbv2_client, aws_config.target_group_name
+        ) or create_http_target_group(
+            elbv2_client=elbv2_client,
+            target_group_name=aws_config.target_group_name,
+            vpc_id=aws_config.vpc_id,
+        )
+        if not crud.advance_runtime(
+            session,
+            runtime,
+            RuntimeUpdate(
+                target_group_arn=target_group_arn,
+                step=RuntimeStep.CREATE_LISTENER_RULES,
+            ),
+        ):
+            return
+
+    if runtime.step == RuntimeStep.CREATE_LISTENER_RULES:
+        logger.info(
+            f"Creating listener rules and service {aws_config.service_name} for {host}"
+        )
+        assert runtime.target_group_arn is not None
+        target_group_arn = runtime.target_group_arn
+        # ECS only accepts a target group that a listener routes to, so the service
+        # waits for the rules. Its lookups don't.
+        with ThreadPoolExecutor(3) as pool:
+            rule_arns = pool.submit(
+                create_listener_rules,
                 elbv2_client=elbv2_client,
                 http_listener_arn=aws_config.http_listener_arn,
                 https_listener_arn=aws_config.https_listener_arn,
@@ -295,17 +461,23 @@ def create_runtime(
                 target_group_arn=target_group_arn,
                 priority=100 + 10 * runtime_no,
             )
-            runtime = crud.update_runtime(
-                session,
-                runtime,
-                RuntimeUpdate(
-                    http_listener_rule_arn=http_rule_arn,
-                    https_listener_rule_arn=https_rule_arn,
-                ),
+            existing_service_arn = pool.submit(
+                find_service, ecs_client, aws_config.cluster, aws_config.service_name
             )
-
-            logger.info(f"Creating service {aws_config.service_name}")
-            service_arn = create_runtime_service(
+            task_definition_revision = pool.submit(
+                get_latest_task_definition_revision,
+                ecs_client,
+                aws_config.task_definition_arn,
+            )
+            http_rule_arn, https_rule_arn = rule_arns.result()
+            service_arn = existing_service_arn.result()
+            # delete_runtime may have started since the service was looked up, and
+            # wouldn't see one created now. (If it starts before the service is
+            # created, its drain step deletes it again.)
+            session.refresh(runtime)
+            if runtime.step != RuntimeStep.CREATE_LISTENER_RULES:
+                return
+            service_arn = service_arn or create_runtime_service(
                 ecs_client=ecs_client,
                 cluster=aws_config.cluster,
                 service_name=aws_config.service_name,
@@ -313,85 +485,168 @@ def create_runtime(
                 security_groups=aws_config.security_groups,
                 subnets=aws_config.subnets,
                 target_group_arn=target_group_arn,
+                task_definition_revision=task_definition_revision.result(),
             )
-            runtime = crud.update_runtime(
-                session, runtime, RuntimeUpdate(service_arn=service_arn)
-            )
-
-        # Poll runtime to see if it stands up. If it doesn't, throw an error and rollback.
-        logger.info(f"Polling runtime {runtime.id} at {runtime.url} for health check")
-        for i in range(1, 41):
-            logger.info(f"{i}/40: Polling runtime for health check")
-            sleep(15)
-            try:
-                url = f"{runtime.url}/controller/ping"  # fastapi server not nginx
-                resp = requests.get(
-                    url=url,
-                    timeout=3,
-                )
-                resp.raise_for_status()
-
-                logger.info(f"Runtime {runtime.id} has started")
-                with Session() as session:
-                    crud.update_runtime(session, runtime, RuntimeUpdate(started=True))
-                return
-            except Exception as e:
-                logger.info(f"Attempt {i}/{40}. Runtime not online yet. {e}")
-                continue
-
-        raise Exception("Runtime did not come online in time. Rolling back.")
-    except (Exception, KeyboardInterrupt) as e:
-        logger.error(f"{e}: Rolling back runtime")
-        delete_runtime(runtime_id=runtime_id)
-        raise e
+        crud.advance_runtime(
+            session,
+            runtime,
+            RuntimeUpdate(
+                http_listener_rule_arn=http_rule_arn,
+                https_listener_rule_arn=https_rule_arn,
+                service_arn=service_arn,
+                step=RuntimeStep.HEALTH_WAIT,
+            ),
+        )
 
 
-@app.task()
+@app.task(
+    bind=True,
+    acks_late=True,
+    reject_on_worker_lost=True,
+    max_retries=DELETE_RUNTIME_MAX_POLLS,
+)
 def delete_runtime(
+    self: Task,
     runtime_id: UUID,
 ) -> None:
-    ecs_client = get_role_session().client("ecs")
-    elbv2_client = get_role_session().client("elbv2")
-    try:
-        with Session() as session:
-            runtime: Runtime | None = crud.get_runtime(session, runtime_id)
-            if runtime is None:
-                raise ValueError(f"Runtime {runtime_id} does not exist")
-            aws_config = get_aws_config(runtime.service_no)
+    """
+    Tears a runtime down:
+    service and listener rules
+    -> wait for the service to drain
+    -> target group
+    -> db row.
+    Like create_runtime, runtime.step is persisted as each step completes, and the drain
+    wait retries the task with a countdown instead of blocking on the services_inactive
+    waiter. Resources without a recorded ARN (e.g. from an interrupted create_runtime)
+    are looked up by name, and ones that don't exist are skipped, so any partially
+    provisioned runtime can be deleted.
+    """
+    with Session() as session:
+        runtime: Runtime | None = crud.get_runtime(session, runtime_id)
+        if runtime is None:
+            logger.info(f"Runtime {runtime_id} does not exist. Already deleted?")
+            return None
+        aws_config = get_aws_config(runtime.service_no)
+        ecs_client = get_ecs_client()
+        elbv2_client = get_elbv2_client()
+
+        if runtime.step not in TEARDOWN_STEPS:
+            # Takes precedence over provisioning, which stops once it sees this.
+            crud.update_runtime(
+                session, runtime, RuntimeUpdate(step=RuntimeStep.DELETE_SERVICE)
+            )
 
-        if runtime.service_arn:
-            try:
-                ecs_client.delete_service(
-                    cluster=aws_config.cluster,
-                    service=aws_config.service_name,
-                    force=True,
+        if runtime.step == RuntimeStep.DELETE_SERVICE:
+            delete_service_and_rules(ecs_client, elbv2_client, runtime, aws_config)
+            if not crud.advance_runtime(
+                session,
+                runtime,
+                RuntimeUpdate(
+                    http_listener_rule_arn=None,
+                    https_listener_rule_arn=None,
+                    step=RuntimeStep.SERVICE_DRAINING,
+                ),
+            ):
+                return None
+
+        if runtime.step == RuntimeStep.SERVICE_DRAINING:
+            status = get_service_status(
+                ecs_client, aws_config.cluster, aws_config.service_name
+            )
+            if status == "ACTIVE":
+                # Created by provisioning that was past its last check when the
+                # service was deleted. See provision_runtime.
+                logger.info(f"Service for runtime {runtime_id} is back. Deleting it")
+                delete_service_and_rules(ecs_client, elbv2_client, runtime, aws_config)
+                status = get_service_status(
+                    ecs_client, aws_config.cluster, aws_config.service_name
                 )
-                waiter = ecs_client.get_waiter("services_inactive")
-                waiter.wait(
-                    cluster=aws_config.cluster,
-                    services=[aws_config.service_name],
+            if status not in (None, "INACTIVE"):
+                attempt = self.request.retries
+                if attempt + 1 >= DELETE_RUNTIME_MAX_POLLS:
+                    raise Exception(
+                        f"Service for runtime {runtime_id} did not drain in time"
+                    )
+                logger.info(
+                    f"{attempt + 1}/{DELETE_RUNTIME_MAX_POLLS}: Service is {status}, "
+                    "waiting for it to drain"
                 )
-            except ecs_client.exceptions.ClientError as error:
-                logger.error(error)
-                logger.warning(f"AWS resource not found for {runtime_id}. Maybe it was already deleted?")
-
-        # Delete the listener rules
-        if runtime.http_listener_rule_arn:
-            elbv2_client.delete_rule(RuleArn=runtime.http_listener_rule_arn)
-        if runtime.https_listener_rule_arn:
-            elbv2_client.delete_rule(RuleArn=runtime.https_listener_rule_arn)
-
-        # Delete the target group
-        if runtime.target_group_arn:
-            elbv2_client.delete_target_group(
-                TargetGroupArn=runtime.target_group_arn,
-            )
+                raise self.retry(countdown=DELETE_RUNTIME_POLL_INTERVAL)
+            if not crud.advance_runtime(
+                session,
+                runtime,
+                RuntimeUpdate(step=RuntimeStep.DELETE_TARGET_GROUP),
+            ):
+                return None
 
-        # Delete the runtime in db
-        with Session() as session:
+        if runtime.step == RuntimeStep.DELETE_TARGET_GROUP:
+            target_group_arn = runtime.target_group_arn or find_target_group(
+                elbv2_client, aws_config.target_group_name
+            )
+            if target_group_arn:
+                delete_if_exists(
+                    elbv2_client.delete_target_group, TargetGroupArn=target_group_arn
+                )
             crud.delete_runtime(session, runtime)
-    except Exception as e:
-        logger.exception(e)
-        pass
 
     return None
+
+
+def delete_service_and_rules(
+    ecs_client: ECSClient,
+    elbv2_client: ELBv2Client,
+    runtime: Runtime,
+    aws_config: AWSConfig,
+) -> None:
+    """
+    Deletes the runtime's service and its listener rules, concurrently. Nothing should
+    route to the service while it drains anyway, so the rules go with it.
+    """
+    with ThreadPoolExecutor(2) as pool:
+        deleted_service = pool.submit(
+            delete_if_exists,
+            ecs_client.delete_service,
+            cluster=aws_config.cluster,
+            service=aws_config.service_name,
+            force=True,
+        )
+        deleted_rules = pool.submit(
+            delete_listener_rules, elbv2_client, runtime, aws_config
+        )
+        deleted_service.result(), deleted_rules.result()
+
+
+def delete_listener_rules(
+    elbv2_client: ELBv2Client, runtime: Runtime, aws_config: AWSConfig
+) -> None:
+    """
+    Deletes the runtime's HTTP and HTTPS rules, concurrently. Rules without a recorded
+    ARN (e.g. from an interrupted create_runtime) are looked up by host.
+    """
+    host = f"{aws_config.subdomain}.{aws_config.host}"
+
+    def delete_rule(rule_arn: str | None, listener_arn: str) -> None:
+        rule_arn = rule_arn or find_listener_rule(elbv2_client, listener_arn, host)
+        if rule_arn:
+            delete_if_exists(elbv2_client.delete_rule, RuleArn=rule_arn)
+
+    with ThreadPoolExecutor(2) as pool:
+        list(
+            pool.map(
+                delete_rule,
+                (runtime.http_listener_rule_arn, runtime.https_listener_rule_arn),
+                (aws_config.http_listener_arn, aws_config.https_listener_arn),
+            )
+        )
+
+
+def delete_if_exists(delete: Callable[..., Any], **kwargs) -> None:
+    """
+    Calls an AWS delete, treating an already deleted resource as success.
+    """
+    try:
+        delete(**kwargs)
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in NOT_FOUND_ERROR_CODES:
+            raise
+        logger.warning(f"{e}. Maybe it was already deleted?")
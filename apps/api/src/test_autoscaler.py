@@ -0,0 +1,164 @@
+import asyncio
+from uuid import UUID, uuid4
+
+import fakeredis
+import pytest
+
+from src import autoscaler
+from src.autoscaler import (
+    AUTOSCALER_MAX_IDLE,
+    AUTOSCALER_MIN_IDLE,
+    MAX_CREATES_PER_TICK,
+    SCALE_DOWN_TICKS,
+    RuntimeAutoscaler,
+    target_idle,
+)
+
+
+class FakeRuntimes:
+    def __init__(self) -> None:
+        self.created = 0
+        self.deleted: list[UUID] = []
+
+    async def create(self) -> None:
+        self.created += 1
+
+    async def delete(self, runtime_id: UUID) -> None:
+        self.deleted.append(runtime_id)
+
+
+def new_autoscaler(
+    runtimes: FakeRuntimes, lock_client: fakeredis.FakeAsyncRedis | None = None
+) -> RuntimeAutoscaler:
+    return RuntimeAutoscaler(runtimes.create, runtimes.delete, lock_client)
+
+
+def test_start_rate() -> None:
+    scaler = new_autoscaler(FakeRuntimes())
+    assert target_idle(scaler.start_rate) == AUTOSCALER_MIN_IDLE
+
+    # A sustained 1 start/min converges on 1 start/min.
+    for _ in range(200):
+        scaler.observe_starts(1, 60)
+    assert scaler.start_rate == pytest.approx(1 / 60, rel=1e-3)
+
+    # A short burst moves the rate, but not all the way.
+    scaler.observe_starts(30, 60)
+    assert 1 / 60 < scaler.start_rate < 30 / 60
+    assert target_idle(scaler.start_rate) == AUTOSCALER_MAX_IDLE
+
+
+def test_scale_up_counts_provisioning() -> None:
+    scaler = new_autoscaler(FakeRuntimes())
+    scaler.start_rate = 2 / autoscaler.RUNTIME_PROVISION_SECONDS
+    target = AUTOSCALER_MIN_IDLE + 2
+
+    assert scaler.decide(idle=0, provisioning=0) == min(target, MAX_CREATES_PER_TICK)
+    assert scaler.decide(idle=1, provisioning=target - 2) == 1
+    assert scaler.decide(idle=0, provisioning=target) == 0
+
+
+def test_scale_down_hysteresis() -> None:
+    scaler = new_autoscaler(FakeRuntimes())
+    excess = AUTOSCALER_MIN_IDLE + 5
+
+    for _ in range(SCALE_DOWN_TICKS - 1):
+        assert scaler.decide(idle=excess, provisioning=0) == 0
+    # A tick within the margin resets the count.
+    assert scaler.decide(idle=AUTOSCALER_MIN_IDLE + 1, provisioning=0) == 0
+    for _ in range(SCALE_DOWN_TICKS - 1):
+        assert scaler.decide(idle=excess, provisioning=0) == 0
+    assert scaler.decide(idle=excess, provisioning=0) == -1
+    # One at a time.
+    assert scaler.decide(idle=excess - 1, provisioning=0) == 0
+
+
+class Row:
+    def __init__(self, id: UUID) -> None:
+        self.id = id
+
+
+@pytest.fixture
+def crud_state(monkeypatch) -> dict:
+    """
+    Stands in for the async_crud calls a tick makes. Returns the state they read, and
+    counts the ticks that ran.
+    """
+    state: dict = {"starts": 0, "idle": [], "provisioning": 0, "ticks": 0}
+
+    async def count_agent_start_tasks(session, since) -> int:
+        state["ticks"] += 1
+        return state["starts"]
+
+    async def get_runtimes(session, unused, limit):
+        return [Row(runtime_id) for runtime_id in state["idle"]][:limit]
+
+    async def count_provisioning_runtimes(session) -> int:
+        return state["provisioning"]
+
+    async def claim_idle_runtime(session, lease, newest=False):
+        if not state["idle"]:
+            return None
+        return Row(state["idle"].pop(-1 if newest else 0))
+
+    monkeypatch.setattr(
+        autoscaler.async_crud, "count_agent_start_tasks", count_agent_start_tasks
+    )
+    monkeypatch.setattr(autoscaler.async_crud, "get_runtimes", get_runtimes)
+    monkeypatch.setattr(
+        autoscaler.async_crud,
+        "count_provisioning_runtimes",
+        count_provisioning_runtimes,
+    )
+    monkeypatch.setattr(autoscaler.async_crud, "claim_idle_runtime", claim_idle_runtime)
+    return state
+
+
+@pytest.mark.asyncio
+async def test_tick(crud_state) -> None:
+    idle_ids = [uuid4() for _ in range(AUTOSCALER_MIN_IDLE + 5)]
+
+    runtimes = FakeRuntimes()
+    scaler = new_autoscaler(runtimes)
+    await scaler.tick()
+    assert runtimes.created == min(AUTOSCALER_MIN_IDLE, MAX_CREATES_PER_TICK)
+
+    # Misses count as starts.
+    scaler.miss()
+    scaler.miss()
+    await scaler.tick()
+    assert scaler.start_rate > 0 and scaler.missed_starts == 0
+
+    crud_state["idle"] = list(idle_ids)
+    scaler.start_rate = 0
+    for _ in range(SCALE_DOWN_TICKS):
+        await scaler.tick()
+    # The newest one, reserved so that no start claims it.
+    assert runtimes.deleted == [idle_ids[-1]]
+    assert crud_state["idle"] == idle_ids[:-1]
+
+
+@pytest.mark.asyncio
+async def test_tick_lock(crud_state) -> None:
+    """
+    Of several processes sharing a lock, one ticks per interval, but a miss wakes a
+    tick right away.
+    """
+    client = fakeredis.FakeAsyncRedis()
+    try:
+        scalers = [new_autoscaler(FakeRuntimes(), client) for _ in range(4)]
+        await asyncio.gather(*(scaler.tick() for scaler in scalers))
+        assert crud_state["ticks"] == 1
+
+        await scalers[0].tick()
+        assert crud_state["ticks"] == 1
+
+        scalers[1].miss()
+        await scalers[1].tick()
+        assert crud_state["ticks"] == 2
+        assert scalers[1].missed_starts == 0
+        # It counts as the interval's tick.
+        await asyncio.gather(*(scaler.tick() for scaler in scalers))
+        assert crud_state["ticks"] == 2
+    finally:
+        await client.aclose()
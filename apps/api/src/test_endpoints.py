@@ -1,22 +1,35 @@
 import asyncio
 import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from asyncio import sleep as asyncio_sleep
 from time import time
-from typing import Any, Callable, Coroutine, Generator
+from types import SimpleNamespace
+from typing import Any, Callable, Coroutine, Generator, cast
+from unittest.mock import MagicMock
 from uuid import UUID, uuid4
 
+import fakeredis
 import pytest
+import redis
 import requests
+from eth_account import Account
+from celery.signals import after_task_publish, task_failure, task_prerun
 
+from src import auth, server, task_status, tasks
 from src.auth import decode_bearer_token
 from src.db import crud
 from src.db.models import (
     AgentBase,
     AgentStartTask,
     Runtime,
+    RuntimeBase,
     RuntimeCreateTask,
+    RuntimeStep,
+    RuntimeUpdate,
     Token,
     TokenBase,
+    TokenLaunch,
     User,
     UserBase,
     Wallet,
@@ -24,7 +37,10 @@ from src.db.models import (
     WalletUpdate,
 )
 from src.models import AgentPublic, TaskStatus, UserPublic
-from src.server import Session
+from src.db import Session
+from src.heartbeats import HEARTBEAT_TIMEOUT, MemoryHeartbeatStore
+from src.nonces import MemoryNonceStore, NonceManager
+from src.test_token_deployment import BONDING, BONDING_ABI, TOKEN_ABI, FakeRpc, serve
 
 
 def test_ping(client):
@@ -49,6 +65,51 @@ def test_jwt(
     assert decoded_payload["iat"] == payload["iat"]
 
 
+def test_jwt_decoded_once(client, user_factory, helper_encode_jwt) -> None:
+    user: User = user_factory()
+    # jti makes the token unique, so it can't already be in the decoded token cache.
+    bearer_token = helper_encode_jwt({"sub": str(user.dynamic_id), "jti": str(uuid4())})
+    headers = {"Authorization": f"Bearer {bearer_token}"}
+
+    # Patched in conftest.
+    decode = cast(MagicMock, auth.decode_bearer_token)
+    # PATCH /users depends on both get_is_admin and get_user_from_token.
+    calls = decode.call_count
+    response = client.patch(
+        f"/users/{user.id}", json={"username": "a"}, headers=headers
+    )
+    assert response.status_code == 200, response.json()
+    assert decode.call_count == calls + 1
+
+    # Already verified, so served from the cache.
+    response = client.patch(
+        f"/users/{user.id}", json={"username": "b"}, headers=headers
+    )
+    assert response.status_code == 200, response.json()
+    assert decode.call_count == calls + 1
+
+
+def test_identity_cache_invalidation(client, user_factory, helper_encode_jwt) -> None:
+    user: User = user_factory()
+    auth = helper_encode_jwt({"sub": str(user.dynamic_id)})
+    headers = {"Authorization": f"Bearer {auth}"}
+
+    # Resolves (and caches) the user behind the token.
+    response = client.patch(
+        f"/users/{user.id}", json={"username": "a"}, headers=headers
+    )
+    assert response.status_code == 200, response.json()
+
+    response = client.delete(f"/users/{user.id}", headers=headers)
+    assert response.status_code == 200, response.json()
+
+    # The token no longer belongs to anyone, rather than to a stale cached user.
+    response = client.patch(
+        f"/users/{user.id}", json={"username": "b"}, headers=headers
+    )
+    assert response.status_code == 403, response.json()
+
+
 @pytest.fixture()
 def wallet_factory(
     client, user_factory, helper_encode_jwt
@@ -371,6 +432,158 @@ def test_tokens(client, token_factory) -> None:
     return None
 
 
+def test_tokens_pagination(client, token_factory) -> None:
+    token_ids = {token_factory(ticker=f"page{i}").id for i in range(5)}
+
+    seen: list[UUID] = []
+    params: dict[str, Any] = {"limit": 2}
+    while True:
+        response = client.get("/tokens", params=params)
+        assert response.status_code == 200
+        page = [Token.model_validate(token) for token in response.json()]
+        assert len(page) <= 2
+        seen.extend(token.id for token in page)
+
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        params["cursor"] = cursor
+
+    assert len(seen) == len(set(seen))
+    assert token_ids <= set(seen)
+
+    response = client.get("/tokens", params={"cursor": "not a cursor"})
+    assert response.status_code == 400
+    response = client.get("/tokens", params={"limit": 101})
+    assert response.status_code == 422
+
+
+def test_trade_transactions(client, token_factory, monkeypatch) -> None:
+    token = token_factory(evm_contract_address="0x" + "ab" * 20, abi=TOKEN_ABI)
+    users = ["0x" + f"{i:040x}" for i in range(1, 4)]
+    trades = [
+        {"token_id": str(token.id), "side": side, "amount": 10, "user_address": user}
+        for user in users
+        for side in ("BUY", "SELL")
+    ]
+
+    with serve(FakeRpc()) as rpc:
+        monkeypatch.setattr(server.token_deployment, "SEI_RPC_URL", rpc.url)
+        rpc.reverts.add(users[0])
+        response = client.post("/tokens/transactions", json={"trades": trades})
+        assert response.status_code == 200, response.json()
+        assert rpc.requests == 1
+
+    results = response.json()
+    assert [result["error"] for result in results[:2]] == ["execution reverted"] * 2
+    for trade, result in zip(trades[2:], results[2:]):
+        transaction = result["transaction"]
+        assert transaction["from"] == trade["user_address"]
+        assert transaction["value"] == (10 if trade["side"] == "BUY" else 0)
+
+    response = client.post(
+        "/tokens/transactions",
+        json={"trades": [{**trades[0], "token_id": str(uuid4())}]},
+    )
+    assert response.status_code == 404
+
+
+def test_token_launches(
+    client, user_factory, helper_encode_jwt, monkeypatch, tmp_path
+) -> None:
+    user: User = user_factory()
+    headers = {
+        "Authorization": f"Bearer {helper_encode_jwt({'sub': str(user.dynamic_id)})}"
+    }
+    deployer = Account.create()
+    monkeypatch.setenv("TOKEN_DEPLOYER_PRIVATE_KEY", deployer.key.hex())
+    monkeypatch.setenv("BONDING_CONTRACT_ADDRESS", BONDING)
+    for name, abi in (("Bonding", BONDING_ABI), ("FERC20", TOKEN_ABI)):
+        (tmp_path / f"{name}.json").write_text(
+            json.dumps({"abi": abi, "bytecode": "0x"})
+        )
+    monkeypatch.setattr(
+        server.token_deployment, "BONDING_ARTIFACT_PATH", str(tmp_path / "Bonding.json")
+    )
+    monkeypatch.setattr(
+        server.token_deployment, "TOKEN_ARTIFACT_PATH", str(tmp_path / "FERC20.json")
+    )
+    server.token_deployment.load_bonding_artifact.cache_clear()
+    server.token_deployment.load_token_abi.cache_clear()
+    nonces = NonceManager(MemoryNonceStore(), server.token_deployment.pending_nonce)
+    monkeypatch.setattr(server.token_deployment, "deployer_nonces", nonces)
+    # The only api process, so ticks don't take the lock.
+    monkeypatch.setattr(server.launch_watcher.tick_lock, "client", None)
+
+    with serve(FakeRpc()) as rpc:
+        monkeypatch.setattr(server.token_deployment, "SEI_RPC_URL", rpc.url)
+        launches = []
+        for i in range(4):
+            response = client.post(
+                "/tokens/launches",
+                json={"name": f"Token {i}", "ticker": f"T{i}"},
+                headers=headers,
+            )
+            assert response.status_code == 202, response.json()
+            launches.append(response.json())
+        assert all(launch["status"] == "PENDING" for launch in launches)
+
+        rpc.failing_sends = 1
+        response = client.post(
+            "/tokens/launches", json={"name": "Token", "ticker": "T"}, headers=headers
+        )
+        assert response.status_code == 502
+        # Left by an api process that died before sending it.
+        with Session() as session:
+            unsent = TokenLaunch(name="Unsent", ticker="U", owner_id=user.id)
+            session.add(unsent)
+            session.commit()
+            launches.append({"id": str(unsent.id)})
+
+        def statuses() -> list[str]:
+            return [
+                client.get(f"/tokens/launches/{launch['id']}").json()["status"]
+                for launch in launches
+            ]
+
+        # One reverted, and one not mined yet.
+        rpc.receipts[launches[2]["tx_hash"]]["status"] = "0x0"
+        del rpc.receipts[launches[3]["tx_hash"]]
+        client.portal.call(server.launch_watcher.tick)
+        assert statuses() == ["SUCCESS"] * 2 + ["FAILURE"] + ["PENDING"] * 2
+        assert rpc.calls["eth_getTransactionReceipt"] == 4
+        # Only the launch that wasn't mined is still pending.
+        assert list(client.portal.call(nonces.store.pending, deployer.address)) == [
+            launches[3]["nonce"]
+        ]
+        # Until they time out.
+        monkeypatch.setattr("src.launches.LAUNCH_TIMEOUT", timedelta(0))
+        client.portal.call(server.launch_watcher.tick)
+        assert statuses() == ["SUCCESS"] * 2 + ["FAILURE"] * 3
+        assert rpc.calls["eth_getTransactionReceipt"] == 5
+        assert client.portal.call(nonces.store.pending, deployer.address) == {}
+        assert client.portal.call(server.launch_watcher.idle)
+
+    launches = [
+        client.get(f"/tokens/launches/{launch['id']}").json() for launch in launches
+    ]
+    for launch in launches[:2]:
+        assert launch["status"] == "SUCCESS"
+        token = client.get(f"/tokens/{launch['token_id']}").json()
+        assert token["evm_contract_address"].lower() in rpc.launched
+        assert token["ticker"] == launch["ticker"]
+        assert token["abi"] == TOKEN_ABI
+    assert launches[2]["status"] == "FAILURE"
+    assert "reverted" in launches[2]["error"]
+    assert "mined" in launches[3]["error"]
+    assert "sent" in launches[4]["error"]
+
+    response = client.get(f"/tokens/launches/{uuid4()}")
+    assert response.status_code == 404
+    server.token_deployment.load_bonding_artifact.cache_clear()
+    server.token_deployment.load_token_abi.cache_clear()
+
+
 @pytest.mark.asyncio
 async def test_runtimes(
     client, runtime_factory, agent_factory, user_factory, helper_encode_jwt
@@ -490,3 +703,203 @@ async def test_agents(
     assert len(response_json) == 1
 
     return None
+
+
+def test_start_agent_claims_distinct_runtimes(
+    client,
+    user_factory,
+    agent_factory,
+    helper_encode_jwt,
+    task_status_redis,
+    monkeypatch,
+) -> None:
+    """
+    Concurrent starts without a runtime are spread over the idle runtimes, one agent
+    each.
+    """
+    monkeypatch.setattr(
+        tasks.start_agent, "delay", lambda *args: SimpleNamespace(id=str(uuid4()))
+    )
+    with Session() as session:
+        runtime_ids = {
+            crud.create_runtime(
+                session,
+                RuntimeBase(
+                    url=f"http://runtime-{i}", service_no=i, step=RuntimeStep.STARTED
+                ),
+            ).id
+            for i in range(4)
+        }
+
+    headers: list[dict[str, str]] = []
+    agents: list[AgentPublic] = []
+    for _ in range(12):
+        owner = user_factory()
+        agents.append(agent_factory(owner_id=owner.id))
+        auth = helper_encode_jwt({"sub": str(owner.dynamic_id)})
+        headers.append({"Authorization": f"Bearer {auth}"})
+
+    with ThreadPoolExecutor(len(agents)) as pool:
+        responses = list(
+            pool.map(
+                lambda agent, headers: client.post(
+                    f"/agents/{agent.id}/start", headers=headers
+                ),
+                agents,
+                headers,
+            )
+        )
+
+    started = [
+        AgentStartTask.model_validate(response.json())
+        for response in responses
+        if response.status_code == 200
+    ]
+    assert (
+        sorted(response.status_code for response in responses) == [200] * 4 + [503] * 8
+    )
+    assert {task.runtime_id for task in started} == runtime_ids
+    # Reserved until the agents are running.
+    assert client.get("/runtimes?unused=true").json() == []
+
+    # A start that fails releases its runtime.
+    with Session() as session:
+        runtime = crud.get_runtime(session, started[0].runtime_id)
+        assert runtime is not None
+        crud.update_runtime(session, runtime, RuntimeUpdate(reserved_until=None))
+    other_agent_id = next(
+        task.agent_id for task in started if task.agent_id != agents[0].id
+    )
+    response = client.post(f"/agents/{other_agent_id}/start", headers=headers[0])
+    assert response.status_code == 403, response.json()
+    response = client.get("/runtimes?unused=true")
+    assert [runtime["id"] for runtime in response.json()] == [
+        str(started[0].runtime_id)
+    ]
+
+
+def test_agent_heartbeats(client, monkeypatch) -> None:
+    store = MemoryHeartbeatStore()
+    monkeypatch.setattr(server, "heartbeat_store", store)
+    agent_ids = sorted(str(uuid4()) for _ in range(3))
+
+    response = client.post(
+        "/agents/heartbeats",
+        json={
+            "heartbeats": [
+                {"agent_id": agent_ids[0]},
+                {
+                    "agent_id": agent_ids[1],
+                    "status": {"memory_bytes": 300_000_000, "cpu_percent": 12.5},
+                },
+                {"agent_id": agent_ids[2], "status": {"uptime_seconds": 60}},
+            ]
+        },
+    )
+    assert response.status_code == 200, response.json()
+    assert response.json()["received"] == 3
+
+    response = client.post(f"/agents/{agent_ids[0]}/heartbeat")
+    assert response.status_code == 200, response.json()
+
+    expired = asyncio.run(store.expire(time() + HEARTBEAT_TIMEOUT + 5))
+    assert sorted(expired) == agent_ids
+
+    response = client.post(
+        "/agents/heartbeats",
+        json={"heartbeats": [{"agent_id": str(uuid4())}] * 1001},
+    )
+    assert response.status_code == 422
+
+
+@pytest.fixture()
+def task_status_redis(monkeypatch) -> Generator[fakeredis.FakeRedis, None, None]:
+    server = fakeredis.FakeServer()
+    redis_client = fakeredis.FakeRedis(server=server)
+    monkeypatch.setattr(task_status, "sync_client", redis_client)
+    monkeypatch.setattr(
+        task_status, "async_client", fakeredis.aioredis.FakeRedis(server=server)
+    )
+    monkeypatch.setattr(task_status, "_skip_redis_until", 0.0)
+    task_status.terminal_statuses.clear()
+
+    yield redis_client
+
+    task_status.terminal_statuses.clear()
+
+
+def test_task_status_cache(client, task_status_redis) -> None:
+    task_id = str(uuid4())
+    task_name = tasks.delete_runtime.name
+    body: tuple[tuple, dict[str, str], dict] = ((), {"runtime_id": str(uuid4())}, {})
+
+    # Published tasks have no row in celery_taskmeta until a worker starts them.
+    after_task_publish.send(sender=task_name, headers={"id": task_id}, body=body)
+    assert client.get(f"/tasks/{task_id}").json() == TaskStatus.PENDING
+
+    task_prerun.send(
+        sender=tasks.delete_runtime,
+        task_id=task_id,
+        task=tasks.delete_runtime,
+        args=body[0],
+        kwargs=body[1],
+    )
+    # A late publish signal doesn't clobber the worker's status.
+    after_task_publish.send(sender=task_name, headers={"id": task_id}, body=body)
+    assert client.get(f"/tasks/{task_id}").json() == TaskStatus.STARTED
+
+    task_failure.send(
+        sender=tasks.delete_runtime,
+        task_id=task_id,
+        exception=Exception(),
+        args=body[0],
+        kwargs=body[1],
+    )
+    assert client.get(f"/tasks/{task_id}").json() == TaskStatus.FAILURE
+
+    # Terminal statuses are also kept in process.
+    task_status_redis.flushall()
+    assert client.get(f"/tasks/{task_id}").json() == TaskStatus.FAILURE
+
+
+@pytest.mark.asyncio
+async def test_task_events(task_status_redis, monkeypatch) -> None:
+    monkeypatch.setattr(task_status, "pubsub_client", task_status.async_client)
+    hub = task_status.TaskEventHub()
+    relay = asyncio.create_task(hub.run())
+
+    agent_id, runtime_id, other_agent_id = uuid4(), uuid4(), uuid4()
+    async with hub.subscribe(lambda event: event.agent_id == agent_id) as queue:
+        # Let the hub subscribe before publishing.
+        while not task_status_redis.pubsub_numsub(task_status.EVENTS_CHANNEL)[0][1]:
+            await asyncio_sleep(0.01)
+
+        # Doesn't stop the relay.
+        task_status_redis.publish(task_status.EVENTS_CHANNEL, b"not an event")
+        for published_agent_id in (other_agent_id, agent_id):
+            after_task_publish.send(
+                sender=tasks.start_agent.name,
+                headers={"id": str(uuid4())},
+                # Positional, as in server.start_agent
+                body=((published_agent_id, runtime_id), {}, {}),
+            )
+
+        event = await asyncio.wait_for(queue.get(), timeout=5)
+        assert event is not None
+        assert event.task == "start_agent"
+        assert event.status == TaskStatus.PENDING
+        assert (event.agent_id, event.runtime_id) == (agent_id, runtime_id)
+        assert queue.empty()
+
+    relay.cancel()
+
+
+@pytest.mark.asyncio
+async def test_task_status_cache_redis_down(monkeypatch) -> None:
+    unreachable = redis.asyncio.Redis(port=1, socket_connect_timeout=0.1)
+    monkeypatch.setattr(task_status, "async_client", unreachable)
+    monkeypatch.setattr(task_status, "_skip_redis_until", 0.0)
+
+    # Falls through to the db, and stops trying redis for a while.
+    assert await task_status.get_status(uuid4()) is None
+    assert not task_status._redis_available()
@@ -0,0 +1,134 @@
+import asyncio
+from collections.abc import AsyncGenerator
+
+import fakeredis
+import pytest
+import pytest_asyncio
+from prometheus_client import CollectorRegistry
+
+from src.heartbeats import (
+    DOWN_RETENTION,
+    HEARTBEAT_TIMEOUT,
+    HeartbeatCollector,
+    HeartbeatStore,
+    MemoryHeartbeatStore,
+    RedisHeartbeatStore,
+)
+
+
+@pytest_asyncio.fixture(params=["memory", "redis"])
+async def store(request) -> AsyncGenerator[HeartbeatStore, None]:
+    if request.param == "memory":
+        yield MemoryHeartbeatStore()
+        return
+    client = fakeredis.FakeAsyncRedis()
+    yield RedisHeartbeatStore(client)
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_expire(store: HeartbeatStore) -> None:
+    await store.beat("a", 0)
+    await store.beat("b", 0)
+    await store.beat("a", 50)
+
+    assert await store.expire(HEARTBEAT_TIMEOUT + 5) == ["b"]
+    # Each expiry is only reported once.
+    assert await store.expire(HEARTBEAT_TIMEOUT + 10) == []
+    assert await store.expire(50 + HEARTBEAT_TIMEOUT + 5) == ["a"]
+
+
+@pytest.mark.asyncio
+async def test_restart(store: HeartbeatStore) -> None:
+    await store.beat("a", 0)
+    assert await store.expire(100) == ["a"]
+
+    assert await store.beat("a", 120) == 100
+    assert await store.beat("a", 130) is None
+    assert await store.expire(130) == []
+
+
+@pytest.mark.asyncio
+async def test_remove(store: HeartbeatStore) -> None:
+    await store.beat("stopped", 0)
+    await store.beat("down", 0)
+    await store.expire(100)
+    await store.remove("stopped")
+    await store.remove("down")
+    assert await store.expire(1000) == []
+    # Starting again isn't a restart.
+    assert await store.beat("down", 1000) is None
+
+    # A stopped agent that starts again is tracked again.
+    await store.beat("stopped", 1000)
+    assert sorted(await store.expire(1000 + HEARTBEAT_TIMEOUT + 1)) == [
+        "down",
+        "stopped",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_down_agents_forgotten(store: HeartbeatStore) -> None:
+    await store.beat("a", 0)
+    assert await store.expire(100) == ["a"]
+    await store.expire(100 + DOWN_RETENTION + 1)
+    assert await store.beat("a", 100 + DOWN_RETENTION + 2) is None
+
+
+@pytest.mark.asyncio
+async def test_memory_store_bounded() -> None:
+    store = MemoryHeartbeatStore()
+    for now in range(10 * HEARTBEAT_TIMEOUT):
+        await store.beat("a", now)
+        await store.expire(now)
+    assert len(store._live) == 1
+
+
+@pytest.mark.asyncio
+async def test_redis_store_shared(monkeypatch) -> None:
+    """
+    Processes sharing a store expire each agent once between them.
+    """
+    monkeypatch.setattr(RedisHeartbeatStore, "EXPIRE_BATCH", 7)
+    client = fakeredis.FakeAsyncRedis()
+    stores = [RedisHeartbeatStore(client) for _ in range(4)]
+    try:
+        agent_ids = [f"agent-{i}" for i in range(100)]
+        for agent_id in agent_ids:
+            await stores[0].beat(agent_id, 0)
+
+        expired = await asyncio.gather(*(store.expire(100) for store in stores))
+        assert sorted(agent_id for ids in expired for agent_id in ids) == sorted(
+            agent_ids
+        )
+    finally:
+        await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_collector(store: HeartbeatStore) -> None:
+    await store.beat("down", 0)
+    await store.expire(100)
+    await store.beat("a", 90)
+    await store.beat("b", 50)
+    await store.beat("stopped", 90)
+    await store.remove("stopped")
+
+    collector = HeartbeatCollector()
+    registry = CollectorRegistry()
+    registry.register(collector)
+    collector.update(*await store.snapshot(), 100)
+
+    def sample(name: str, **labels: str) -> float | None:
+        return registry.get_sample_value(name, labels)
+
+    assert sample("agent_liveness_status", agent_id="a") == 1
+    assert sample("agent_liveness_status", agent_id="b") == 1
+    assert sample("agent_liveness_status", agent_id="down") == 0
+    assert sample("agent_liveness_status", agent_id="stopped") is None
+    assert sample("agent_heartbeat_agents", state="live") == 2
+    assert sample("agent_heartbeat_agents", state="down") == 1
+    assert sample("agent_heartbeat_lag_seconds_bucket", le="10.0") == 1
+    assert sample("agent_heartbeat_lag_seconds_bucket", le="45.0") == 1
+    assert sample("agent_heartbeat_lag_seconds_bucket", le="60.0") == 2
+    assert sample("agent_heartbeat_lag_seconds_sum") == 60
@@ -0,0 +1,98 @@
+import asyncio
+from collections.abc import AsyncGenerator
+
+import fakeredis
+import pytest
+import pytest_asyncio
+
+from src.nonces import MemoryNonceStore, NonceManager, NonceStore, RedisNonceStore
+
+ADDRESS = "0x0000000000000000000000000000000000000001"
+
+
+@pytest_asyncio.fixture(params=["memory", "redis"])
+async def store(request) -> AsyncGenerator[NonceStore, None]:
+    if request.param == "memory":
+        yield MemoryNonceStore()
+        return
+    client = fakeredis.FakeAsyncRedis()
+    yield RedisNonceStore(client)
+    await client.aclose()
+
+
+class FakeChain:
+    def __init__(self, next_nonce: int) -> None:
+        self.next_nonce = next_nonce
+        self.fetches = 0
+
+    async def fetch_nonce(self, address: str) -> int:
+        self.fetches += 1
+        # Let concurrent reserves pile up on the lock.
+        await asyncio.sleep(0.01)
+        return self.next_nonce
+
+
+@pytest.mark.asyncio
+async def test_sync(store: NonceStore) -> None:
+    assert await store.take(ADDRESS) is None
+    await store.sync(ADDRESS, 5)
+    assert [await store.take(ADDRESS) for _ in range(3)] == [5, 6, 7]
+    assert await store.synced(ADDRESS)
+
+    await store.add_pending(ADDRESS, 6, "0x6")
+    await store.add_pending(ADDRESS, 7, "0x7")
+    await store.add_pending(ADDRESS, 5, "0x5")
+    await store.confirm(ADDRESS, 5)
+    # The node doesn't know 6 and 7 yet.
+    assert await store.sync(ADDRESS, 6) == 8
+    assert await store.pending(ADDRESS) == {6: "0x6", 7: "0x7"}
+    assert await store.take(ADDRESS) == 8
+
+    # 7 timed out, and 8 and 9 failed to send, while 10 is still pending.
+    await store.confirm(ADDRESS, 7)
+    assert [await store.take(ADDRESS) for _ in range(2)] == [9, 10]
+    await store.add_pending(ADDRESS, 10, "0xa")
+    # Only the gaps are handed out again.
+    assert await store.sync(ADDRESS, 6) == 7
+    assert [await store.take(ADDRESS) for _ in range(4)] == [7, 8, 9, 11]
+
+
+@pytest.mark.asyncio
+async def test_reserve(store: NonceStore) -> None:
+    chain = FakeChain(3)
+    nonces = NonceManager(store, chain.fetch_nonce)
+
+    reserved = await asyncio.gather(*(nonces.reserve(ADDRESS) for _ in range(20)))
+    assert sorted(reserved) == list(range(3, 23))
+    assert chain.fetches == 1
+
+
+@pytest.mark.asyncio
+async def test_send(store: NonceStore) -> None:
+    chain = FakeChain(0)
+    nonces = NonceManager(store, chain.fetch_nonce)
+    sent: list[int] = []
+
+    async def send(nonce: int) -> str:
+        if nonce < chain.next_nonce:
+            raise ValueError("nonce too low")
+        sent.append(nonce)
+        chain.next_nonce = nonce + 1
+        return f"0x{nonce}"
+
+    assert await nonces.send(ADDRESS, send) == (0, "0x0")
+    # Sent from elsewhere.
+    chain.next_nonce = 5
+    assert await nonces.send(ADDRESS, send) == (5, "0x5")
+    assert sent == [0, 5]
+    assert await store.pending(ADDRESS) == {0: "0x0", 5: "0x5"}
+    await nonces.confirm(ADDRESS, 0)
+    assert await store.pending(ADDRESS) == {5: "0x5"}
+
+    async def fail(nonce: int) -> str:
+        raise ConnectionError("connection reset")
+
+    # Other errors aren't retried, but the nonce is resynced, so it's handed out again.
+    with pytest.raises(ConnectionError):
+        await nonces.send(ADDRESS, fail)
+    assert await nonces.send(ADDRESS, send) == (6, "0x6")
@@ -0,0 +1,699 @@
+import json
+import os
+import threading
+import time
+from collections.abc import Generator
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TypeVar
+from uuid import UUID, uuid4
+
+import boto3
+import pytest
+from celery.backends.database.models import Task as CeleryTask
+from celery.contrib.testing.worker import start_worker
+from moto import mock_aws
+from mypy_boto3_elbv2.literals import ProtocolEnumType
+from sqlalchemy import insert
+from sqlmodel import SQLModel
+
+from src import aws_utils, tasks
+from src.db import Session, crud
+from src.db.setup import engine
+from src.db.models import (
+    AgentBase,
+    Runtime,
+    RuntimeBase,
+    RuntimeStep,
+    RuntimeUpdate,
+    RuntimeUpdateTaskBase,
+    User,
+    UserBase,
+)
+from src.models import AWSConfig
+
+
+T = TypeVar("T")
+
+
+def existing(row: T | None) -> T:
+    assert row is not None
+    return row
+
+
+@pytest.fixture(autouse=True)
+def tables() -> None:
+    """
+    The api's tables, which the api creates on startup, so that these tests don't depend
+    on another module having started it.
+    """
+    SQLModel.metadata.create_all(engine)
+
+
+class FakeRuntimes(ThreadingHTTPServer):
+    """
+    Stands in for any number of runtimes, at http://host:port/<runtime_id>.
+    A runtime reports its agent as running after `polls_until_running` status checks.
+    Pings are answered with a 200, unless the runtime is unhealthy.
+    """
+
+    # Accept everything a concurrent healthcheck sweep throws at it at once.
+    request_queue_size = 128
+
+    def __init__(self, polls_until_running: int, latency: float = 0) -> None:
+        super().__init__(("127.0.0.1", 0), FakeRuntimeHandler)
+        self.polls_until_running = polls_until_running
+        # Seconds every GET takes.
+        self.latency = latency
+        # Runtimes that answer every GET with a 503.
+        self.unhealthy: set[str] = set()
+        self.lock = threading.Lock()
+        self.status_polls: dict[str, int] = {}
+        self.started_at: dict[str, float] = {}
+        self.running_at: dict[str, float] = {}
+        # The (runtime_id, start, end) of every GET, in the order they ended.
+        self.gets: list[tuple[str, float, float]] = []
+
+    def url(self, runtime_id: UUID) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host!s}:{port}/{runtime_id}"
+
+
+class FakeRuntimeHandler(BaseHTTPRequestHandler):
+    server: FakeRuntimes
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def respond(self, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self) -> None:
+        runtime_id, endpoint = self.path.lstrip("/").split("/", 1)
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if endpoint == "controller/character/start":
+            with self.server.lock:
+                self.server.started_at[runtime_id] = time.monotonic()
+        self.respond({})
+
+    def do_GET(self) -> None:
+        runtime_id, endpoint = self.path.lstrip("/").split("/", 1)
+        start = time.perf_counter()
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.gets.append((runtime_id, start, time.perf_counter()))
+        if runtime_id in self.server.unhealthy:
+            self.send_error(503)
+            return
+        if endpoint != "controller/character/status":
+            self.respond({})
+            return
+        with self.server.lock:
+            polls = self.server.status_polls.get(runtime_id, 0) + 1
+            self.server.status_polls[runtime_id] = polls
+            running = polls >= self.server.polls_until_running
+            if running:
+                self.server.running_at.setdefault(runtime_id, time.monotonic())
+        self.respond({"running": running, "agent_id": f"eliza-{runtime_id}"})
+
+
+@contextmanager
+def serve(server: FakeRuntimes) -> Generator[FakeRuntimes, None, None]:
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture()
+def fake_runtimes() -> Generator[FakeRuntimes, None, None]:
+    with serve(FakeRuntimes(polls_until_running=4)) as server:
+        yield server
+
+
+@pytest.fixture()
+def celery_worker(monkeypatch) -> Generator[None, None, None]:
+    """
+    In-memory broker, and a worker with a fixed pool of 4 threads.
+    """
+    monkeypatch.setattr(tasks, "START_AGENT_POLL_INTERVAL", 0.3)
+    # celery prefers these to the app's config.
+    monkeypatch.delenv("CELERY_BROKER_URL", raising=False)
+    monkeypatch.delenv("CELERY_RESULT_BACKEND", raising=False)
+    overrides = {
+        "broker_url": "memory://",
+        "result_backend": "cache+memory://",
+        "broker_connection_retry_on_startup": False,
+    }
+    original = {key: tasks.app.conf[key] for key in overrides}
+    tasks.app.conf.update(overrides)
+    try:
+        with start_worker(
+            tasks.app,
+            pool="threads",
+            concurrency=4,
+            perform_ping_check=False,
+            loglevel="WARNING",
+        ):
+            yield
+    finally:
+        tasks.app.conf.update(original)
+
+
+def test_concurrent_agent_starts(fake_runtimes: FakeRuntimes, celery_worker) -> None:
+    num_agents = 16
+
+    with Session() as session:
+        owner: User = crud.create_user(
+            session, UserBase(dynamic_id=uuid4(), username="start_agent_test")
+        )
+        owner_id = owner.id
+        pairs: list[tuple[UUID, UUID]] = []
+        for i in range(num_agents):
+            runtime: Runtime = crud.create_runtime(
+                session, RuntimeBase(url="", service_no=10_000 + i)
+            )
+            # The fake runtime is keyed by the runtime's id.
+            runtime = crud.update_runtime(
+                session, runtime, RuntimeUpdate(url=fake_runtimes.url(runtime.id))
+            )
+            agent = crud.create_agent(
+                session,
+                AgentBase(
+                    owner_id=owner_id,
+                    character_json={"name": f"agent_{i}"},
+                    env_file="FOO=bar",
+                ),
+            )
+            pairs.append((agent.id, runtime.id))
+    runtime_ids = {str(runtime_id) for _, runtime_id in pairs}
+
+    try:
+        results = [
+            tasks.start_agent.delay(agent_id, runtime_id)
+            for agent_id, runtime_id in pairs
+        ]
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline and not all(r.ready() for r in results):
+            time.sleep(0.1)
+        assert all(r.successful() for r in results)
+
+        with Session() as session:
+            for agent_id, runtime_id in pairs:
+                agent = existing(crud.get_agent(session, agent_id))
+                assert agent.runtime_id == runtime_id
+                assert agent.eliza_agent_id == f"eliza-{runtime_id}"
+
+        # Every start was kicked off before the first agent came up. A worker holding
+        # its slot while polling could only have had 4 starts in flight.
+        assert set(fake_runtimes.started_at) == runtime_ids
+        assert max(fake_runtimes.started_at.values()) < min(
+            fake_runtimes.running_at.values()
+        )
+    finally:
+        with Session() as session:
+            for agent_id, runtime_id in pairs:
+                crud.delete_agent(session, existing(crud.get_agent(session, agent_id)))
+                crud.delete_runtime(
+                    session, existing(crud.get_runtime(session, runtime_id))
+                )
+            crud.delete_user(session, existing(crud.get_user(session, owner_id)))
+
+
+class WorkerLost(BaseException):
+    """
+    Stands in for the worker dying mid-task (not an Exception, so no rollback).
+    """
+
+
+@pytest.fixture()
+def aws(monkeypatch) -> Generator[AWSConfig, None, None]:
+    """
+    A mocked VPC with a load balancer, its HTTP/HTTPS listeners, and an ECS cluster with
+    a runtime task definition. get_aws_config returns the config of runtime 1 in it.
+    """
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    # Sessions and clients are cached, but should see these credentials, and not outlive
+    # the mock.
+    aws_utils.reset_role_session()
+    with mock_aws():
+        ec2 = boto3.client("ec2")
+        elbv2 = boto3.client("elbv2")
+        ecs = boto3.client("ecs")
+
+        vpc_id = ec2.create_vpc(CidrBlock="10.0.0.0/16")["Vpc"]["VpcId"]
+        subnets = [
+            ec2.create_subnet(
+                VpcId=vpc_id, CidrBlock=f"10.0.{i}.0/24", AvailabilityZone=zone
+            )["Subnet"]["SubnetId"]
+            for i, zone in enumerate(["us-east-1a", "us-east-1b"])
+        ]
+        security_group = ec2.create_security_group(
+            GroupName="runtime", Description="runtime", VpcId=vpc_id
+        )["GroupId"]
+        lb_arn = elbv2.create_load_balancer(Name="aiden-test", Subnets=subnets)[
+            "LoadBalancers"
+        ][0]["LoadBalancerArn"]
+        default_tg_arn = elbv2.create_target_group(
+            Name="default", Protocol="HTTP", Port=80, VpcId=vpc_id
+        )["TargetGroups"][0]["TargetGroupArn"]
+        protocols: list[tuple[ProtocolEnumType, int]] = [("HTTP", 80), ("HTTPS", 443)]
+        http_listener_arn, https_listener_arn = (
+            elbv2.create_listener(
+                LoadBalancerArn=lb_arn,
+                Protocol=protocol,
+                Port=port,
+                DefaultActions=[{"Type": "forward", "TargetGroupArn": default_tg_arn}],
+            )["Listeners"][0]["ListenerArn"]
+            for protocol, port in protocols
+        )
+        ecs.create_cluster(clusterName="AidenTest")
+        task_definition_arn = ecs.register_task_definition(
+            family="aiden-agent-runtime-test",
+            containerDefinitions=[
+                {"name": "runtime", "image": "runtime", "memory": 512}
+            ],
+        )["taskDefinition"]["taskDefinitionArn"].rsplit(":", 1)[0]
+
+        aws_config = AWSConfig(
+            vpc_id=vpc_id,
+            target_group_name="aiden-runtime-test-1",
+            http_listener_arn=http_listener_arn,
+            https_listener_arn=https_listener_arn,
+            service_name="aiden-runtime-test-1",
+            host="aiden.test",
+            subdomain="aiden-runtime-1",
+            cluster="AidenTest",
+            task_definition_arn=task_definition_arn,
+            subnets=subnets,
+            security_groups=[security_group],
+        )
+        monkeypatch.setattr(tasks, "get_aws_config", lambda num: aws_config)
+        yield aws_config
+    aws_utils.reset_role_session()
+
+
+def count_runtime_resources(aws_config: AWSConfig) -> tuple[int, int, int]:
+    """
+    Returns the number of target groups, listener rules and active services of runtime
+    1.
+    """
+    elbv2 = boto3.client("elbv2")
+    ecs = boto3.client("ecs")
+    target_groups = [
+        tg
+        for tg in elbv2.describe_target_groups()["TargetGroups"]
+        if tg["TargetGroupName"] == aws_config.target_group_name
+    ]
+    rules = [
+        rule
+        for listener_arn in (
+            aws_config.http_listener_arn,
+            aws_config.https_listener_arn,
+        )
+        for rule in elbv2.describe_rules(ListenerArn=listener_arn)["Rules"]
+        if not rule["IsDefault"]
+    ]
+    services = [
+        service
+        for service in ecs.describe_services(
+            cluster=aws_config.cluster, services=[aws_config.service_name]
+        )["services"]
+        if service["status"] == "ACTIVE"
+    ]
+    return len(target_groups), len(rules), len(services)
+
+
+def new_runtime(fake_runtimes: FakeRuntimes) -> UUID:
+    with Session() as session:
+        runtime = crud.create_runtime(session, RuntimeBase(url="", service_no=1))
+        runtime = crud.update_runtime(
+            session, runtime, RuntimeUpdate(url=fake_runtimes.url(runtime.id))
+        )
+        return runtime.id
+
+
+def test_create_runtime_resumes(
+    aws: AWSConfig, fake_runtimes: FakeRuntimes, monkeypatch
+) -> None:
+    runtime_id = new_runtime(fake_runtimes)
+    create_runtime_service = tasks.create_runtime_service
+
+    def create_service_then_die(**kwargs) -> str:
+        create_runtime_service(**kwargs)
+        raise WorkerLost()
+
+    # The worker dies after creating the service, but before recording it.
+    monkeypatch.setattr(tasks, "create_runtime_service", create_service_then_die)
+    with pytest.raises(WorkerLost):
+        tasks.create_runtime(
+            aws_config_dict=aws.model_dump(), runtime_no=1, runtime_id=runtime_id
+        )
+    with Session() as session:
+        runtime = crud.get_runtime(session, runtime_id)
+        assert runtime is not None
+        assert runtime.step == RuntimeStep.CREATE_LISTENER_RULES
+    assert count_runtime_resources(aws) == (1, 2, 1)
+
+    # Redelivered, it picks up where it left off without creating anything twice.
+    monkeypatch.setattr(tasks, "create_runtime_service", create_runtime_service)
+    tasks.create_runtime(
+        aws_config_dict=aws.model_dump(), runtime_no=1, runtime_id=runtime_id
+    )
+    with Session() as session:
+        runtime = crud.get_runtime(session, runtime_id)
+        assert runtime is not None
+        assert runtime.step == RuntimeStep.STARTED
+        assert runtime.service_arn is not None
+    assert count_runtime_resources(aws) == (1, 2, 1)
+
+    tasks.delete_runtime(runtime_id=runtime_id)
+    with Session() as session:
+        assert crud.get_runtime(session, runtime_id) is None
+    assert count_runtime_resources(aws) == (0, 0, 0)
+
+
+def test_delete_partially_provisioned_runtime(
+    aws: AWSConfig, fake_runtimes: FakeRuntimes, monkeypatch
+) -> None:
+    runtime_id = new_runtime(fake_runtimes)
+    create_listener_rules = tasks.create_listener_rules
+
+    def create_rules_then_die(**kwargs) -> tuple[str, str]:
+        create_listener_rules(**kwargs)
+        raise WorkerLost()
+
+    monkeypatch.setattr(tasks, "create_listener_rules", create_rules_then_die)
+    with pytest.raises(WorkerLost):
+        tasks.create_runtime(
+            aws_config_dict=aws.model_dump(), runtime_no=1, runtime_id=runtime_id
+        )
+    assert count_runtime_resources(aws) == (1, 2, 0)
+
+    # The rules' ARNs were never recorded, so they're found by host.
+    tasks.delete_runtime(runtime_id=runtime_id)
+    with Session() as session:
+        assert crud.get_runtime(session, runtime_id) is None
+    assert count_runtime_resources(aws) == (0, 0, 0)
+
+
+def test_delete_while_provisioning(
+    aws: AWSConfig, fake_runtimes: FakeRuntimes, monkeypatch
+) -> None:
+    runtime_id = new_runtime(fake_runtimes)
+    find_service = tasks.find_service
+
+    def find_service_then_delete(*args) -> str | None:
+        service_arn = find_service(*args)
+        with Session() as session:
+            runtime = crud.get_runtime(session, runtime_id)
+            assert runtime is not None
+            crud.update_runtime(
+                session, runtime, RuntimeUpdate(step=RuntimeStep.DELETE_SERVICE)
+            )
+        return service_arn
+
+    # delete_runtime starts while the service is being looked up.
+    monkeypatch.setattr(tasks, "find_service", find_service_then_delete)
+    tasks.create_runtime(
+        aws_config_dict=aws.model_dump(), runtime_no=1, runtime_id=runtime_id
+    )
+    assert count_runtime_resources(aws) == (1, 2, 0)
+
+    # The service is created anyway, just after it was deleted.
+    monkeypatch.setattr(tasks, "find_service", find_service)
+    with Session() as session:
+        runtime = crud.get_runtime(session, runtime_id)
+        assert runtime is not None
+        crud.update_runtime(
+            session, runtime, RuntimeUpdate(step=RuntimeStep.CREATE_LISTENER_RULES)
+        )
+    tasks.create_runtime(
+        aws_config_dict=aws.model_dump(), runtime_no=1, runtime_id=runtime_id
+    )
+    with Session() as session:
+        runtime = crud.get_runtime(session, runtime_id)
+        assert runtime is not None
+        crud.update_runtime(
+            session, runtime, RuntimeUpdate(step=RuntimeStep.SERVICE_DRAINING)
+        )
+    assert count_runtime_resources(aws) == (1, 2, 1)
+
+    # The drain step sees it, and deletes it again.
+    tasks.delete_runtime(runtime_id=runtime_id)
+    with Session() as session:
+        assert crud.get_runtime(session, runtime_id) is None
+    assert count_runtime_resources(aws) == (0, 0, 0)
+
+
+def test_role_session(aws: AWSConfig, monkeypatch) -> None:
+    assert aws_utils.get_role_session() is aws_utils.get_role_session()
+    assert aws_utils.get_ecs_client() is aws_utils.get_ecs_client()
+
+    # In dev, the role is assumed once, then again only once its credentials are about
+    # to expire.
+    aws_utils.reset_role_session()
+    monkeypatch.setenv("ENV", "dev")
+    assumed: list[dict[str, str]] = []
+    assume_role = aws_utils.assume_role
+
+    def counted_assume_role() -> dict[str, str]:
+        assumed.append(assume_role())
+        return assumed[-1]
+
+    monkeypatch.setattr(aws_utils, "assume_role", counted_assume_role)
+    credentials = aws_utils.get_role_session().get_credentials()
+    assert credentials is not None
+    assert credentials.get_frozen_credentials().access_key == assumed[0]["access_key"]
+    aws_utils.get_ecs_client().list_clusters()
+    assert len(assumed) == 1
+
+    # Expires within botocore's refresh window.
+    credentials._expiry_time = (  # type: ignore[attr-defined]
+        datetime.now(timezone.utc) + timedelta(minutes=1)
+    )
+    aws_utils.get_ecs_client().list_clusters()
+    assert len(assumed) == 2
+
+    # A forked worker doesn't inherit the session.
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if aws_utils._role_session is None else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert aws_utils._role_session is not None
+
+
+Span = tuple[float, float]
+
+
+def spans(calls: list[tuple[str, float, float]], *operations: str) -> list[Span]:
+    """
+    The (start, end) of each call to one of operations.
+    """
+    found = [(start, end) for operation, start, end in calls if operation in operations]
+    assert found, f"No call to {operations}"
+    return found
+
+
+def assert_in_order(first: list[Span], then: list[Span]) -> None:
+    assert max(end for _, end in first) <= min(start for start, _ in then)
+
+
+def assert_overlapping(calls: list[Span]) -> None:
+    assert max(start for start, _ in calls) < min(end for _, end in calls)
+
+
+def test_provisioning_latency(
+    aws: AWSConfig, fake_runtimes: FakeRuntimes, monkeypatch
+) -> None:
+    """
+    With every AWS call taking `latency`, independent calls overlap, while calls that
+    depend on others wait for them.
+    """
+    latency = 0.2
+    # Operation, start, end.
+    calls: list[tuple[str, float, float]] = []
+
+    def slow_call(event_name: str, **kwargs) -> None:
+        start = time.perf_counter()
+        time.sleep(latency)
+        calls.append((event_name.rsplit(".", 1)[-1], start, time.perf_counter()))
+
+    aws_utils.get_role_session().events.register("before-call.*.*", slow_call)
+    # Warm, as in a worker that has run a task before. Error classes are built on first
+    # use.
+    aws_utils.get_ecs_client()
+    aws_utils.get_elbv2_client().exceptions.TargetGroupNotFoundException
+
+    runtime_id = new_runtime(fake_runtimes)
+    with Session() as session:
+        runtime = crud.get_runtime(session, runtime_id)
+        assert runtime is not None
+        tasks.provision_runtime(session, runtime, aws, runtime_no=1)
+        assert runtime.step == RuntimeStep.HEALTH_WAIT
+    assert len(calls) == 9
+    # Target group lookup, then the target group.
+    assert_in_order(
+        spans(calls, "DescribeTargetGroups"), spans(calls, "CreateTargetGroup")
+    )
+    # Then the rules (lookup, create) alongside the service and task definition
+    # lookups.
+    lookups = spans(
+        calls, "DescribeRules", "DescribeServices", "DescribeTaskDefinition"
+    )
+    assert_in_order(spans(calls, "CreateTargetGroup"), lookups)
+    assert_overlapping(lookups)
+    # Each listener's rule is created once it's looked up, both at once.
+    assert_overlapping(spans(calls, "CreateRule"))
+    # Then the service, which needs the rules.
+    assert_in_order(
+        spans(calls, "CreateRule", "DescribeServices"), spans(calls, "CreateService")
+    )
+
+    calls.clear()
+    tasks.delete_runtime(runtime_id=runtime_id)
+    assert count_runtime_resources(aws) == (0, 0, 0)
+    assert len(calls) == 5
+    # The service and both rules at once, the drain check, then the target group.
+    deletes = spans(calls, "DeleteService", "DeleteRule")
+    assert len(deletes) == 3
+    assert_overlapping(deletes)
+    assert_in_order(deletes, spans(calls, "DescribeServices"))
+    assert_in_order(spans(calls, "DescribeServices"), spans(calls, "DeleteTargetGroup"))
+
+
+@pytest.fixture()
+def celery_results() -> Generator[None, None, None]:
+    """
+    celery's result table, which celery would create on first use.
+    """
+    CeleryTask.__table__.create(engine, checkfirst=True)
+    yield
+    CeleryTask.__table__.drop(engine)
+
+
+def test_healthcheck_runtimes(monkeypatch, celery_results) -> None:
+    num_runtimes = 20
+    latency = 0.2
+    deleted: list[UUID] = []
+    restarted: list[UUID] = []
+    monkeypatch.setattr(
+        tasks.delete_runtime, "delay", lambda runtime_id: deleted.append(runtime_id)
+    )
+    monkeypatch.setattr(
+        tasks.start_agent,
+        "delay",
+        lambda agent_id, runtime_id: restarted.append(agent_id),
+    )
+
+    with serve(FakeRuntimes(polls_until_running=1, latency=latency)) as fake_runtimes:
+        with Session() as session:
+            owner = crud.create_user(
+                session, UserBase(dynamic_id=uuid4(), username="healthcheck_test")
+            )
+            owner_id = owner.id
+            runtime_ids: list[UUID] = []
+            for i in range(num_runtimes):
+                runtime = crud.create_runtime(
+                    session, RuntimeBase(url="", service_no=20_000 + i)
+                )
+                runtime = crud.update_runtime(
+                    session,
+                    runtime,
+                    RuntimeUpdate(
+                        url=fake_runtimes.url(runtime.id), step=RuntimeStep.STARTED
+                    ),
+                )
+                runtime_ids.append(runtime.id)
+            dying, unhealthy, running, stopped, provisioning, updating = runtime_ids[:6]
+            crud.update_runtime(
+                session,
+                existing(crud.get_runtime(session, dying)),
+                RuntimeUpdate(
+                    failed_healthchecks=tasks.FAILED_HEALTHCHECKS_BEFORE_DELETE
+                ),
+            )
+            crud.update_runtime(
+                session,
+                existing(crud.get_runtime(session, provisioning)),
+                RuntimeUpdate(step=RuntimeStep.HEALTH_WAIT),
+            )
+            update_task = crud.create_runtime_update_task(
+                session,
+                RuntimeUpdateTaskBase(runtime_id=updating, celery_task_id=uuid4()),
+            )
+            session.execute(
+                insert(CeleryTask.__table__).values(
+                    task_id=str(update_task.celery_task_id), status="STARTED"
+                )
+            )
+            session.commit()
+            fake_runtimes.unhealthy = {str(dying), str(unhealthy), str(updating)}
+            agent_ids = {
+                runtime_id: crud.create_agent(
+                    session,
+                    AgentBase(
+                        owner_id=owner_id,
+                        character_json={"name": f"agent_{i}"},
+                        env_file="FOO=bar",
+                        runtime_id=runtime_id,
+                        eliza_agent_id=eliza_agent_id,
+                    ),
+                ).id
+                for i, (runtime_id, eliza_agent_id) in enumerate(
+                    [(running, f"eliza-{running}"), (stopped, "eliza-someone-else")]
+                )
+            }
+
+        try:
+            tasks.healthcheck_runtimes()
+
+            # Every probed runtime's first request is in flight at once.
+            first_gets: dict[str, Span] = {}
+            for path_id, start, end in fake_runtimes.gets:
+                if path_id not in first_gets or start < first_gets[path_id][0]:
+                    first_gets[path_id] = (start, end)
+            assert len(first_gets) == num_runtimes - 2
+            assert_overlapping(list(first_gets.values()))
+            assert deleted == [dying]
+            assert restarted == [agent_ids[stopped]]
+            with Session() as session:
+                runtimes = {
+                    runtime_id: existing(crud.get_runtime(session, runtime_id))
+                    for runtime_id in runtime_ids
+                }
+                assert runtimes[dying].failed_healthchecks == (
+                    tasks.FAILED_HEALTHCHECKS_BEFORE_DELETE + 1
+                )
+                assert runtimes[unhealthy].failed_healthchecks == 1
+                assert runtimes[unhealthy].last_healthcheck is None
+                assert runtimes[provisioning].last_healthcheck is None
+                # Skipped, so its failure doesn't count.
+                assert runtimes[updating].failed_healthchecks == 0
+                assert runtimes[updating].last_healthcheck is None
+                for runtime_id in runtime_ids[2:4] + runtime_ids[6:]:
+                    assert runtimes[runtime_id].failed_healthchecks == 0
+                    assert runtimes[runtime_id].last_healthcheck is not None
+        finally:
+            with Session() as session:
+                for agent_id in agent_ids.values():
+                    crud.delete_agent(
+                        session, existing(crud.get_agent(session, agent_id))
+                    )
+                for runtime_id in runtime_ids:
+                    crud.delete_runtime(
+                        session, existing(crud.get_runtime(session, runtime_id))
+                    )
+                crud.delete_user(session, existing(crud.get_user(session, owner_id)))
@@ -0,0 +1,399 @@
+import asyncio
+import json
+import math
+import threading
+from collections import Counter
+from collections.abc import AsyncGenerator, Generator
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import fakeredis
+import pytest
+import pytest_asyncio
+import rlp
+from eth_account import Account
+from eth_utils import (
+    event_abi_to_log_topic,
+    function_signature_to_4byte_selector,
+    keccak,
+)
+
+from src import token_deployment
+from src.nonces import MemoryNonceStore, NonceManager, RedisNonceStore
+
+CHAIN_ID = 1329
+GAS_PRICE = 10**9
+USER = Account.create().address
+TOKEN = Account.create().address
+TOKEN_ABI = [
+    {
+        "type": "function",
+        "name": "sellTokens",
+        "inputs": [{"name": "amount", "type": "uint256"}],
+        "outputs": [],
+        "stateMutability": "nonpayable",
+    }
+]
+
+BONDING = Account.create().address
+BONDING_ABI = [
+    {
+        "type": "function",
+        "name": "assetLaunchFee",
+        "inputs": [],
+        "outputs": [{"name": "", "type": "uint256"}],
+        "stateMutability": "view",
+    },
+    {
+        "type": "function",
+        "name": "launchWithSei",
+        "inputs": [
+            {"name": "name", "type": "string"},
+            {"name": "ticker", "type": "string"},
+        ],
+        "outputs": [],
+        "stateMutability": "payable",
+    },
+    {
+        "type": "event",
+        "name": "Launched",
+        "anonymous": False,
+        "inputs": [
+            {"name": "token", "type": "address", "indexed": True},
+            {"name": "pair", "type": "address", "indexed": True},
+            {"name": "n", "type": "uint256", "indexed": False},
+        ],
+    },
+]
+LAUNCHED_TOPIC = "0x" + event_abi_to_log_topic(BONDING_ABI[2]).hex()  # type: ignore
+ASSET_LAUNCH_FEE_SELECTOR = (
+    "0x" + function_signature_to_4byte_selector("assetLaunchFee()").hex()
+)
+LAUNCH_FEE = 10**18
+TRANSFER_GAS = 21000
+CALL_GAS = 60000
+
+
+class RpcError(Exception):
+    pass
+
+
+def padded(address: str) -> str:
+    return "0x" + address[2:].lower().rjust(64, "0")
+
+
+class FakeRpc(ThreadingHTTPServer):
+    """
+    Stands in for SEI's EVM RPC, including batches. Counts connections, HTTP requests,
+    and calls per method.
+    Like a node, it rejects raw transactions with a used nonce, and holds ones with a
+    nonce past the sender's next until the gap is filled. Transactions are mined as soon
+    as they can be. Those to the bonding contract launch a token.
+    Gas estimates for senders in `reverts` fail, as if the transaction would revert, and
+    the next `failing_sends` raw transactions are rejected.
+    """
+
+    # Accept all of a burst of concurrent launches at once.
+    request_queue_size = 128
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), FakeRpcHandler)
+        self.lock = threading.Lock()
+        self.calls: Counter[str] = Counter()
+        self.connections = 0
+        self.requests = 0
+        # Next nonce of each sender, i.e. how many of its transactions were mined.
+        self.nonces: dict[str, int] = {}
+        self.reverts: set[str] = set()
+        self.failing_sends = 0
+        # Transactions waiting for a gap in their sender's nonces, by sender and nonce.
+        self.queued: dict[str, dict[int, dict]] = {}
+        self.receipts: dict[str, dict] = {}
+        self.launched: list[str] = []
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host!s}:{port}"
+
+    def result(self, method: str, params: list):
+        if method == "eth_chainId":
+            return hex(CHAIN_ID)
+        if method == "eth_gasPrice":
+            return hex(GAS_PRICE)
+        if method == "eth_getTransactionCount":
+            return hex(self.nonces.get(params[0], 0))
+        if method == "eth_estimateGas":
+            if params[0]["from"] in self.reverts:
+                raise RpcError("execution reverted")
+            return hex(CALL_GAS if params[0].get("data") else TRANSFER_GAS)
+        if method == "eth_call":
+            assert params[0]["data"] == ASSET_LAUNCH_FEE_SELECTOR
+            return "0x" + LAUNCH_FEE.to_bytes(32, "big").hex()
+        if method == "eth_sendRawTransaction":
+            return self.send_raw_transaction(bytes.fromhex(params[0][2:]))
+        if method == "eth_getTransactionReceipt":
+            return self.receipts.get(params[0])
+        raise NotImplementedError(method)
+
+    def send_raw_transaction(self, raw: bytes) -> str:
+        if self.failing_sends:
+            self.failing_sends -= 1
+            raise RpcError("internal error")
+        # Legacy transaction: nonce, gasPrice, gas, to, value, data, v, r, s
+        nonce, _, _, to, _, _, _, _, _ = rlp.decode(raw)
+        nonce = int.from_bytes(nonce, "big")
+        sender = Account.recover_transaction(raw)
+        tx_hash = "0x" + keccak(raw).hex()
+        queued = self.queued.setdefault(sender, {})
+        if nonce < self.nonces.get(sender, 0):
+            raise RpcError("nonce too low")
+        if nonce in queued:
+            raise RpcError("already known")
+        queued[nonce] = {"hash": tx_hash, "to": "0x" + to.hex()}
+        while (next_nonce := self.nonces.get(sender, 0)) in queued:
+            self.mine(sender, queued.pop(next_nonce))
+            self.nonces[sender] = next_nonce + 1
+        return tx_hash
+
+    def mine(self, sender: str, tx: dict) -> None:
+        block = hex(len(self.receipts) + 1)
+        block_hash = "0x" + keccak(text=block).hex()
+        logs = []
+        if tx["to"] == BONDING.lower():
+            token = "0x" + tx["hash"][-40:]
+            self.launched.append(token)
+            logs.append(
+                {
+                    "address": BONDING,
+                    "topics": [LAUNCHED_TOPIC, padded(token), padded(sender)],
+                    "data": "0x" + (0).to_bytes(32, "big").hex(),
+                    "blockNumber": block,
+                    "blockHash": block_hash,
+                    "transactionHash": tx["hash"],
+                    "transactionIndex": "0x0",
+                    "logIndex": "0x0",
+                    "removed": False,
+                }
+            )
+        self.receipts[tx["hash"]] = {
+            "transactionHash": tx["hash"],
+            "transactionIndex": "0x0",
+            "blockNumber": block,
+            "blockHash": block_hash,
+            "from": sender,
+            "to": tx["to"],
+            "cumulativeGasUsed": hex(CALL_GAS),
+            "gasUsed": hex(CALL_GAS),
+            "effectiveGasPrice": hex(GAS_PRICE),
+            "contractAddress": None,
+            "logs": logs,
+            "logsBloom": "0x" + "00" * 256,
+            "status": "0x1",
+            "type": "0x0",
+        }
+
+    def respond(self, request: dict) -> dict:
+        self.calls[request["method"]] += 1
+        response = {"jsonrpc": "2.0", "id": request["id"]}
+        try:
+            response["result"] = self.result(request["method"], request["params"])
+        except RpcError as e:
+            response["error"] = {"code": 3, "message": str(e)}
+        return response
+
+
+class FakeRpcHandler(BaseHTTPRequestHandler):
+    server: FakeRpc
+    # Keep-alive
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self) -> None:
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        response: list[dict] | dict
+        with self.server.lock:
+            self.server.requests += 1
+            if isinstance(request, list):
+                response = [self.server.respond(item) for item in request]
+            else:
+                response = self.server.respond(request)
+        payload = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+@contextmanager
+def serve(server: FakeRpc) -> Generator[FakeRpc, None, None]:
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest_asyncio.fixture()
+async def fake_rpc(monkeypatch) -> AsyncGenerator[FakeRpc, None]:
+    with serve(FakeRpc()) as server:
+        monkeypatch.setattr(token_deployment, "SEI_RPC_URL", server.url)
+        monkeypatch.setattr(token_deployment, "_rpc", None)
+        yield server
+        await token_deployment.close_rpc()
+
+
+@pytest.mark.asyncio
+async def test_unsigned_transactions(fake_rpc: FakeRpc) -> None:
+    fake_rpc.nonces[USER] = 7
+
+    txn = await token_deployment.buy_token_unsigned(100, TOKEN, USER)
+    assert txn == {
+        "from": USER,
+        "to": TOKEN,
+        "value": 100,
+        "gas": math.ceil(TRANSFER_GAS * token_deployment.GAS_ESTIMATE_MARGIN),
+        "gasPrice": GAS_PRICE,
+        "nonce": 7,
+        "chainId": CHAIN_ID,
+    }
+    # Nonce, gas estimate, gas price and chain id in one round trip.
+    assert fake_rpc.requests == 1
+    assert sum(fake_rpc.calls.values()) == 4
+
+    # The chain id is cached.
+    fake_rpc.calls.clear()
+    txn = await token_deployment.sell_token_unsigned(5, TOKEN_ABI, TOKEN, USER)
+    # sellTokens(uint256) selector, and the amount.
+    assert txn["data"] == "0x6c11bcd3" + (5).to_bytes(32, "big").hex()
+    assert txn["gas"] == math.ceil(CALL_GAS * token_deployment.GAS_ESTIMATE_MARGIN)
+    assert fake_rpc.requests == 2
+    assert "eth_chainId" not in fake_rpc.calls
+    # Over one kept-alive connection.
+    assert fake_rpc.connections == 1
+
+    fake_rpc.reverts.add(USER)
+    with pytest.raises(ValueError, match="execution reverted"):
+        await token_deployment.buy_token_unsigned(100, TOKEN, USER)
+
+
+@pytest.mark.asyncio
+async def test_unsigned_transactions_batch(fake_rpc: FakeRpc, monkeypatch) -> None:
+    monkeypatch.setattr(token_deployment, "RPC_MAX_BATCH_SIZE", 16)
+    users = [Account.create().address for _ in range(10)]
+    fake_rpc.nonces = {user: i for i, user in enumerate(users)}
+    fake_rpc.reverts.add(users[0])
+
+    # Three amounts for each user.
+    calls = [
+        token_deployment.buy_call(amount, TOKEN, user)
+        for user in users
+        for amount in (1, 2, 3)
+    ]
+    transactions = await token_deployment.unsigned_transactions(calls)
+
+    assert transactions[:3] == ["execution reverted"] * 3
+    for i, transaction in enumerate(transactions[3:], start=3):
+        assert isinstance(transaction, dict)
+        assert transaction["value"] == i % 3 + 1
+        assert transaction["nonce"] == i // 3
+    # Gas price, chain id, 10 nonces and 30 estimates, in three concurrent batches.
+    assert sum(fake_rpc.calls.values()) == 42
+    assert fake_rpc.requests == 3
+
+
+@pytest.mark.asyncio
+async def test_gas_price_ttl(fake_rpc: FakeRpc, monkeypatch) -> None:
+    rpc = await token_deployment.get_rpc()
+    assert await rpc.gas_price() == GAS_PRICE
+    assert await rpc.gas_price() == GAS_PRICE
+    assert fake_rpc.calls["eth_gasPrice"] == 1
+
+    monkeypatch.setattr(token_deployment, "GAS_PRICE_TTL_SECONDS", 0)
+    await asyncio.sleep(0.01)
+    await rpc.gas_price()
+    assert fake_rpc.calls["eth_gasPrice"] == 2
+
+
+@pytest_asyncio.fixture(params=["memory", "redis"])
+async def deployer(
+    request, fake_rpc: FakeRpc, monkeypatch, tmp_path
+) -> AsyncGenerator[str, None]:
+    """
+    A deployer key, with its nonces managed in either store. Returns its address.
+    """
+    account = Account.create()
+    monkeypatch.setenv("TOKEN_DEPLOYER_PRIVATE_KEY", account.key.hex())
+    monkeypatch.setenv("BONDING_CONTRACT_ADDRESS", BONDING)
+    artifact = tmp_path / "Bonding.json"
+    artifact.write_text(json.dumps({"abi": BONDING_ABI, "bytecode": "0x"}))
+    monkeypatch.setattr(token_deployment, "BONDING_ARTIFACT_PATH", str(artifact))
+    token_deployment.load_bonding_artifact.cache_clear()
+
+    client = fakeredis.FakeAsyncRedis()
+    store = MemoryNonceStore() if request.param == "memory" else RedisNonceStore(client)
+    monkeypatch.setattr(
+        token_deployment,
+        "deployer_nonces",
+        NonceManager(store, token_deployment.pending_nonce),
+    )
+    yield account.address
+    token_deployment.load_bonding_artifact.cache_clear()
+    await client.aclose()
+
+
+async def launch(n: int) -> list[str | BaseException]:
+    return await asyncio.gather(
+        *(token_deployment.deploy_token(f"Token {i}", f"T{i}") for i in range(n)),
+        return_exceptions=True,
+    )
+
+
+@pytest.mark.asyncio
+async def test_parallel_launches(fake_rpc: FakeRpc, deployer: str) -> None:
+    tokens = await launch(40)
+
+    assert sorted(str(token).lower() for token in tokens) == sorted(fake_rpc.launched)
+    assert fake_rpc.nonces[deployer] == 40
+    # Synced once, and then counted locally.
+    assert fake_rpc.calls["eth_getTransactionCount"] == 1
+    # Over one pool of connections.
+    assert fake_rpc.connections <= token_deployment.RPC_POOL_SIZE
+    assert await token_deployment.deployer_nonces.store.pending(deployer) == {}
+
+
+@pytest.mark.asyncio
+async def test_launch_resyncs(fake_rpc: FakeRpc, deployer: str) -> None:
+    await launch(1)
+    # Transactions sent with the key from elsewhere, which this process doesn't know
+    # about.
+    fake_rpc.nonces[deployer] += 3
+
+    tokens = await launch(10)
+    assert {str(token).lower() for token in tokens} == set(fake_rpc.launched[1:])
+    assert fake_rpc.nonces[deployer] == 1 + 3 + 10
+
+    # A failed send leaves a gap, which holds up later transactions until the next send
+    # fills it.
+    fake_rpc.failing_sends = 1
+
+    async def launch_later() -> list[str | BaseException]:
+        await asyncio.sleep(0.5)
+        return await launch(1)
+
+    launches, later = await asyncio.gather(launch(10), launch_later())
+    errors = [str(e) for e in launches if isinstance(e, BaseException)]
+    assert len(errors) == 1 and "internal error" in errors[0]
+    assert not isinstance(later[0], BaseException)
+    assert fake_rpc.nonces[deployer] == 1 + 3 + 10 + 9 + 1
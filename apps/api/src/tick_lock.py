@@ -0,0 +1,145 @@
+"""
+Periodic jobs that run in every api process, like the runtime autoscaler, but take turns
+rather than all ticking.
+
+Regular ticks run once per interval across all processes: whichever process gets there
+first marks the interval as taken, and the others skip it. A tick woken early, e.g. by a
+missed agent start, doesn't wait for the interval, since running sooner is the point of
+waking it. Either way, ticks hold a lock while they run, so no two overlap.
+"""
+
+import asyncio
+from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+import redis
+from redis import asyncio as aioredis
+from redis.asyncio.lock import Lock
+
+from src import logger
+
+# A tick that holds the lock for longer than this is assumed to have died.
+TICK_TIMEOUT = 60
+# Seconds between checks of a job that has nothing to do, unless it's woken.
+IDLE_INTERVAL = 60
+
+
+class TickLock:
+    def __init__(
+        self, client: aioredis.Redis | None, name: str, interval: float
+    ) -> None:
+        """
+        client: Redis to coordinate in. None if this is the only api process.
+        name: Of the job. Keys and log messages are prefixed with it.
+        interval: Seconds between regular ticks.
+        """
+        self.client = client
+        self.name = name
+        self.interval = interval
+
+    async def _acquire(self, woken: bool) -> Lock | None:
+        assert self.client is not None
+        # Expires just before the next regular tick.
+        interval_ms = int(self.interval * 900)
+        if not woken and not await self.client.set(
+            f"{self.name}:interval", 1, nx=True, px=interval_ms
+        ):
+            return None
+        # A woken tick waits for one that's running elsewhere, rather than being lost.
+        lock = self.client.lock(
+            f"{self.name}:tick",
+            timeout=TICK_TIMEOUT,
+            blocking=woken,
+            blocking_timeout=TICK_TIMEOUT,
+        )
+        if not await lock.acquire():
+            return None
+        if woken:
+            # Counts as this interval's tick.
+            await self.client.set(f"{self.name}:interval", 1, px=interval_ms)
+        return lock
+
+    @asynccontextmanager
+    async def tick(self, woken: bool = False) -> AsyncIterator[bool]:
+        """
+        Yields whether this process should run the tick. Skips it if redis is down.
+        woken: Whether the tick was woken early, rather than due.
+        """
+        if self.client is None:
+            yield True
+            return
+        try:
+            lock = await self._acquire(woken)
+        except redis.RedisError as e:
+            logger.warning(f"[{self.name}] Skipping tick, lock unavailable: {e}")
+            lock = None
+        if lock is None:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            try:
+                await lock.release()
+            except redis.RedisError as e:
+                # Expires by itself.
+                logger.warning(f"[{self.name}] Failed to release tick lock: {e}")
+
+
+class Ticker(ABC):
+    """
+    A job that ticks every interval seconds until cancelled, taking turns with the other
+    api processes. See TickLock.
+    """
+
+    def __init__(
+        self, lock_client: aioredis.Redis | None, name: str, interval: float
+    ) -> None:
+        """
+        lock_client: Redis to take the tick lock in. None if this is the only api
+        process.
+        """
+        self.tick_lock = TickLock(lock_client, name, interval)
+        self._wake = asyncio.Event()
+
+    def wake(self) -> None:
+        """
+        Runs a tick right away, even if another process just ran one.
+        """
+        self._wake.set()
+
+    @abstractmethod
+    async def _tick(self) -> None:
+        pass
+
+    async def idle(self) -> bool:
+        """
+        Whether there is nothing to do. An idle job checks again every IDLE_INTERVAL
+        seconds, or once woken, rather than ticking.
+        """
+        return False
+
+    async def tick(self) -> None:
+        woken = self._wake.is_set()
+        self._wake.clear()
+        async with self.tick_lock.tick(woken) as acquired:
+            if acquired:
+                await self._tick()
+
+    async def run(self) -> None:
+        name, interval = self.tick_lock.name, self.tick_lock.interval
+        while True:
+            try:
+                idle = await self.idle()
+                if not idle:
+                    await self.tick()
+            except Exception as e:
+                idle = False
+                logger.exception(f"[{name}] Tick failed: {e}")
+            try:
+                await asyncio.wait_for(
+                    self._wake.wait(), IDLE_INTERVAL if idle else interval
+                )
+            except asyncio.TimeoutError:
+                pass
@@ -1,99 +1,360 @@
+import asyncio
 import json
+import math
 import os
+import time
+from collections.abc import Mapping
+from functools import cache
+from typing import Any
 
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
 from eth_account import Account
 from eth_utils import event_abi_to_log_topic
+from hexbytes import HexBytes
 from web3 import AsyncHTTPProvider, AsyncWeb3
+from web3.contract import AsyncContract
+from web3.types import Nonce, Wei
+
+from src import logger
+from src.nonces import NonceManager, nonce_store_from_env
 
 SEI_RPC_URL = os.getenv("SEI_RPC_URL")  # Get the SEI EVM RPC URL
+BONDING_ARTIFACT_PATH = (
+    "./src/launchpad-contracts/artifacts/contracts/Bonding.sol/Bonding.json"
+)
+# Of the tokens the bonding contract launches.
+TOKEN_ARTIFACT_PATH = os.getenv(
+    "TOKEN_ARTIFACT_PATH",
+    "./src/launchpad-contracts/artifacts/contracts/FERC20.sol/FERC20.json",
+)
+# Connections kept open to the RPC, per event loop.
+RPC_POOL_SIZE = int(os.getenv("SEI_RPC_POOL_SIZE", 32))
+RPC_KEEPALIVE_SECONDS = 60
+RPC_TIMEOUT_SECONDS = 10
+# Gas price is refetched once it's older than this.
+GAS_PRICE_TTL_SECONDS = 5
+# Requests per JSON-RPC batch. Providers cap batch sizes, so larger batches are split,
+# and the parts sent concurrently.
+RPC_MAX_BATCH_SIZE = int(os.getenv("SEI_RPC_MAX_BATCH_SIZE", 100))
+# Gas estimates are padded by this factor, since state can change before a transaction
+# lands.
+GAS_ESTIMATE_MARGIN = 1.2
+
+
+@cache
+def load_bonding_artifact() -> tuple[list[dict], str]:
+    """
+    ABI and bytecode of the Bonding contract, read from disk once.
+    """
+    with open(BONDING_ARTIFACT_PATH, "r") as f:
+        contract_json = json.load(f)
+    return contract_json["abi"], contract_json["bytecode"]
 
 
-# Connects to SEI's EVM RPC and deploys a new instance of the token contract.
-async def deploy_token(name, ticker) -> tuple[str, list[dict]]:
-    SEI_RPC_URL = os.getenv("SEI_RPC_URL")
+@cache
+def load_token_abi() -> list[dict]:
+    with open(TOKEN_ARTIFACT_PATH, "r") as f:
+        return json.load(f)["abi"]
+
+
+class SeiRpc:
+    """
+    Connection to SEI's EVM RPC, shared by all calls on one event loop. See get_rpc.
+
+    Keeps its HTTP connections alive between requests (web3's default session closes
+    them after every request), and caches what doesn't change between calls: the chain
+    id, contract objects, and the gas price for GAS_PRICE_TTL_SECONDS.
+    """
+
+    def __init__(self, rpc_url: str, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Must be created on the loop it is used on.
+        """
+        self.loop = loop
+        self.provider = AsyncHTTPProvider(rpc_url)
+        self.w3 = AsyncWeb3(self.provider)
+        self._chain_id: int | None = None
+        self._gas_price: int | None = None
+        self._gas_price_fetched_at = 0.0
+        self._contracts: dict[str, AsyncContract] = {}
+        self.session = ClientSession(
+            raise_for_status=True,
+            connector=TCPConnector(
+                limit=RPC_POOL_SIZE, keepalive_timeout=RPC_KEEPALIVE_SECONDS
+            ),
+            timeout=ClientTimeout(total=RPC_TIMEOUT_SECONDS),
+        )
+        # Installs the session before the provider's first request, which would
+        # otherwise create and cache its own.
+        self.ready = loop.create_task(self.provider.cache_async_session(self.session))
+
+    async def chain_id(self) -> int:
+        if self._chain_id is None:
+            self._chain_id = await self.w3.eth.chain_id
+        return self._chain_id
+
+    async def gas_price(self) -> int:
+        now = time.monotonic()
+        if (
+            self._gas_price is None
+            or now - self._gas_price_fetched_at > GAS_PRICE_TTL_SECONDS
+        ):
+            self._gas_price = await self.w3.eth.gas_price
+            self._gas_price_fetched_at = now
+        return self._gas_price
+
+    async def transaction_count(
+        self, address: str, block_identifier: str = "latest"
+    ) -> int:
+        return await self.w3.eth.get_transaction_count(
+            address,  # type: ignore[arg-type]
+            block_identifier,  # type: ignore[arg-type]
+        )
+
+    async def batch(self, requests: list[tuple[str, list]]) -> list[dict[str, Any]]:
+        """
+        Sends requests as JSON-RPC batches. Returns the raw responses, in order, each
+        with either a result or an error.
+        """
+        chunks = [
+            requests[i : i + RPC_MAX_BATCH_SIZE]
+            for i in range(0, len(requests), RPC_MAX_BATCH_SIZE)
+        ]
+        try:
+            responses = await asyncio.gather(
+                *(
+                    self.provider.make_batch_request(chunk)  # type: ignore
+                    for chunk in chunks
+                )
+            )
+        except (ClientError, asyncio.TimeoutError) as e:
+            raise ConnectionError(f"RPC batch failed: {e}") from e
+        results: list[dict[str, Any]] = []
+        for response in responses:
+            # The whole batch failed
+            if not isinstance(response, list):
+                raise ConnectionError(f"RPC batch failed: {response.get('error')}")
+            results.extend(response)  # type: ignore
+        return results
+
+    async def receipts(self, tx_hashes: list[str]) -> list[dict[str, Any] | None]:
+        """
+        Receipts of transactions, fetched in one batch. None for those that aren't mined
+        yet.
+        """
+        responses = await self.batch(
+            [("eth_getTransactionReceipt", [tx_hash]) for tx_hash in tx_hashes]
+        )
+        return [_result(response) for response in responses]
+
+    async def unsigned_transactions(
+        self, calls: list[dict[str, Any]]
+    ) -> list[dict[str, Any] | str]:
+        """
+        Completes calls (from, to, value and optionally data) into unsigned
+        transactions, with their nonce, estimated gas, gas price and chain id fetched in
+        one batch. Calls from the same address get the same (pending) nonce: they're
+        alternatives, e.g. different amounts, not a sequence.
+        Returns, for each call, the transaction, or the RPC's error for it, e.g. if it
+        would revert.
+        """
+        senders = list(dict.fromkeys(call["from"] for call in calls))
+        requests: list[tuple[str, list]] = [("eth_gasPrice", [])]
+        if self._chain_id is None:
+            requests.append(("eth_chainId", []))
+        requests += [
+            ("eth_getTransactionCount", [sender, "pending"]) for sender in senders
+        ]
+        requests += [
+            ("eth_estimateGas", [{**call, "value": hex(call["value"])}])
+            for call in calls
+        ]
+        responses = await self.batch(requests)
+
+        self._gas_price = int(_result(responses.pop(0)), 16)
+        self._gas_price_fetched_at = time.monotonic()
+        if self._chain_id is None:
+            self._chain_id = int(_result(responses.pop(0)), 16)
+        nonces = {
+            sender: int(_result(response), 16)
+            for sender, response in zip(senders, responses)
+        }
+
+        transactions: list[dict[str, Any] | str] = []
+        for call, response in zip(calls, responses[len(senders) :]):
+            if "error" in response:
+                transactions.append(response["error"].get("message", "Unknown error"))
+                continue
+            transactions.append(
+                {
+                    **call,
+                    "gas": math.ceil(int(response["result"], 16) * GAS_ESTIMATE_MARGIN),
+                    "gasPrice": self._gas_price,
+                    "nonce": nonces[call["from"]],
+                    "chainId": self._chain_id,
+                }
+            )
+        return transactions
+
+    def contract(self, address: str, abi: list[dict]) -> AsyncContract:
+        """
+        Contract at address. A token's ABI never changes, so the first one seen for an
+        address is kept.
+        """
+        if address not in self._contracts:
+            self._contracts[address] = self.w3.eth.contract(
+                address=AsyncWeb3.to_checksum_address(address), abi=abi
+            )
+        return self._contracts[address]
+
+    def bonding_contract(self, address: str) -> AsyncContract:
+        if address not in self._contracts:
+            abi, bytecode = load_bonding_artifact()
+            self._contracts[address] = self.w3.eth.contract(  # type: ignore
+                address=address, abi=abi, bytecode=bytecode
+            )
+        return self._contracts[address]
+
+
+def _result(response: dict[str, Any]) -> Any:
+    if "error" in response:
+        raise ValueError(f"RPC error: {response['error'].get('message')}")
+    return response["result"]
+
+
+_rpc: SeiRpc | None = None
+
+
+async def get_rpc() -> SeiRpc:
+    """
+    The SeiRpc for the running event loop. aiohttp sessions are bound to the loop they
+    were created on, so a new loop (e.g. in a celery task, or a test) gets a new one.
+    """
+    global _rpc
+    loop = asyncio.get_running_loop()
+    if _rpc is None or _rpc.loop is not loop:
+        if not SEI_RPC_URL:
+            raise ValueError("Missing SEI_RPC_URL")
+        _rpc = SeiRpc(SEI_RPC_URL, loop)
+    rpc = _rpc
+    # Shielded, so that a cancelled caller doesn't cancel it for everyone else.
+    await asyncio.shield(rpc.ready)
+    return rpc
+
+
+async def close_rpc() -> None:
+    global _rpc
+    if _rpc is not None:
+        rpc, _rpc = _rpc, None
+        await rpc.session.close()
+
+
+async def pending_nonce(address: str) -> int:
+    rpc = await get_rpc()
+    return await rpc.transaction_count(address, "pending")
+
+
+# Nonces of the token deployer, so that many launches can be in flight at once.
+deployer_nonces = NonceManager(nonce_store_from_env(), pending_nonce)
+
+
+def deployer_env() -> tuple[str, str]:
+    """
+    Returns the token deployer's private key, and the bonding contract's address.
+    """
     PRIVATE_KEY = os.getenv("TOKEN_DEPLOYER_PRIVATE_KEY")
     BONDING_CONTRACT_ADDRESS = os.getenv("BONDING_CONTRACT_ADDRESS")
     if not SEI_RPC_URL or not PRIVATE_KEY or not BONDING_CONTRACT_ADDRESS:
         raise ValueError(
             "Missing SEI_RPC_URL, TOKEN_DEPLOYER_PRIVATE_KEY, or BONDING_CONTRACT_ADDRESS"
         )
-    # Initialize async provider
-    w3 = AsyncWeb3(AsyncHTTPProvider(SEI_RPC_URL))
+    return PRIVATE_KEY, BONDING_CONTRACT_ADDRESS
 
-    # Check connection
-    if not await w3.is_connected():
-        raise ConnectionError("Failed to connect to Sei Network")
 
-    # Load ABI and bytecode
-    with open(
-        "./src/launchpad-contracts/artifacts/contracts/Bonding.sol/Bonding.json", "r"
-    ) as f:
-        contract_json = json.load(f)
+def deployer_address() -> str:
+    return Account.from_key(deployer_env()[0]).address
+
 
-    contract_abi: list[dict] = contract_json["abi"]
-    contract_bytecode = contract_json["bytecode"]
+async def submit_launch(name, ticker) -> tuple[int, str]:
+    """
+    Sends the transaction that launches a new token through the bonding contract,
+    without waiting for it to be mined. See launched_token.
+    Returns the transaction's nonce and hash.
+    """
+    PRIVATE_KEY, BONDING_CONTRACT_ADDRESS = deployer_env()
+    rpc = await get_rpc()
+    w3 = rpc.w3
 
     # Initialize account
     account = Account.from_key(PRIVATE_KEY)
     deployer_address = account.address
 
-    # Deploy contract
-    bonding_contract = w3.eth.contract(  # type: ignore
-        address=BONDING_CONTRACT_ADDRESS,
-        abi=contract_abi,
-        bytecode=contract_bytecode,
-    )
+    bonding_contract = rpc.bonding_contract(BONDING_CONTRACT_ADDRESS)
 
-    nonce = await w3.eth.get_transaction_count(deployer_address)
-    gas_price = await w3.eth.gas_price
-    chain_id = await w3.eth.chain_id
-    # Build transaction with the given name and ticker
+    gas_price = await rpc.gas_price()
+    chain_id = await rpc.chain_id()
 
     launch_fee = await bonding_contract.functions.assetLaunchFee().call()
 
-    launch_token_with_sei_txn = await bonding_contract.functions.launchWithSei(
-        name,
-        ticker,
-    ).build_transaction(
-        {
-            "from": deployer_address,
-            "nonce": nonce,
-            "gas": 5000000,
-            "gasPrice": gas_price,
-            "chainId": chain_id,
-            "value": launch_fee,
-        }
-    )
+    async def send(nonce: int) -> str:
+        # Build transaction with the given name and ticker
+        launch_token_with_sei_txn = await bonding_contract.functions.launchWithSei(
+            name,
+            ticker,
+        ).build_transaction(
+            {
+                "from": deployer_address,
+                "nonce": Nonce(nonce),
+                "gas": 5000000,
+                "gasPrice": Wei(gas_price),
+                "chainId": chain_id,
+                "value": launch_fee,
+            }
+        )
 
-    # Sign and send launch transaction
-    signed_txn = w3.eth.account.sign_transaction(launch_token_with_sei_txn, PRIVATE_KEY)
-    tx_hash = await w3.eth.send_raw_transaction(signed_txn.raw_transaction)
+        # Sign and send launch transaction
+        signed_txn = w3.eth.account.sign_transaction(
+            launch_token_with_sei_txn, PRIVATE_KEY
+        )
+        tx_hash = await w3.eth.send_raw_transaction(signed_txn.raw_transaction)
+        return tx_hash.to_0x_hex()
 
-    # Wait for deployment receipt
-    receipt = await w3.eth.wait_for_transaction_receipt(tx_hash)
-    logs = receipt.get("logs")
-    abi = bonding_contract.events.Launched().abi
-    launched_topic_hash = event_abi_to_log_topic(abi)
-    launched_event_log = None
-    if not logs:
-        raise ValueError("No logs found in the transaction receipt")
-    for log in logs:
+    return await deployer_nonces.send(deployer_address, send)
+
+
+def launched_token(bonding_contract: AsyncContract, receipt: Mapping[str, Any]) -> str:
+    """
+    Returns the address of the token launched by a launch transaction, from its
+    receipt's Launched event.
+    """
+    launched = bonding_contract.events.Launched()
+    launched_topic_hash = event_abi_to_log_topic(launched.abi)
+    for log in receipt.get("logs") or []:
         topics = log.get("topics")
-        if topics and topics[0] == launched_topic_hash:
-            launched_event_log = log
-            break
+        if topics and HexBytes(topics[0]) == launched_topic_hash:
+            return launched.process_log(log).get("args").get("token")
+    raise ValueError("No Launched event found in the transaction receipt")
 
-    parsed_log = bonding_contract.events.Launched().process_log(launched_event_log)
-    token_address = parsed_log.get("args").get("token")
 
-    return token_address
+# Connects to SEI's EVM RPC and deploys a new instance of the token contract.
+async def deploy_token(name, ticker) -> str:
+    """
+    Launches a token, and waits for it to be mined. Returns the token's address.
+    """
+    nonce, tx_hash = await submit_launch(name, ticker)
+
+    # Wait for deployment receipt
+    rpc = await get_rpc()
+    try:
+        receipt = await rpc.w3.eth.wait_for_transaction_receipt(tx_hash)  # type: ignore
+    finally:
+        await deployer_nonces.confirm(deployer_address(), nonce)
+    return launched_token(rpc.bonding_contract(deployer_env()[1]), receipt)
 
 
 async def buy_token(buy_amount, contract_address):
-    w3 = AsyncWeb3(AsyncHTTPProvider(SEI_RPC_URL))
-    # Check connection
-    if not await w3.is_connected():
-        raise ConnectionError("Failed to connect to Sei Network")
+    rpc = await get_rpc()
+    w3 = rpc.w3
 
     # Initialize account
     PRIVATE_KEY = os.getenv("TOKEN_DEPLOYER_PRIVATE_KEY")
@@ -101,27 +362,83 @@ async def buy_token(buy_amount, contract_address):
     deployer_address = account.address
 
     # Prepare the transaction to buy tokens
-    nonce = await w3.eth.get_transaction_count(deployer_address)
-    gas_price = await w3.eth.gas_price
-    chain_id = await w3.eth.chain_id
+    gas_price = await rpc.gas_price()
+    chain_id = await rpc.chain_id()
+
+    async def send(nonce: int) -> str:
+        buy_txn = {
+            "to": contract_address,
+            "value": buy_amount,
+            "from": deployer_address,
+            "nonce": nonce,
+            "gas": 300000,
+            "gasPrice": gas_price,
+            "chainId": chain_id,
+        }
+
+        signed_buy_txn = w3.eth.account.sign_transaction(buy_txn, PRIVATE_KEY)
+        buy_tx_hash = await w3.eth.send_raw_transaction(signed_buy_txn.raw_transaction)
+        return buy_tx_hash.to_0x_hex()
+
+    nonce, buy_tx_hash = await deployer_nonces.send(deployer_address, send)
+    logger.info(f"[buy_token] Buy transaction sent: {buy_tx_hash}")
+
+    try:
+        buy_receipt = await w3.eth.wait_for_transaction_receipt(  # type: ignore
+            buy_tx_hash
+        )
+    finally:
+        await deployer_nonces.confirm(deployer_address, nonce)
+    logger.info(
+        "[buy_token] Tokens bought successfully in tx: "
+        f"{buy_receipt.transactionHash.hex()}"
+    )
+    return buy_receipt
+
+
+def buy_call(amount, contract_address, user_address) -> dict[str, Any]:
+    """
+    Call that buys tokens. See SeiRpc.unsigned_transactions.
 
-    buy_txn = {
+    amount: Amount of SEI to spend, in wei
+    """
+    return {"from": user_address, "to": contract_address, "value": amount}
+
+
+async def sell_call(
+    amount, contract_abi, contract_address, user_address
+) -> dict[str, Any]:
+    """
+    Call that sells tokens. See SeiRpc.unsigned_transactions.
+
+    amount: Amount of tokens to sell
+    """
+    rpc = await get_rpc()
+    contract = rpc.contract(contract_address, contract_abi)
+    return {
+        "from": user_address,
         "to": contract_address,
-        "value": buy_amount,
-        "from": deployer_address,
-        "nonce": nonce,
-        "gas": 300000,
-        "gasPrice": gas_price,
-        "chainId": chain_id,
+        "value": 0,  # Selling tokens, not sending SEI/eth
+        "data": contract.encode_abi("sellTokens", args=[amount]),
     }
 
-    signed_buy_txn = w3.eth.account.sign_transaction(buy_txn, PRIVATE_KEY)
-    buy_tx_hash = await w3.eth.send_raw_transaction(signed_buy_txn.raw_transaction)
-    print(f"Buy transaction sent: {buy_tx_hash.hex()}")
 
-    buy_receipt = await w3.eth.wait_for_transaction_receipt(buy_tx_hash)
-    print(f"Tokens bought successfully in tx: {buy_receipt.transactionHash.hex()}")
-    return buy_receipt
+async def unsigned_transactions(
+    calls: list[dict[str, Any]],
+) -> list[dict[str, Any] | str]:
+    """
+    Unsigned transactions for many calls, e.g. buys and sells of many users, in one
+    round trip. See SeiRpc.unsigned_transactions.
+    """
+    rpc = await get_rpc()
+    return await rpc.unsigned_transactions(calls)
+
+
+async def _unsigned_transaction(call: dict[str, Any]) -> dict[str, Any]:
+    (transaction,) = await unsigned_transactions([call])
+    if isinstance(transaction, str):
+        raise ValueError(f"Can't build transaction: {transaction}")
+    return transaction
 
 
 async def sell_token_unsigned(amount, contract_abi, contract_address, user_address):
@@ -134,29 +451,9 @@ async def sell_token_unsigned(amount, contract_abi, contract_address, user_addre
 
     user_address: Address of the user selling the tokens
     """
-    w3 = AsyncWeb3(AsyncHTTPProvider(SEI_RPC_URL))
-    if not await w3.is_connected():
-        raise ConnectionError("Failed to connect to Sei Network")
-
-    contract = w3.eth.contract(address=contract_address, abi=contract_abi)
-
-    nonce = await w3.eth.get_transaction_count(user_address)
-    gas_price = await w3.eth.gas_price
-    chain_id = await w3.eth.chain_id
-
-    sell_function_data = contract.encodeABI(fn_name="sellTokens", args=[amount])
-
-    unsigned_txn = {
-        "from": user_address,
-        "to": contract_address,
-        "value": 0,  # Selling tokens, not sending SEI/eth
-        "gas": 300000,
-        "gasPrice": gas_price,
-        "nonce": nonce,
-        "data": sell_function_data,
-        "chainId": chain_id,
-    }
-    return unsigned_txn
+    return await _unsigned_transaction(
+        await sell_call(amount, contract_abi, contract_address, user_address)
+    )
 
 
 async def buy_token_unsigned(amount, contract_address, user_address):
@@ -165,28 +462,8 @@ async def buy_token_unsigned(amount, contract_address, user_address):
 
     amount: Amount of tokens to buy
 
-    contract_abi: ABI of the token contract
-
     contract_address: Address of the token contract
 
     user_address: Address of the user buying the tokens
     """
-    w3 = AsyncWeb3(AsyncHTTPProvider(SEI_RPC_URL))
-    if not await w3.is_connected():
-        raise ConnectionError("Failed to connect to Sei Network")
-
-    nonce = await w3.eth.get_transaction_count(user_address)
-    gas_price = await w3.eth.gas_price
-    chain_id = await w3.eth.chain_id
-
-    unsigned_buy_txn = {
-        "to": contract_address,
-        "value": amount,  # Amount in SEI
-        "from": user_address,
-        "nonce": nonce,
-        "gas": 300000,
-        "gasPrice": gas_price,
-        "chainId": chain_id,
-    }
-
-    return unsigned_buy_txn
+    return await _unsigned_transaction(buy_call(amount, contract_address, user_address))
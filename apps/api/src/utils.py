@@ -1,6 +1,10 @@
-from fastapi import HTTPException
+from fastapi import HTTPException, Response
 
 from src.db.models import Base
+from src.db.pagination import Cursor
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
 
 def obj_or_404[T: Base](
     obj: T | None,
@@ -9,3 +13,21 @@ def obj_or_404[T: Base](
     if not obj:
         raise HTTPException(status_code=404, detail=f"{fallback_type.__name__} Not found")
     return obj
+
+
+def cursor_or_400(cursor: str | None) -> Cursor | None:
+    if cursor is None:
+        return None
+    try:
+        return Cursor.decode(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def set_next_cursor(response: Response, next_cursor: str | None) -> None:
+    """
+    Listings return plain lists, so the cursor for the next page travels in a header.
+    Absent on the last page.
+    """
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
@@ -341,6 +341,7 @@ async function pollAgent({
           )
           return
         case TaskStatus.PENDING:
+        case TaskStatus.RETRY:
         case TaskStatus.STARTED:
           pendingStartingCallback()
       }
@@ -7,9 +7,20 @@ import {
 } from "./common"
 import { Result, createSuccessResult, isErrorResult } from "./result"
 
+type RuntimeStep =
+  | 'CREATE_TARGET_GROUP'
+  | 'CREATE_LISTENER_RULES'
+  | 'CREATE_SERVICE'
+  | 'HEALTH_WAIT'
+  | 'STARTED'
+  | 'DELETE_SERVICE'
+  | 'SERVICE_DRAINING'
+  | 'DELETE_LISTENER_RULES'
+  | 'DELETE_TARGET_GROUP'
+
 interface RuntimeBase {
   url: string
-  started?: boolean
+  step?: RuntimeStep
 }
 
 interface Runtime extends RuntimeBase {
@@ -17,6 +17,7 @@ interface RuntimeUpdateTask {
 enum TaskStatus {
   FAILURE = "FAILURE",
   PENDING = "PENDING",
+  RETRY = "RETRY",
   STARTED = "STARTED",
   SUCCESS = "SUCCESS",
 }
@@ -0,0 +1,149 @@
+"""
+Benchmark of fetching tokenInfo for every token in a timeseries collection.
+Compares one eth_call per token, awaited in turn, with fetch_token_infos, which batches
+the calls into JSON-RPC batches fetched concurrently. Runs against a local stand-in for
+the SEI RPC, which adds --latency ms to every HTTP request, like the round trip to a
+remote node, and reports the time and HTTP requests each takes for --tokens tokens.
+
+Usage (from apps/market-data):
+  uv run python -m benchmarks.collect_timeseries
+  uv run python -m benchmarks.collect_timeseries --tokens 5000 --latency 50
+"""
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from eth_abi import encode
+from eth_account import Account
+from eth_utils.abi import get_abi_output_types
+from web3 import AsyncHTTPProvider, AsyncWeb3
+
+from src.token_info import fetch_token_infos
+
+BONDING_JSON_PATH = Path(__file__).resolve().parents[1] / "src/contracts/bonding.json"
+BONDING = Account.create().address
+
+
+class StandInRpc(ThreadingHTTPServer):
+    """
+    Answers eth_call with a tokenInfo for any token, in single requests and batches,
+    after sleeping for latency seconds per HTTP request.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, output_types: list[str], latency: float) -> None:
+        super().__init__(("127.0.0.1", 0), StandInRpcHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.token_info = (
+            "0x"
+            + encode(
+                output_types,
+                [
+                    BONDING,
+                    BONDING,
+                    BONDING,
+                    (BONDING, "Token", "Token", "TKN", *range(1, 9)),
+                    True,
+                    False,
+                ],
+            ).hex()
+        )
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host!s}:{port}"
+
+    def respond(self, request: dict) -> dict:
+        response = {"jsonrpc": "2.0", "id": request["id"]}
+        if request["method"] == "eth_call":
+            response["result"] = self.token_info
+        elif request["method"] == "eth_chainId":
+            response["result"] = hex(1329)
+        else:
+            response["error"] = {"code": -32601, "message": "method not found"}
+        return response
+
+
+class StandInRpcHandler(BaseHTTPRequestHandler):
+    server: StandInRpc
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.requests += 1
+        time.sleep(self.server.latency)
+        if isinstance(request, list):
+            response = [self.server.respond(item) for item in request]
+        else:
+            response = self.server.respond(request)
+        payload = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+async def sequential(w3: AsyncWeb3, contract, addresses: list[str]) -> list[tuple]:
+    return [
+        (await contract.functions.tokenInfo(address).call())[3] for address in addresses
+    ]
+
+
+async def batched(w3: AsyncWeb3, contract, addresses: list[str]) -> list[tuple]:
+    return await fetch_token_infos(w3, contract, addresses)  # type: ignore
+
+
+def main(args: argparse.Namespace) -> None:
+    with open(BONDING_JSON_PATH, "r") as f:
+        abi = json.load(f)["abi"]
+    token_info_abi = next(item for item in abi if item.get("name") == "tokenInfo")
+    server = StandInRpc(get_abi_output_types(token_info_abi), args.latency / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    addresses = [Account.create().address for _ in range(args.tokens)]
+
+    async def run(fetch) -> tuple[float, int, list[tuple]]:
+        w3 = AsyncWeb3(AsyncHTTPProvider(server.url))
+        contract = w3.eth.contract(address=BONDING, abi=abi)
+        requests = server.requests
+        start = time.perf_counter()
+        infos = await fetch(w3, contract, addresses)
+        elapsed = time.perf_counter() - start
+        await w3.provider.disconnect()
+        return elapsed, server.requests - requests, infos
+
+    results = {
+        "sequential": asyncio.run(run(sequential)),
+        "batched": asyncio.run(run(batched)),
+    }
+    # The fields collect_timeseries stores. Only the addresses are formatted
+    # differently.
+    assert [info[5:10] for info in results["sequential"][2]] == [
+        info[5:10] for info in results["batched"][2]
+    ]
+    server.shutdown()
+
+    print(f"{args.tokens} tokens, {args.latency} ms per request")
+    print(f"{'fetch':<12} {'time':>9}  (s) {'requests':>9}")
+    for name, (elapsed, requests, _) in results.items():
+        print(f"{name:<12} {elapsed:>9.3f}      {requests:>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=20)
+    main(parser.parse_args())
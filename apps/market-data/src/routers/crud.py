@@ -15,6 +15,7 @@ from src.db.models import (
     TokenTimeseriesBase,
 )
 from src.routers.utils import obj_or_404
+from src.token_info import fetch_token_infos
 
 router = APIRouter()
 
@@ -81,10 +82,16 @@ async def collect_timeseries():
             bytecode=bytecode,
         )
 
-        for token in crud.get_token_symbols(session):
-            token_info = (await contract.functions.tokenInfo(token.address).call())[3]
+        tokens = list(crud.get_token_symbols(session))
+        token_infos = await fetch_token_infos(
+            w3, contract, [token.address for token in tokens]
+        )
+        now = datetime.now()
+        for token, token_info in zip(tokens, token_infos):
+            if token_info is None:
+                continue
             timeseries = TokenTimeseries(
-                time=datetime.now(),
+                time=now,
                 ticker=token.ticker,
                 supply=token_info[5],
                 price=token_info[6],
@@ -0,0 +1,70 @@
+import asyncio
+import os
+
+from eth_utils.abi import get_abi_output_types
+from hexbytes import HexBytes
+from web3 import AsyncWeb3
+from web3.contract import AsyncContract
+from web3.types import RPCEndpoint
+
+from src import logger
+
+# tokenInfo calls per JSON-RPC batch, and batches in flight at once.
+# A collection of n tokens takes about n / TOKEN_INFO_BATCH_SIZE round trips,
+# TOKEN_INFO_CONCURRENCY at a time.
+TOKEN_INFO_BATCH_SIZE = int(os.getenv("TOKEN_INFO_BATCH_SIZE", 100))
+TOKEN_INFO_CONCURRENCY = int(os.getenv("TOKEN_INFO_CONCURRENCY", 4))
+
+
+async def fetch_token_infos(
+    w3: AsyncWeb3,
+    contract: AsyncContract,
+    addresses: list[str],
+) -> list[tuple | None]:
+    """
+    Calls the bonding contract's tokenInfo for each address, in JSON-RPC batches.
+    Returns the Data struct of each token, in order, or None where its call failed.
+    Unlike ContractFunction.call, addresses in it aren't checksummed.
+    Raises ConnectionError if a whole batch fails.
+    """
+    output_types = get_abi_output_types(contract.get_function_by_name("tokenInfo").abi)
+    semaphore = asyncio.Semaphore(TOKEN_INFO_CONCURRENCY)
+
+    async def fetch(chunk: list[str]) -> list[tuple | None]:
+        requests = [
+            (
+                RPCEndpoint("eth_call"),
+                [
+                    {
+                        "to": contract.address,
+                        "data": contract.encode_abi("tokenInfo", args=[address]),
+                    },
+                    "latest",
+                ],
+            )
+            for address in chunk
+        ]
+        async with semaphore:
+            responses = await w3.provider.make_batch_request(requests)
+        # A batch the node rejects as a whole gets a single error response.
+        if not isinstance(responses, list):
+            raise ConnectionError(f"tokenInfo batch failed: {responses.get('error')}")
+
+        infos: list[tuple | None] = []
+        for address, response in zip(chunk, responses):
+            if "error" in response:
+                logger.warning(f"tokenInfo({address}) failed: {response['error']}")
+                infos.append(None)
+                continue
+            infos.append(w3.codec.decode(output_types, HexBytes(response["result"]))[3])
+        return infos
+
+    chunks = [
+        addresses[i : i + TOKEN_INFO_BATCH_SIZE]
+        for i in range(0, len(addresses), TOKEN_INFO_BATCH_SIZE)
+    ]
+    return [
+        info
+        for infos in await asyncio.gather(*(fetch(chunk) for chunk in chunks))
+        for info in infos
+    ]